@@ -0,0 +1,248 @@
+"""Exact and semantic answer cache in front of the QA chain"""
+
+import asyncio
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+import numpy as np
+
+from agent.config import (
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_TTL,
+    DENSE_TIMEOUT,
+    RETRIEVAL_MODE,
+)
+from agent.filters import filters_key, query_scope
+from agent.retrieval import submit_embedding
+from agent.tracing import telemetry
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Case-, whitespace- and trailing-punctuation-insensitive cache key."""
+    return re.sub(r"\s+", " ", query).strip().lower().rstrip("?!. ")
+
+
+@dataclass
+class _Entry:
+    response: dict
+    vector: Optional[np.ndarray]
+    created: float
+    scope: Hashable = ()
+
+
+class AnswerCache:
+    """
+    Bounded LRU of chain responses for one index version.
+    Lookups try the normalized query first, then (when embeddings are given)
+    the most similar cached query by cosine similarity >= threshold.
+    Entries expire after ttl seconds; a new index version clears the cache.
+    scope (e.g. filters_key of the query's metadata filters) partitions the
+    cache: a query only matches entries cached with the same scope.
+    Query embeddings get embed_timeout seconds; if the call fails or times
+    out the lookup is exact-only. In lexical retrieval mode (no embedding
+    calls at all) the semantic lookup is off.
+    """
+
+    def __init__(self, embeddings=None, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 ttl: float = ANSWER_CACHE_TTL, max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 embed_timeout: float = DENSE_TIMEOUT, mode: str = RETRIEVAL_MODE):
+        self.embeddings = embeddings if mode != "lexical" else None
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.embed_timeout = embed_timeout
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, _Entry]" = OrderedDict()
+        self._version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _embed(self, query: str) -> Optional[np.ndarray]:
+        if self.embeddings is None:
+            return None
+        try:
+            embedding = submit_embedding(self.embeddings.embed_query, query).result(self.embed_timeout)
+        except Exception as e:  # including a timeout
+            logger.warning("Answer cache could not embed the query (%s); exact matches only", str(e) or type(e).__name__)
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self, version: Optional[str]) -> None:
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def get(self, query: str, version: Optional[str] = None,
+            scope: Hashable = ()) -> Tuple[Optional[dict], Optional[np.ndarray]]:
+        """Return (cached response or None, query vector if one was computed)."""
+        key = (scope, normalize_query(query))
+        now = time.time()
+        with self._lock:
+            self._check_version(version)
+            for k in [k for k, e in self._entries.items() if now - e.created > self.ttl]:
+                del self._entries[k]
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry.response, None
+            candidates = [(k, e.vector) for k, e in self._entries.items()
+                          if e.vector is not None and e.scope == scope]
+
+        vector = self._embed(query) if candidates else None
+        if vector is not None:
+            keys, matrix = zip(*candidates)
+            scores = np.stack(matrix) @ vector
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                with self._lock:
+                    entry = self._entries.get(keys[best])
+                    if entry is not None:
+                        self._entries.move_to_end(keys[best])
+                        self.semantic_hits += 1
+                        return entry.response, vector
+        with self._lock:
+            self.misses += 1
+        return None, vector
+
+    def put(self, query: str, response: dict, version: Optional[str] = None,
+            vector: Optional[np.ndarray] = None, scope: Hashable = ()) -> None:
+        if vector is None and self.threshold < 1.0:
+            vector = self._embed(query)
+        with self._lock:
+            self._check_version(version)
+            key = (scope, normalize_query(query))
+            self._entries[key] = _Entry(dict(response), vector, time.time(), scope)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            total = hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "hit_rate": hits / total if total else 0.0,
+            }
+
+
+class CachedQAChain:
+    """
+    Wraps a chain built by build_chain; invoke(), stream() and their async
+    forms answer from the cache when possible. index_version is called per
+    query so a re-indexed corpus invalidates stale answers. Responses carry
+    "cached": True/False.
+    """
+
+    def __init__(self, chain: Any, cache: AnswerCache,
+                 index_version: Callable[[], Optional[str]] = lambda: None):
+        self.chain = chain
+        self.cache = cache
+        self.index_version = index_version
+
+    @staticmethod
+    def _hit_timings(start: float) -> dict:
+        elapsed = time.perf_counter() - start
+        return {"retrieval": 0.0, "ttft": elapsed, "total": elapsed}
+
+    def _put(self, question: str, response: dict, version: Optional[str], vector: Optional[np.ndarray],
+             scope: Hashable) -> None:
+        """Cache a finished answer; a failure here must not lose the answer."""
+        try:
+            self.cache.put(question, response, version, vector, scope)
+        except Exception:
+            logger.exception("Could not cache the answer to %r", question)
+
+    @staticmethod
+    def _record_lookup(start: float, hit: bool) -> Optional[dict]:
+        """Trace a hit (returned) or add the lookup time of a miss to the stage summaries."""
+        elapsed = time.perf_counter() - start
+        if not hit:
+            telemetry.observe_stage("query", "cache_lookup", elapsed)
+            return None
+        trace = {"stages": {"cache_lookup": elapsed, "total": elapsed}, "counts": {}, "cached": True}
+        telemetry.record_query(trace)
+        return trace
+
+    def invoke(self, query, *args, **kwargs) -> dict:
+        start = time.perf_counter()
+        question, filters = query_scope(query)
+        scope = filters_key(filters)
+        version = self.index_version()
+        cached, vector = self.cache.get(question, version, scope)
+        trace = self._record_lookup(start, cached is not None)
+        if cached is not None:
+            return {**cached, "timings": self._hit_timings(start), "trace": trace, "cached": True}
+        response = self.chain.invoke(query, *args, **kwargs)
+        self._put(question, response, version, vector, scope)
+        return {**response, "cached": False}
+
+    async def ainvoke(self, query, *args, **kwargs) -> dict:
+        start = time.perf_counter()
+        question, filters = query_scope(query)
+        scope = filters_key(filters)
+        version = self.index_version()
+        # Lookups may embed the query; keep that off the event loop.
+        cached, vector = await asyncio.to_thread(self.cache.get, question, version, scope)
+        trace = self._record_lookup(start, cached is not None)
+        if cached is not None:
+            return {**cached, "timings": self._hit_timings(start), "trace": trace, "cached": True}
+        response = await self.chain.ainvoke(query, *args, **kwargs)
+        await asyncio.to_thread(self._put, question, response, version, vector, scope)
+        return {**response, "cached": False}
+
+    def stream(self, query, *args, **kwargs):
+        """Like the wrapped chain's stream(); a hit yields a single "done" event."""
+        start = time.perf_counter()
+        question, filters = query_scope(query)
+        scope = filters_key(filters)
+        version = self.index_version()
+        cached, vector = self.cache.get(question, version, scope)
+        trace = self._record_lookup(start, cached is not None)
+        if cached is not None:
+            yield {"type": "done", "result": cached["result"], "timings": self._hit_timings(start),
+                   "trace": trace, "cached": True}
+            return
+        for event in self.chain.stream(query, *args, **kwargs):
+            if event["type"] == "done":
+                self._put(question, {"query": question, "result": event["result"],
+                                     "timings": event["timings"]}, version, vector, scope)
+                event = {**event, "cached": False}
+            yield event
+
+    async def astream(self, query, *args, **kwargs):
+        """Async stream(): the lookup and the store run off the event loop."""
+        start = time.perf_counter()
+        question, filters = query_scope(query)
+        scope = filters_key(filters)
+        version = self.index_version()
+        cached, vector = await asyncio.to_thread(self.cache.get, question, version, scope)
+        trace = self._record_lookup(start, cached is not None)
+        if cached is not None:
+            yield {"type": "done", "result": cached["result"], "timings": self._hit_timings(start),
+                   "trace": trace, "cached": True}
+            return
+        async for event in self.chain.astream(query, *args, **kwargs):
+            if event["type"] == "done":
+                await asyncio.to_thread(self._put, question, {"query": question, "result": event["result"],
+                                                              "timings": event["timings"]}, version, vector, scope)
+                event = {**event, "cached": False}
+            yield event
+
+    def __getattr__(self, name):
+        return getattr(self.chain, name)
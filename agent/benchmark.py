@@ -0,0 +1,349 @@
+"""
+Offline benchmark for ingest, index build/load, retrieval and end-to-end QA.
+
+Generates synthetic PDF/DOCX/TXT corpora of several sizes and runs the real
+pipeline over them with the local embeddings and a fake LLM of configurable
+latency, so numbers are reproducible and cost nothing:
+    python -m agent.benchmark --sizes 20,100,500 --output bench.json
+    python -m agent.benchmark --baseline bench.json   # exit 1 on regressions
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import faiss
+import numpy as np
+
+from agent.chain import build_chain
+from agent.config import FAISS_INDEX_TYPE, RETRIEVAL_MODE
+from agent.embeddings import LocalEmbeddings
+from agent.fakes import FakeChatModel
+from agent.loader import load_documents
+from agent.service import QueryService
+from agent.vectorstore import open_current_index, sync_vectorstore
+
+_TERMS = (
+    "hypertension atrial fibrillation troponin NT-proBNP LDL-C HbA1c statin beta-blocker ACE-inhibitor "
+    "echocardiogram ejection fraction angina myocardial infarction stroke arrhythmia cholesterol "
+    "triglycerides diabetes obesity smoking anticoagulant warfarin heparin stent bypass valve aortic "
+    "stenosis regurgitation cardiomyopathy pericarditis endocarditis tachycardia bradycardia syncope "
+    "dyspnea edema claudication aneurysm thrombosis embolism biomarker risk score prevention"
+).split()
+_FILLER = (
+    "the patient study trial cohort results showed significant increase decrease in of with for and "
+    "was were risk factors outcomes follow-up years compared baseline treatment group associated "
+    "reduction mortality events clinical analysis data level levels higher lower among adults"
+).split()
+
+
+# ---------- Synthetic corpus ----------
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(_TERMS) if rng.random() < 0.3 else rng.choice(_FILLER)
+             for _ in range(rng.randint(8, 20))]
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraphs(rng: random.Random, words: int) -> List[str]:
+    paragraphs, count = [], 0
+    while count < words:
+        paragraph = " ".join(_sentence(rng) for _ in range(rng.randint(3, 6)))
+        paragraphs.append(paragraph)
+        count += len(paragraph.split())
+    return paragraphs
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, paragraphs: List[str], lines_per_page: int = 50, width: int = 90) -> None:
+    """Minimal single-font PDF (one text stream per page) that pypdf can extract."""
+    lines: List[str] = []
+    for paragraph in paragraphs:
+        line = ""
+        for word in paragraph.split():
+            if line and len(line) + len(word) + 1 > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}".strip()
+        lines.extend([line, ""])
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in pages:
+        text = " T* ".join(f"({_pdf_escape(line)}) Tj" for line in page)
+        stream = f"BT /F1 10 Tf 12 TL 50 780 Td {text} ET"
+        objects.append(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_docx(path: str, paragraphs: List[str], rng: random.Random) -> None:
+    from docx import Document as DocxDocument
+
+    document = DocxDocument()
+    for i, paragraph in enumerate(paragraphs):
+        if i % 3 == 0:
+            document.add_heading(" ".join(rng.sample(_TERMS, 3)).title(), level=1)
+        document.add_paragraph(paragraph)
+    document.save(path)
+
+
+def make_corpus(path: str, n_docs: int, words_per_doc: int = 800, seed: int = 0) -> List[str]:
+    """Write n_docs files (TXT, DOCX and PDF in turn) to path; returns their names."""
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    names = []
+    for i in range(n_docs):
+        paragraphs = _paragraphs(rng, words_per_doc)
+        kind = ("txt", "docx", "pdf")[i % 3]
+        name = f"doc{i:05d}.{kind}"
+        target = os.path.join(path, name)
+        if kind == "txt":
+            with open(target, "w", encoding="utf-8") as f:
+                f.write("\n\n".join(paragraphs))
+        elif kind == "docx":
+            write_docx(target, paragraphs, rng)
+        else:
+            write_pdf(target, paragraphs)
+        names.append(name)
+    return names
+
+
+def make_queries(n: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    return [f"What is known about {' and '.join(rng.sample(_TERMS, rng.randint(1, 3)))}?" for _ in range(n)]
+
+
+# ---------- Measurements ----------
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1000
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+
+def bench_ingest(docs_path: str) -> Dict[str, float]:
+    """Parse + chunk every file with load_documents."""
+    files = len(os.listdir(docs_path))
+    start = time.perf_counter()
+    chunks = load_documents(docs_path)
+    seconds = time.perf_counter() - start
+    return {"files": files, "chunks": len(chunks), "seconds": seconds,
+            "docs_per_s": files / seconds if seconds else 0.0,
+            "chunks_per_s": len(chunks) / seconds if seconds else 0.0}
+
+
+def bench_build(docs_path: str, persist_path: str, embeddings: Any) -> Dict[str, float]:
+    """Full index build (parse, chunk, dedup, embed, FAISS, persist) from scratch."""
+    start = time.perf_counter()
+    vectorstore, report = sync_vectorstore(docs_path, persist_path, embeddings)
+    return {"seconds": time.perf_counter() - start,
+            "vectors": vectorstore.index.ntotal if vectorstore is not None else 0,
+            "duplicates_collapsed": report.duplicates_collapsed}
+
+
+def bench_load(persist_path: str, embeddings: Any, repeat: int = 5) -> Dict[str, float]:
+    """Best-of-repeat time to open the published index, memory-mapped and read into memory."""
+    result = {}
+    for label, mmap in (("mmap_seconds", True), ("read_seconds", False)):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            open_current_index(persist_path, embeddings, mmap=mmap)
+            times.append(time.perf_counter() - start)
+        result[label] = min(times)
+    return result
+
+
+def bench_retrieval(retriever: Any, queries: Sequence[str]) -> Dict[str, float]:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        retriever.invoke(query)
+        latencies.append(time.perf_counter() - start)
+    return {"queries": len(queries), **_percentiles(latencies)}
+
+
+async def _bench_e2e(chain: Any, queries: Sequence[str], concurrency: int) -> Dict[str, float]:
+    service = QueryService(chain, max_concurrency=concurrency, max_pending=len(queries))
+    latencies = []
+
+    async def timed(query: str) -> None:
+        start = time.perf_counter()
+        await service.aquery(query)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(q) for q in queries))
+    elapsed = time.perf_counter() - start
+    return {"concurrency": concurrency, "queries": len(queries), "seconds": elapsed,
+            "qps": len(queries) / elapsed if elapsed else 0.0, **_percentiles(latencies)}
+
+
+def bench_e2e(chain: Any, queries: Sequence[str], concurrency: int) -> Dict[str, float]:
+    """Latency (including queueing) and throughput of the QA chain under concurrency."""
+    return asyncio.run(_bench_e2e(chain, queries, concurrency))
+
+
+def run_benchmark(sizes: Sequence[int], words_per_doc: int = 800, n_queries: int = 50,
+                  concurrency: Sequence[int] = (1, 4, 16), llm_latency: float = 0.2,
+                  token_delay: float = 0.0, dim: int = 256, workdir: Optional[str] = None,
+                  seed: int = 0) -> Dict[str, Any]:
+    """One run per corpus size; returns the JSON-serializable results."""
+    root = workdir or tempfile.mkdtemp(prefix="bench-")
+    embeddings = LocalEmbeddings(dim)
+    queries = make_queries(n_queries, seed + 1)
+    results: Dict[str, Any] = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "faiss": faiss.__version__,
+            "cpu_count": os.cpu_count(),
+            "index_type": FAISS_INDEX_TYPE,
+            "retrieval_mode": RETRIEVAL_MODE,
+            "words_per_doc": words_per_doc,
+            "llm_latency": llm_latency,
+            "token_delay": token_delay,
+            "embedding_dim": dim,
+        },
+        "runs": [],
+    }
+    try:
+        for size in sizes:
+            docs_path = os.path.join(root, f"docs-{size}")
+            persist_path = os.path.join(root, f"index-{size}")
+            make_corpus(docs_path, size, words_per_doc, seed)
+            run: Dict[str, Any] = {"size": size, "ingest": bench_ingest(docs_path),
+                                   "build": bench_build(docs_path, persist_path, embeddings),
+                                   "load": bench_load(persist_path, embeddings)}
+            _, vectorstore, lexical = open_current_index(persist_path, embeddings)
+            llm = FakeChatModel(latency=llm_latency, token_delay=token_delay)
+            chain = build_chain(vectorstore, llm=llm, lexical_index=lexical)
+            run["retrieval"] = bench_retrieval(chain.retriever, queries)
+            run["e2e"] = [bench_e2e(chain, queries, c) for c in concurrency]
+            results["runs"].append(run)
+            print(f"size={size}: {json.dumps(run)}", file=sys.stderr)
+    finally:
+        if workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+# ---------- Regression check ----------
+
+def _metrics(run: Dict[str, Any]) -> Dict[str, float]:
+    """Flatten a run to {name: value} for the metrics worth comparing."""
+    metrics = {
+        "ingest.docs_per_s": run["ingest"]["docs_per_s"],
+        "build.seconds": run["build"]["seconds"],
+        "load.mmap_seconds": run["load"]["mmap_seconds"],
+        "load.read_seconds": run["load"]["read_seconds"],
+    }
+    for q in ("p50_ms", "p95_ms", "p99_ms"):
+        metrics[f"retrieval.{q}"] = run["retrieval"][q]
+    for e2e in run["e2e"]:
+        prefix = f"e2e.c{e2e['concurrency']}"
+        metrics[f"{prefix}.qps"] = e2e["qps"]
+        metrics[f"{prefix}.p95_ms"] = e2e["p95_ms"]
+    return metrics
+
+
+def _slowdown_ms(name: str, old: float, value: float) -> float:
+    """How much slower value is than old, in ms (per item for rates)."""
+    if name.endswith(("per_s", "qps")):
+        return 1000.0 / value - 1000.0 / old if value > 0 else float("inf")
+    if name.endswith("seconds"):
+        return (value - old) * 1000.0
+    return value - old
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float = 0.2,
+            min_delta_ms: float = 1.0) -> List[str]:
+    """
+    Metrics that got worse than baseline by more than tolerance (relative)
+    and by at least min_delta_ms (absolute; per doc or query for rates), for
+    corpus sizes present in both. Rates (per_s, qps) regress when they drop;
+    times regress when they grow. The floor keeps sub-millisecond timings,
+    where run-to-run noise is easily 20%, from failing the check.
+    """
+    previous = {run["size"]: _metrics(run) for run in baseline.get("runs", [])}
+    regressions = []
+    for run in current.get("runs", []):
+        before = previous.get(run["size"])
+        if before is None:
+            continue
+        for name, value in _metrics(run).items():
+            old = before.get(name)
+            if not old:
+                continue
+            higher_is_better = name.endswith(("per_s", "qps"))
+            change = (old - value) / old if higher_is_better else (value - old) / old
+            if change > tolerance and _slowdown_ms(name, old, value) >= min_delta_ms:
+                regressions.append(f"size={run['size']} {name}: {old:.4g} -> {value:.4g} ({change:+.0%} worse)")
+    return regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="20,100", help="comma-separated corpus sizes (files)")
+    parser.add_argument("--words", type=int, default=800, help="words per synthetic document")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="fake LLM seconds to first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="fake LLM seconds between tokens")
+    parser.add_argument("--dim", type=int, default=256, help="local embedding dimension")
+    parser.add_argument("--workdir", help="keep corpora and indexes here instead of a temp dir")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="ignore slowdowns smaller than this many ms (per doc/query for rates)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark([int(s) for s in args.sizes.split(",")], args.words, args.queries,
+                            [int(c) for c in args.concurrency.split(",")], args.llm_latency,
+                            args.token_delay, args.dim, args.workdir)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(json.load(f), results, args.tolerance, args.min_delta_ms)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,30 @@
 # agent/chain.py
-from typing import Any
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional, Union
+
+from langchain_core.documents import Document
+from langchain_core.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
 
-from agent.config import get_openai_api_key, OPENAI_MODEL, OPENAI_TEMPERATURE
+from agent.chunking import count_tokens
+from agent.config import (
+    CONTEXT_CANDIDATES,
+    CONTEXT_TOKEN_BUDGET,
+    OPENAI_MODEL,
+    OPENAI_TEMPERATURE,
+    RETRIEVAL_FETCH_K,
+    RETRIEVAL_K,
+    get_openai_api_key,
+)
+from agent.context import ContextBuilder
+from agent.filters import Filters, format_filters, query_scope
+from agent.lexical import BM25Index
+from agent.retrieval import HybridRetriever
+from agent.tracing import StageTimer, stage, telemetry
 
+logger = logging.getLogger(__name__)
 
 CARDIO_PROMPT = """You are MedAnalytica Pro, a careful cardiovascular AI assistant.
 Use ONLY the provided context to answer the user's question.
@@ -23,32 +42,203 @@ Question:
 Answer:"""
 
 
-def build_chain(vectorstore: Any):
+class RetrievalQAChain:
     """
-    Build a RetrievalQA chain over the provided vectorstore.
-    vectorstore must implement .as_retriever().
+    Retrieve-then-"stuff" QA over a retriever.
+    invoke() returns {"query", "result"} like RetrievalQA; stream() yields
+    events as they happen:
+      {"type": "retrieval", "documents": [...], "seconds": float}
+      {"type": "token", "text": str}            (one per LLM chunk)
+      {"type": "done", "result": str, "timings": {"retrieval", "ttft", "total"}, "trace": {...}}
+    ttft is time to first token, measured from the start of the query; the
+    trace (agent.tracing) breaks the query down by stage and counts tokens.
+    A query is a question string, which may carry inline metadata filters,
+    or {"query": question, "filter": {...}} (see agent.filters); filters
+    scope retrieval when the retriever is a HybridRetriever. If they match
+    no passages the LLM is not called: the result says so and the "done"
+    event carries "no_match": True.
     """
-    api_key = get_openai_api_key()  # Raises a helpful error if missing
 
-    llm = ChatOpenAI(
-        api_key=api_key,
-        model=OPENAI_MODEL,
-        temperature=OPENAI_TEMPERATURE,
-    )
+    def __init__(self, llm: Any, retriever: Any, prompt: PromptTemplate,
+                 context_builder: Optional[ContextBuilder] = None):
+        self.llm = llm
+        self.retriever = retriever
+        self.prompt = prompt
+        self.context_builder = context_builder
+
+    @staticmethod
+    def _question(query: Union[str, dict]) -> str:
+        return query_scope(query)[0]
+
+    def _search_kwargs(self, filters: Filters) -> dict:
+        if not filters:
+            return {}
+        if not isinstance(self.retriever, HybridRetriever):
+            logger.warning("Retriever %s cannot filter by metadata; searching everything",
+                           type(self.retriever).__name__)
+            return {}
+        return {"filter": filters}
+
+    @staticmethod
+    def _no_match(filters: Filters, timer: StageTimer, start: float) -> dict:
+        """The "done" event for filters that matched nothing."""
+        total = time.perf_counter() - start
+        result = (f"No passages in the uploaded documents match the filter {format_filters(filters)}. "
+                  "Check the document name or other filter values, or search all documents.")
+        trace = {"stages": {**timer.stages, "total": total}, "counts": dict(timer.counts),
+                 "tokens_estimated": False, "cached": False}
+        telemetry.record_query(trace)
+        return {"type": "done", "result": result, "no_match": True,
+                "timings": {"retrieval": total, "ttft": total, "total": total}, "trace": trace}
+
+    def format_prompt(self, question: str, docs: List[Document]) -> str:
+        context = "\n\n".join(doc.page_content for doc in docs)
+        return self.prompt.format(context=context, question=question)
+
+    def _pack(self, question: str, docs: List[Document], timer: StageTimer) -> List[Document]:
+        """Narrow the retrieved candidates to the context_builder's token budget."""
+        if self.context_builder is None:
+            return docs
+        # A HybridRetriever reports its query embedding; without one (lexical
+        # mode, dense search failed) packing must not call the embedder either.
+        hybrid = isinstance(self.retriever, HybridRetriever)
+        with stage(timer.stages, "context_packing"):
+            docs, packing = self.context_builder.build(question, docs, query_vector=timer.query_vector,
+                                                       embed_query=not hybrid)
+        timer.counts.update(context_tokens=packing["context_tokens"], tokens_saved=packing["tokens_saved"])
+        return docs
+
+    @staticmethod
+    def _trace(timer: StageTimer, prompt: str, result: str, total: float) -> dict:
+        """The query's trace, recorded in telemetry; token counts are estimated if the LLM reported none."""
+        counts = dict(timer.counts)
+        estimated = not counts["prompt_tokens"]
+        if estimated:
+            counts["prompt_tokens"], counts["completion_tokens"] = count_tokens(prompt), count_tokens(result)
+        trace = {"stages": {**timer.stages, "total": total}, "counts": counts,
+                 "tokens_estimated": estimated, "cached": False}
+        telemetry.record_query(trace)
+        return trace
+
+    def stream(self, query: Union[str, dict]) -> Iterator[dict]:
+        question, filters = query_scope(query)
+        timer = StageTimer()
+        config = {"callbacks": [timer]}
+        start = time.perf_counter()
+        docs = self.retriever.invoke(question, config=config, **self._search_kwargs(filters))
+        docs = self._pack(question, docs, timer)
+        retrieved = time.perf_counter()
+        yield {"type": "retrieval", "documents": docs, "seconds": retrieved - start}
+        if filters and not docs:
+            yield self._no_match(filters, timer, start)
+            return
+
+        with stage(timer.stages, "prompt"):
+            prompt = self.format_prompt(question, docs)
+        parts, ttft = [], None
+        for chunk in self.llm.stream(prompt, config=config):
+            text = getattr(chunk, "content", chunk)
+            if not text:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            parts.append(text)
+            yield {"type": "token", "text": text}
+
+        total = time.perf_counter() - start
+        result = "".join(parts)
+        yield {
+            "type": "done",
+            "result": result,
+            "timings": {"retrieval": retrieved - start, "ttft": ttft if ttft is not None else total, "total": total},
+            "trace": self._trace(timer, prompt, result, total),
+        }
 
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 4})
+    async def astream(self, query: Union[str, dict]) -> AsyncIterator[dict]:
+        """Async counterpart of stream() with the same events."""
+        question, filters = query_scope(query)
+        timer = StageTimer()
+        config = {"callbacks": [timer]}
+        start = time.perf_counter()
+        docs = await self.retriever.ainvoke(question, config=config, **self._search_kwargs(filters))
+        docs = await asyncio.to_thread(self._pack, question, docs, timer)  # may embed; keep the loop free
+        retrieved = time.perf_counter()
+        yield {"type": "retrieval", "documents": docs, "seconds": retrieved - start}
+        if filters and not docs:
+            yield self._no_match(filters, timer, start)
+            return
+
+        with stage(timer.stages, "prompt"):
+            prompt = self.format_prompt(question, docs)
+        parts, ttft = [], None
+        async for chunk in self.llm.astream(prompt, config=config):
+            text = getattr(chunk, "content", chunk)
+            if not text:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            parts.append(text)
+            yield {"type": "token", "text": text}
+
+        total = time.perf_counter() - start
+        result = "".join(parts)
+        yield {
+            "type": "done",
+            "result": result,
+            "timings": {"retrieval": retrieved - start, "ttft": ttft if ttft is not None else total, "total": total},
+            "trace": self._trace(timer, prompt, result, total),
+        }
+
+    def invoke(self, query: Union[str, dict], *args, **kwargs) -> dict:
+        for event in self.stream(query):
+            if event["type"] == "done":
+                return {"query": self._question(query), "result": event["result"],
+                        "timings": event["timings"], "trace": event["trace"],
+                        **({"no_match": True} if event.get("no_match") else {})}
+        raise RuntimeError("stream ended without a result")
+
+    async def ainvoke(self, query: Union[str, dict], *args, **kwargs) -> dict:
+        async for event in self.astream(query):
+            if event["type"] == "done":
+                return {"query": self._question(query), "result": event["result"],
+                        "timings": event["timings"], "trace": event["trace"],
+                        **({"no_match": True} if event.get("no_match") else {})}
+        raise RuntimeError("stream ended without a result")
+
+
+def build_chain(vectorstore: Any, llm: Optional[Any] = None, lexical_index: Optional[BM25Index] = None,
+                context_budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Build a retrieval QA chain over the provided vectorstore.
+    With a lexical_index (see load_lexical_index) retrieval is hybrid BM25 +
+    vector search (HybridRetriever); otherwise vectorstore.as_retriever().
+    CONTEXT_CANDIDATES passages are retrieved and packed into context_budget
+    tokens by a ContextBuilder; context_budget=0 stuffs the top RETRIEVAL_K.
+    llm defaults to ChatOpenAI; pass any LangChain chat model
+    (e.g. agent.fakes.FakeChatModel) to override.
+    """
+    if llm is None:
+        api_key = get_openai_api_key()  # Raises a helpful error if missing
+        llm = ChatOpenAI(
+            api_key=api_key,
+            model=OPENAI_MODEL,
+            temperature=OPENAI_TEMPERATURE,
+            streaming=True,
+            stream_usage=True,  # token counts for tracing
+        )
+
+    k = CONTEXT_CANDIDATES if context_budget else RETRIEVAL_K
+    if lexical_index is not None:
+        retriever = HybridRetriever(vectorstore=vectorstore, lexical=lexical_index, k=k,
+                                    fetch_k=max(RETRIEVAL_FETCH_K, k))
+    else:
+        retriever = vectorstore.as_retriever(search_kwargs={"k": k})
+    context_builder = (ContextBuilder(vectorstore.embedding_function, context_budget, vectorstore=vectorstore)
+                       if context_budget else None)
 
     prompt = PromptTemplate(
         template=CARDIO_PROMPT,
         input_variables=["context", "question"],
     )
 
-    chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        retriever=retriever,
-        chain_type="stuff",
-        chain_type_kwargs={"prompt": prompt},
-        return_source_documents=False,
-    )
-
-    return chain
\ No newline at end of file
+    return RetrievalQAChain(llm=llm, retriever=retriever, prompt=prompt, context_builder=context_builder)
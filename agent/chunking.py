@@ -0,0 +1,127 @@
+"""Token-aware chunking of loaded documents"""
+
+import re
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Tuple
+
+from agent.config import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, TIKTOKEN_ENCODING, TIKTOKEN_LOAD_RETRIES
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+_APPROX_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+# Finer and finer units used to break up text that is over the token budget:
+# lines (docx paragraphs / PDF text lines), then sentences, then words.
+_SPLITTERS = (
+    re.compile(r"[^\n]+\n*"),
+    re.compile(r"[^.!?;]+(?:[.!?;]+|$)\s*"),
+    re.compile(r"\S+\s*"),
+)
+
+
+APPROX_ENCODING = "approx"
+
+
+class TokenizerUnavailableError(RuntimeError):
+    """A tiktoken encoding could not be loaded."""
+
+
+@lru_cache(maxsize=None)
+def get_encoding(name: str = TIKTOKEN_ENCODING):
+    """
+    The tiktoken encoding called name, or None for APPROX_ENCODING (a regex
+    approximation that needs neither tiktoken nor its BPE download).
+    Loading is retried TIKTOKEN_LOAD_RETRIES times before raising
+    TokenizerUnavailableError; failures are not cached, so the next call
+    tries again. There is no silent fallback: the encoding is part of the
+    index settings, and a different one would re-chunk the whole corpus.
+    """
+    if name == APPROX_ENCODING:
+        return None
+    for attempt in range(TIKTOKEN_LOAD_RETRIES + 1):
+        try:
+            import tiktoken
+            return tiktoken.get_encoding(name)
+        except Exception as e:  # tiktoken downloads its BPE files on first use
+            error = e
+            if attempt < TIKTOKEN_LOAD_RETRIES and not isinstance(e, ImportError):
+                time.sleep(0.5 * 2 ** attempt)
+                continue
+            break
+    raise TokenizerUnavailableError(
+        f"tiktoken encoding {name!r} unavailable ({error}); "
+        f"set TIKTOKEN_ENCODING={APPROX_ENCODING} to count tokens approximately") from error
+
+
+def count_tokens(text: str, encoding: str = TIKTOKEN_ENCODING) -> int:
+    """Number of tokens in text under encoding (see get_encoding)."""
+    enc = get_encoding(encoding)
+    if enc is None:
+        return len(_APPROX_TOKEN_RE.findall(text))
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def _spans(text: str, start: int, end: int, max_tokens: int, encoding: str,
+           level: int = 0) -> List[Tuple[int, int, int]]:
+    """(start, end, tokens) units covering text[start:end], each within max_tokens where possible."""
+    out = []
+    for m in _SPLITTERS[level].finditer(text, start, end):
+        n = count_tokens(m.group(), encoding)
+        if n > max_tokens and level + 1 < len(_SPLITTERS):
+            out.extend(_spans(text, m.start(), m.end(), max_tokens, encoding, level + 1))
+        else:
+            out.append((m.start(), m.end(), n))
+    return out
+
+
+def split_text(text: str, chunk_tokens: int = CHUNK_TOKENS,
+               overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+               encoding: str = TIKTOKEN_ENCODING) -> List[Tuple[int, int, int]]:
+    """
+    Split text into (start, end, tokens) chunks of at most chunk_tokens,
+    breaking on line, then sentence, then word boundaries. Consecutive
+    chunks share up to overlap_tokens of trailing units.
+    """
+    spans = [s for s in _spans(text, 0, len(text), chunk_tokens, encoding) if text[s[0]:s[1]].strip()]
+    chunks = []
+    i = 0
+    while i < len(spans):
+        j, total = i, 0
+        while j < len(spans) and (j == i or total + spans[j][2] <= chunk_tokens):
+            total += spans[j][2]
+            j += 1
+        chunks.append((spans[i][0], spans[j - 1][1], total))
+        if j >= len(spans):
+            break
+        # Step back over trailing units for the overlap, always moving forward.
+        k, back = j, 0
+        while k - 1 > i and back + spans[k - 1][2] <= overlap_tokens:
+            k -= 1
+            back += spans[k][2]
+        i = k
+    return chunks
+
+
+def chunk_documents(docs: List["Document"], chunk_tokens: int = CHUNK_TOKENS,
+                    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                    encoding: str = TIKTOKEN_ENCODING) -> List["Document"]:
+    """
+    Split each loaded unit (PDF page, docx section, text file) into chunks.
+    Chunks never cross units, so page/section metadata stays exact; each
+    chunk adds its index, character offsets within the unit and token count.
+    """
+    from langchain_core.documents import Document
+
+    out = []
+    for doc in docs:
+        text = doc.page_content
+        for n, (start, end, tokens) in enumerate(split_text(text, chunk_tokens, overlap_tokens, encoding)):
+            segment = text[start:end]
+            start += len(segment) - len(segment.lstrip())
+            segment = segment.strip()
+            metadata = dict(doc.metadata)
+            metadata.update(chunk=n, start_index=start, end_index=start + len(segment), tokens=tokens)
+            out.append(Document(page_content=segment, metadata=metadata))
+    return out
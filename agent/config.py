@@ -2,13 +2,24 @@
 import os
 from typing import Optional
 
-try:
-    # Optional: load from .env if python-dotenv is installed
-    from dotenv import load_dotenv  # type: ignore
-    load_dotenv()
-except Exception:
-    # It's okay if dotenv isn't installed
-    pass
+
+def _load_dotenv() -> None:
+    """Load .env (from the working directory or the project root) if there is one."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    paths = [os.path.join(d, ".env") for d in (os.getcwd(), root)]
+    path = next((p for p in paths if os.path.isfile(p)), None)
+    if path is None:
+        return  # nothing to load, so skip importing python-dotenv
+    try:
+        # Optional: load from .env if python-dotenv is installed
+        from dotenv import load_dotenv  # type: ignore
+        load_dotenv(path)
+    except Exception:
+        # It's okay if dotenv isn't installed
+        pass
+
+
+_load_dotenv()
 
 
 def get_env(key: str, default: Optional[str] = None) -> Optional[str]:
@@ -34,3 +45,95 @@ OPENAI_API_KEY = get_openai_api_key(raise_if_missing=False)
 # Optional common config values
 OPENAI_MODEL = get_env("OPENAI_MODEL", "gpt-4o-mini")
 OPENAI_TEMPERATURE = float(get_env("OPENAI_TEMPERATURE", "0.2") or 0.2)
+
+# Ingestion: parser processes (0 = os.cpu_count()) and how many parsed files
+# may be waiting for embedding at once.
+LOADER_WORKERS = int(get_env("LOADER_WORKERS", "0") or 0)
+LOADER_MAX_PENDING = int(get_env("LOADER_MAX_PENDING", "4") or 4)
+EMBED_BATCH_SIZE = int(get_env("EMBED_BATCH_SIZE", "64") or 64)
+
+# Chunking: target/overlap sizes in tokens of TIKTOKEN_ENCODING, a tiktoken
+# encoding or "approx" (a regex approximation for hosts that cannot download
+# tiktoken's BPE files). Changing it rebuilds the index; an encoding that
+# fails to load after TIKTOKEN_LOAD_RETRIES retries is an error.
+CHUNK_TOKENS = int(get_env("CHUNK_TOKENS", "350") or 350)
+CHUNK_OVERLAP_TOKENS = int(get_env("CHUNK_OVERLAP_TOKENS", "50") or 50)
+TIKTOKEN_ENCODING = get_env("TIKTOKEN_ENCODING", "cl100k_base") or "cl100k_base"
+TIKTOKEN_LOAD_RETRIES = int(get_env("TIKTOKEN_LOAD_RETRIES", "2") or 0)
+
+# Embedding cache (SQLite, stored next to the index); LRU-evicted past this many vectors.
+EMBEDDING_CACHE_MAX_ENTRIES = int(get_env("EMBEDDING_CACHE_MAX_ENTRIES", "200000") or 200000)
+
+# Near-duplicate chunks (estimated Jaccard >= threshold) share one vector.
+DEDUP_THRESHOLD = float(get_env("DEDUP_THRESHOLD", "0.85") or 0.85)
+
+# Answer cache: cosine similarity for a semantic hit, entry TTL (seconds), max entries.
+ANSWER_CACHE_THRESHOLD = float(get_env("ANSWER_CACHE_THRESHOLD", "0.95") or 0.95)
+ANSWER_CACHE_TTL = float(get_env("ANSWER_CACHE_TTL", "3600") or 3600)
+ANSWER_CACHE_MAX_ENTRIES = int(get_env("ANSWER_CACHE_MAX_ENTRIES", "512") or 512)
+
+# Headless query service: concurrent chain calls, admitted (running + waiting)
+# queries, and seconds a query may wait for admission before it is rejected
+# as overloaded (0 waits forever).
+SERVICE_MAX_CONCURRENCY = int(get_env("SERVICE_MAX_CONCURRENCY", "8") or 8)
+SERVICE_MAX_PENDING = int(get_env("SERVICE_MAX_PENDING", "64") or 64)
+SERVICE_ADMISSION_TIMEOUT = float(get_env("SERVICE_ADMISSION_TIMEOUT", "10") or 0)
+
+# Retrieval: "hybrid" (BM25 + vector, fused by reciprocal rank), "dense" or "lexical".
+RETRIEVAL_MODE = get_env("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_K = int(get_env("RETRIEVAL_K", "4") or 4)
+RETRIEVAL_FETCH_K = int(get_env("RETRIEVAL_FETCH_K", "20") or 20)
+# Seconds to wait for the query embedding before answering from BM25 alone.
+DENSE_TIMEOUT = float(get_env("DENSE_TIMEOUT", "3") or 3)
+# Metadata-filtered queries: partitions up to PARTITION_EXACT_MAX chunks get an
+# exact in-memory sub-index; the PARTITION_CACHE_SIZE most recent are kept.
+PARTITION_EXACT_MAX = int(get_env("PARTITION_EXACT_MAX", "2048") or 2048)
+PARTITION_CACHE_SIZE = int(get_env("PARTITION_CACHE_SIZE", "16") or 16)
+
+# FAISS index type: flat | hnsw | ivf | ivfpq | sq8 | ivfsq8 (trained automatically on build).
+FAISS_INDEX_TYPE = (get_env("FAISS_INDEX_TYPE", "flat") or "flat").lower()
+HNSW_M = int(get_env("HNSW_M", "32") or 32)
+HNSW_EF_CONSTRUCTION = int(get_env("HNSW_EF_CONSTRUCTION", "80") or 80)
+HNSW_EF_SEARCH = int(get_env("HNSW_EF_SEARCH", "64") or 64)
+IVF_NLIST = int(get_env("IVF_NLIST", "0") or 0)  # 0 = about 4 * sqrt(vectors)
+IVF_NPROBE = int(get_env("IVF_NPROBE", "8") or 8)
+PQ_M = int(get_env("PQ_M", "16") or 16)
+PQ_NBITS = int(get_env("PQ_NBITS", "8") or 8)
+
+# Versioned index directories: versions kept on disk, how often (seconds) a
+# running process checks for a newly published one, and whether to open
+# the FAISS index memory-mapped so processes on a host share its pages.
+INDEX_KEEP_VERSIONS = int(get_env("INDEX_KEEP_VERSIONS", "3") or 3)
+INDEX_POLL_SECONDS = float(get_env("INDEX_POLL_SECONDS", "5") or 5)
+FAISS_MMAP = (get_env("FAISS_MMAP", "1") or "1") not in ("0", "false", "no")
+
+# Tracing: JSONL file for per-query/per-ingest traces (off unless set), the
+# size at which it is rotated to <file>.1 (0 = never) and the port for
+# Prometheus /metrics (0 disables).
+TRACE_FILE = get_env("TRACE_FILE", "") or ""
+TRACE_MAX_BYTES = int(get_env("TRACE_MAX_BYTES", str(10 << 20)) or 0)
+METRICS_PORT = int(get_env("METRICS_PORT", "0") or 0)
+
+# Context packing: candidates fetched per query, then MMR-ordered (1 = pure
+# relevance, 0 = pure diversity) and packed into this many prompt tokens.
+CONTEXT_CANDIDATES = int(get_env("CONTEXT_CANDIDATES", "12") or 12)
+CONTEXT_TOKEN_BUDGET = int(get_env("CONTEXT_TOKEN_BUDGET", "1500") or 1500)
+MMR_LAMBDA = float(get_env("MMR_LAMBDA", "0.7") or 0.7)
+
+# Embedding backend: "openai" or "local" (CPU-only NumPy hashing, no network).
+# EMBEDDING_DIM 0 = the model's default size (384 for local).
+EMBEDDING_BACKEND = (get_env("EMBEDDING_BACKEND", "openai") or "openai").lower()
+EMBEDDING_MODEL = get_env("EMBEDDING_MODEL", "text-embedding-ada-002")
+EMBEDDING_DIM = int(get_env("EMBEDDING_DIM", "0") or 0)
+# Remote embedding calls: parallel requests, batch limits (EMBED_BATCH_SIZE is
+# the starting batch size, adapted on rate limits) and retries.
+EMBED_CONCURRENCY = int(get_env("EMBED_CONCURRENCY", "4") or 4)
+EMBED_MAX_BATCH_SIZE = int(get_env("EMBED_MAX_BATCH_SIZE", "512") or 512)
+EMBED_MAX_BATCH_TOKENS = int(get_env("EMBED_MAX_BATCH_TOKENS", "200000") or 200000)
+EMBED_MAX_RETRIES = int(get_env("EMBED_MAX_RETRIES", "6") or 6)
+
+# Chat sessions: SQLite file, messages rendered per window ("load older" adds
+# another window) and sessions listed per sidebar page.
+SESSION_DB = get_env("SESSION_DB", "data/sessions.sqlite")
+CHAT_WINDOW = int(get_env("CHAT_WINDOW", "20") or 20)
+SESSION_PAGE_SIZE = int(get_env("SESSION_PAGE_SIZE", "10") or 10)
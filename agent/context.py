@@ -0,0 +1,172 @@
+"""Token-budgeted context packing: MMR selection, overlap removal and budget fitting"""
+
+import logging
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from langchain_core.documents import Document
+
+from agent.chunking import count_tokens, split_text
+from agent.config import CONTEXT_TOKEN_BUDGET, DENSE_TIMEOUT, MMR_LAMBDA
+from agent.retrieval import submit_embedding
+
+logger = logging.getLogger(__name__)
+
+# A passage whose span is covered this much by an already packed one is dropped;
+# a smaller overlap is trimmed off instead.
+REDUNDANT_OVERLAP = 0.5
+_SEPARATOR_TOKENS = 1  # the "\n\n" between passages
+
+
+def _unit(doc: Document) -> Tuple:
+    """The loaded unit (file, page or section) a chunk's offsets refer to."""
+    meta = doc.metadata
+    return meta.get("source"), meta.get("page"), meta.get("section")
+
+
+def _tokens(doc: Document) -> int:
+    return doc.metadata.get("tokens") or count_tokens(doc.page_content)
+
+
+class ContextBuilder:
+    """
+    Chooses what goes into the prompt from an over-fetched candidate list.
+    1. Orders candidates by maximal marginal relevance (relevance to the
+       query traded against similarity to passages already chosen).
+    2. Walks that order, dropping passages mostly covered by an already
+       chosen span of the same unit and trimming smaller overlaps.
+    3. Packs passages while they fit in token_budget (tiktoken counts); a
+       passage that does not fit is skipped in favour of later, shorter ones.
+    Step 1 needs the query's embedding: the retriever's (query_vector) if
+    it made one, else one from embeddings (under embed_timeout). With
+    neither (lexical retrieval, a failed or slow embedding call) the
+    retriever's order is kept. Candidate vectors are read back from the
+    vectorstore's FAISS index; only chunks it cannot reconstruct are embedded.
+    """
+
+    def __init__(self, embeddings: Optional[Any] = None, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                 lambda_mult: float = MMR_LAMBDA, embed_timeout: float = DENSE_TIMEOUT,
+                 vectorstore: Optional[Any] = None):
+        self.embeddings = embeddings
+        self.token_budget = token_budget
+        self.lambda_mult = lambda_mult
+        self.embed_timeout = embed_timeout
+        self.vectorstore = vectorstore
+        self._positions: Optional[Dict[str, int]] = None
+
+    def _stored_vectors(self, docs: List[Document]) -> List[Optional[np.ndarray]]:
+        """Each doc's vector from the FAISS index (by docstore id), None where unavailable."""
+        vectors: List[Optional[np.ndarray]] = [None] * len(docs)
+        if self.vectorstore is None:
+            return vectors
+        if self._positions is None:
+            self._positions = {doc_id: i for i, doc_id in self.vectorstore.index_to_docstore_id.items()}
+        for i, doc in enumerate(docs):
+            position = self._positions.get(getattr(doc, "id", None))
+            if position is None:
+                continue
+            try:
+                vectors[i] = self.vectorstore.index.reconstruct(int(position))
+            except RuntimeError:
+                break  # e.g. IVF without a direct map: embed instead
+        return vectors
+
+    def _mmr_order(self, question: str, docs: List[Document], query_vector: Optional[List[float]] = None,
+                   embed_query: bool = True) -> List[Document]:
+        if len(docs) < 3 or (query_vector is None and (not embed_query or self.embeddings is None)):
+            return docs
+        try:
+            if query_vector is None:
+                query_vector = submit_embedding(self.embeddings.embed_query, question).result(self.embed_timeout)
+            vectors = self._stored_vectors(docs)
+            missing = [i for i, vector in enumerate(vectors) if vector is None]
+            if missing:
+                if self.embeddings is None:
+                    return docs
+                embedded = submit_embedding(self.embeddings.embed_documents,
+                                            [docs[i].page_content for i in missing]).result(self.embed_timeout)
+                for i, vector in zip(missing, embedded):
+                    vectors[i] = vector
+        except FutureTimeout:
+            logger.warning("MMR embedding exceeded %.1fs; packing context in retrieval order", self.embed_timeout)
+            return docs
+        except Exception as e:
+            logger.warning("MMR embedding failed (%s); packing context in retrieval order", e)
+            return docs
+        order = maximal_marginal_relevance(np.asarray(query_vector, dtype=np.float32),
+                                           np.asarray(vectors, dtype=np.float32),
+                                           lambda_mult=self.lambda_mult, k=len(docs))
+        return [docs[i] for i in order]
+
+    @staticmethod
+    def _without_overlap(doc: Document, taken: Dict[Tuple, List[Tuple[int, int]]]) -> Optional[Document]:
+        """doc minus text already covered by a taken span of its unit, or None if mostly covered."""
+        start, end = doc.metadata.get("start_index"), doc.metadata.get("end_index")
+        if start is None or end is None or end <= start:
+            return doc
+        for s, e in taken.get(_unit(doc), []):
+            covered = min(end, e) - max(start, s)
+            if covered <= 0:
+                continue
+            if covered >= REDUNDANT_OVERLAP * (end - start):
+                return None
+            # Small overlap with a neighbouring chunk: cut the shared edge.
+            text = doc.page_content
+            if s <= start:
+                text = text[covered:].lstrip()
+                start = end - len(text)
+            elif e >= end:
+                text = text[:len(text) - covered].rstrip()
+                end = start + len(text)
+            else:
+                continue
+            metadata = {**doc.metadata, "start_index": start, "end_index": end, "trimmed": True}
+            metadata.pop("tokens", None)
+            doc = Document(page_content=text, metadata=metadata)
+        return doc
+
+    def _truncate(self, doc: Document) -> Document:
+        """The leading token_budget tokens of doc (for a first passage larger than the budget)."""
+        first = split_text(doc.page_content, self.token_budget, 0)
+        end = first[0][1] if first else 0
+        text = doc.page_content[:end].rstrip()
+        metadata = {**doc.metadata, "truncated": True}
+        metadata.pop("tokens", None)
+        if metadata.get("start_index") is not None:
+            metadata["end_index"] = metadata["start_index"] + len(text)
+        return Document(page_content=text, metadata=metadata)
+
+    def build(self, question: str, docs: List[Document], query_vector: Optional[List[float]] = None,
+              embed_query: bool = True) -> Tuple[List[Document], Dict[str, int]]:
+        """
+        (passages to put in the prompt, packing stats). embed_query=False
+        skips MMR unless query_vector is given.
+        """
+        candidate_tokens = sum(_tokens(doc) for doc in docs)
+        taken: Dict[Tuple, List[Tuple[int, int]]] = {}
+        packed, used, dropped, trimmed = [], 0, 0, 0
+        for doc in self._mmr_order(question, docs, query_vector, embed_query):
+            slim = self._without_overlap(doc, taken)
+            if slim is None or not slim.page_content:
+                dropped += 1
+                continue
+            was_trimmed = slim is not doc
+            cost = _tokens(slim) + (_SEPARATOR_TOKENS if packed else 0)
+            if used + cost > self.token_budget:
+                if packed:
+                    continue
+                slim = self._truncate(slim)
+                cost = count_tokens(slim.page_content)
+            trimmed += was_trimmed
+            packed.append(slim)
+            used += cost
+            if slim.metadata.get("start_index") is not None:
+                taken.setdefault(_unit(slim), []).append((slim.metadata["start_index"], slim.metadata["end_index"]))
+        stats = {"candidates": len(docs), "passages": len(packed), "overlaps_dropped": dropped,
+                 "overlaps_trimmed": trimmed, "candidate_tokens": candidate_tokens,
+                 "context_tokens": used, "tokens_saved": candidate_tokens - used}
+        logger.info("Context: %d/%d passages, %d tokens of %d budget (%d saved; %d overlaps dropped, %d trimmed)",
+                    len(packed), len(docs), used, self.token_budget, stats["tokens_saved"], dropped, trimmed)
+        return packed, stats
@@ -0,0 +1,124 @@
+"""Near-duplicate detection for chunks using MinHash signatures and LSH banding"""
+
+import hashlib
+import json
+import os
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from agent.config import DEDUP_THRESHOLD
+
+NUM_PERM = 64
+BANDS = 16  # 16 bands x 4 rows: pairs above ~0.5 Jaccard are very likely to share a bucket
+SHINGLE_WORDS = 3
+
+_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(1)
+_A = _rng.randint(1, _PRIME, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, _PRIME, size=NUM_PERM, dtype=np.uint64)
+_WORD_RE = re.compile(r"\w+")
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles),
+        dtype=np.uint64, count=len(shingles),
+    )
+
+
+def minhash_signature(text: str) -> Tuple[int, ...]:
+    """NUM_PERM-value MinHash of the text's lowercase word shingles."""
+    hashes = _shingle_hashes(text) % _PRIME
+    permuted = (_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME
+    return tuple(int(v) for v in permuted.min(axis=1))
+
+
+def similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+
+class NearDuplicateIndex:
+    """
+    LSH index over MinHash signatures of the chunks that hold a vector.
+    find() returns the indexed chunk a new chunk duplicates, if any.
+    """
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self.signatures: Dict[str, Tuple[int, ...]] = {}
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], Set[str]] = defaultdict(set)
+
+    @staticmethod
+    def _bands(sig: Tuple[int, ...]):
+        rows = NUM_PERM // BANDS
+        return [(b, sig[b * rows:(b + 1) * rows]) for b in range(BANDS)]
+
+    def add(self, key: str, sig: Tuple[int, ...]) -> None:
+        self.signatures[key] = sig
+        for band in self._bands(sig):
+            self._buckets[band].add(key)
+
+    def remove(self, key: str) -> None:
+        sig = self.signatures.pop(key, None)
+        if sig is None:
+            return
+        for band in self._bands(sig):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band]
+
+    def find(self, sig: Tuple[int, ...]) -> Optional[str]:
+        """Key of the most similar indexed chunk at or above threshold, else None."""
+        candidates = set()
+        for band in self._bands(sig):
+            candidates |= self._buckets.get(band, set())
+        best, best_score = None, self.threshold
+        for key in sorted(candidates):
+            score = similarity(sig, self.signatures[key])
+            if score >= best_score:
+                best, best_score = key, score
+        return best
+
+    def save(self, path: str) -> None:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"threshold": self.threshold, "signatures": self.signatures}, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, threshold: float = DEDUP_THRESHOLD) -> "NearDuplicateIndex":
+        index = cls(threshold)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        for key, sig in data.get("signatures", {}).items():
+            index.add(key, tuple(sig))
+        return index
+
+
+def duplicate_clusters(files: Dict[str, dict]) -> Dict[str, List[str]]:
+    """
+    From manifest file entries, map each chunk id that absorbed duplicates
+    to every file sharing it (owner first).
+    """
+    owner = {cid: name for name, entry in files.items() for cid in entry["ids"]}
+    clusters: Dict[str, List[str]] = {}
+    for name, entry in sorted(files.items()):
+        for cid in entry.get("duplicate_of", []):
+            cluster = clusters.setdefault(cid, [owner.get(cid, "?")])
+            if name not in cluster:
+                cluster.append(name)
+    return clusters
@@ -0,0 +1,159 @@
+"""SQLite-backed docstore: chunk text and metadata are read on demand, never unpickled"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Union
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+from agent.filters import Filters, sql_where
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS documents ("
+    " id TEXT PRIMARY KEY, content TEXT NOT NULL, metadata TEXT NOT NULL)",
+    # One row per (chunk, source file) for metadata filters (agent.filters);
+    # a deduplicated chunk is tagged with every file it appears in.
+    "CREATE TABLE IF NOT EXISTS chunk_tags ("
+    " id TEXT NOT NULL, source TEXT NOT NULL, file_type TEXT, title TEXT, page INTEGER, year INTEGER)",
+    "CREATE INDEX IF NOT EXISTS chunk_tags_id ON chunk_tags(id)",
+    "CREATE INDEX IF NOT EXISTS chunk_tags_source ON chunk_tags(source)",
+)
+
+
+def _tag_rows(doc_id: str, metadata: dict) -> List[tuple]:
+    """chunk_tags rows for a chunk; page is stored 1-based and only for the chunk's own file."""
+    owner = metadata.get("source")
+    page = metadata.get("page")
+    rows = []
+    for source in metadata.get("sources") or [owner]:
+        if source is None:
+            continue
+        file_type = os.path.splitext(source)[1].lstrip(".").lower() or None
+        own = source == owner
+        rows.append((doc_id, source, file_type, metadata.get("title") if own else None,
+                     page + 1 if own and isinstance(page, int) else None, metadata.get("year") if own else None))
+    return rows
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    Docstore over a single SQLite file. Nothing is loaded at open time;
+    search() fetches one row, so memory stays flat as the corpus grows.
+    add() replaces existing ids, which lets callers update metadata, and
+    keeps the chunk_tags table that ids_matching() filters on in step.
+    read_only opens a published (sealed) file without writing anything next
+    to it: no journal, no -wal/-shm files, no schema changes.
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        if read_only:
+            # immutable=1 skips locking and change detection; only safe once nothing is left in a WAL.
+            immutable = "" if os.path.exists(f"{path}-wal") else "&immutable=1"
+            self._db = sqlite3.connect(f"file:{path}?mode=ro{immutable}", uri=True, check_same_thread=False)
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._create_schema()
+
+    def _create_schema(self) -> None:
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    @staticmethod
+    def _row_to_document(doc_id: str, content: str, metadata: str) -> Document:
+        return Document(id=doc_id, page_content=content, metadata=json.loads(metadata))
+
+    def search(self, search: str) -> Union[str, Document]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, content, metadata FROM documents WHERE id = ?", (search,)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return self._row_to_document(*row)
+
+    def mget(self, ids: List[str]) -> List[Optional[Document]]:
+        """Documents for ids in one query (None where missing), in the given order."""
+        found: Dict[str, Document] = {}
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                batch = ids[i:i + 500]
+                rows = self._db.execute(
+                    f"SELECT id, content, metadata FROM documents WHERE id IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                found.update((row[0], self._row_to_document(*row)) for row in rows)
+        return [found.get(doc_id) for doc_id in ids]
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        rows = [
+            (doc_id, doc.page_content, json.dumps(doc.metadata, default=str))
+            for doc_id, doc in texts.items()
+        ]
+        tags = [row for doc_id, doc in texts.items() for row in _tag_rows(doc_id, doc.metadata)]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO documents (id, content, metadata) VALUES (?, ?, ?)", rows
+            )
+            self._db.executemany("DELETE FROM chunk_tags WHERE id = ?", [(doc_id,) for doc_id in texts])
+            self._db.executemany("INSERT INTO chunk_tags VALUES (?, ?, ?, ?, ?, ?)", tags)
+            self._db.commit()
+
+    def delete(self, ids: Iterable[str]) -> None:
+        ids = [(doc_id,) for doc_id in ids]
+        with self._lock:
+            self._db.executemany("DELETE FROM documents WHERE id = ?", ids)
+            self._db.executemany("DELETE FROM chunk_tags WHERE id = ?", ids)
+            self._db.commit()
+
+    def ids_matching(self, filters: Filters) -> Optional[List[str]]:
+        """
+        Ids of the chunks matching filters (see agent.filters), or None if
+        this docstore predates chunk tags and cannot be filtered.
+        """
+        where, params = sql_where(filters)
+        try:
+            with self._lock:
+                rows = self._db.execute(f"SELECT DISTINCT id FROM chunk_tags WHERE {where}", params).fetchall()
+        except sqlite3.OperationalError as e:
+            logger.warning("Cannot filter %s (%s); re-sync the index to tag its chunks", self.path, e)
+            return None
+        return [row[0] for row in rows]
+
+    def seal(self) -> None:
+        """Fold the WAL into the database file and leave WAL mode, ready to be published read-only."""
+        with self._lock:
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._db.execute("PRAGMA journal_mode=DELETE")
+
+    @classmethod
+    def copy(cls, src: str, dst: str) -> "SQLiteDocstore":
+        """A writable docstore at dst holding a consistent snapshot of the one at src (left untouched)."""
+        docstore = cls(dst)
+        source = sqlite3.connect(f"file:{src}?mode=ro", uri=True)
+        try:
+            with docstore._lock:
+                source.backup(docstore._db)
+                docstore._db.execute("PRAGMA journal_mode=WAL")
+                docstore._create_schema()  # the snapshot may predate chunk_tags
+        finally:
+            source.close()
+        return docstore
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
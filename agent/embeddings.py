@@ -0,0 +1,250 @@
+"""
+Embedding backends selected by EMBEDDING_BACKEND.
+
+"openai"  OpenAI embeddings (EMBEDDING_MODEL) sent in adaptive batches over a
+          bounded pool of concurrent requests, with backoff on rate limits.
+"local"   CPU-only hashed n-gram embeddings computed with NumPy; no network,
+          for air-gapped deployments and tests.
+Every backend exposes backend, model_name and dimension, which the index
+records so that loading it with a different backend fails fast.
+"""
+
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from agent.chunking import count_tokens
+from agent.config import (
+    EMBED_BATCH_SIZE,
+    EMBED_CONCURRENCY,
+    EMBED_MAX_BATCH_SIZE,
+    EMBED_MAX_BATCH_TOKENS,
+    EMBED_MAX_RETRIES,
+    EMBEDDING_BACKEND,
+    EMBEDDING_DIM,
+    EMBEDDING_MODEL,
+)
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BACKENDS = ("openai", "local")
+# Output sizes of the OpenAI models when no dimensions are requested.
+OPENAI_DIMENSIONS = {"text-embedding-ada-002": 1536, "text-embedding-3-small": 1536, "text-embedding-3-large": 3072}
+_RETRY_STATUS = (408, 409, 429, 500, 502, 503, 504)
+_RETRY_ERRORS = ("RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError")
+
+
+class EmbeddingMismatchError(ValueError):
+    """The index was built by a different embedding backend, model or dimension."""
+
+
+def embedding_identity(embeddings: Any) -> dict:
+    """{"backend", "model", "dimension"} of an Embeddings (cache wrappers are looked through)."""
+    inner = getattr(embeddings, "underlying", embeddings)
+    return {
+        "backend": getattr(inner, "backend", type(inner).__name__),
+        "model": getattr(inner, "model_name", None) or getattr(inner, "model", None) or type(inner).__name__,
+        "dimension": getattr(inner, "dimension", None) or getattr(inner, "size", None),
+    }
+
+
+def embedding_mismatch(recorded: Optional[dict], embeddings: Any, index_dimension: Optional[int] = None) -> Optional[str]:
+    """
+    Why vectors recorded as `recorded` (an embedding_identity, None for
+    indexes that predate it) can't be searched with embeddings, or None.
+    index_dimension is the stored index's vector size, when known.
+    """
+    current = embedding_identity(embeddings)
+    if recorded:
+        for key in ("backend", "model"):
+            if recorded.get(key) != current[key]:
+                return f"index was built with {key} {recorded.get(key)!r}, configured {key} is {current[key]!r}"
+    stored = index_dimension or (recorded or {}).get("dimension")
+    if stored and current["dimension"] and stored != current["dimension"]:
+        return f"index holds {stored}-dimensional vectors, embeddings produce {current['dimension']}"
+    return None
+
+
+# ---------- Batching, concurrency and retries ----------
+
+def _is_retryable(error: Exception) -> bool:
+    return type(error).__name__ in _RETRY_ERRORS or getattr(error, "status_code", None) in _RETRY_STATUS
+
+
+def _is_rate_limit(error: Exception) -> bool:
+    return type(error).__name__ == "RateLimitError" or getattr(error, "status_code", None) == 429
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    embed_documents() for a backend's raw batch call embed_batch(texts).
+    Texts are split into batches of at most batch_size texts and
+    max_batch_tokens tokens, sent over at most concurrency parallel calls.
+    Rate limits and transient errors are retried with exponential backoff
+    (honouring Retry-After); a rate limit also halves batch_size, which then
+    grows back by a quarter after every 10 clean batches, up to max_batch_size.
+    """
+
+    def __init__(self, embed_batch: Callable[[List[str]], List[List[float]]], backend: str, model_name: str,
+                 dimension: Optional[int] = None, batch_size: int = EMBED_BATCH_SIZE,
+                 max_batch_size: int = EMBED_MAX_BATCH_SIZE, max_batch_tokens: int = EMBED_MAX_BATCH_TOKENS,
+                 concurrency: int = EMBED_CONCURRENCY, max_retries: int = EMBED_MAX_RETRIES,
+                 base_delay: float = 1.0, max_delay: float = 60.0):
+        self.embed_batch = embed_batch
+        self.backend = backend
+        self.model_name = model_name
+        self.dimension = dimension
+        self.batch_size = max(1, min(batch_size, max_batch_size))
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self._clean_batches = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix=f"embed-{backend}")
+
+    def _batches(self, texts: List[str]) -> List[Tuple[int, int]]:
+        """(start, end) slices under the current size and token limits."""
+        slices, start, tokens = [], 0, 0
+        for i, text in enumerate(texts):
+            n = count_tokens(text)
+            if i > start and (i - start >= self.batch_size or tokens + n > self.max_batch_tokens):
+                slices.append((start, i))
+                start, tokens = i, 0
+            tokens += n
+        if start < len(texts):
+            slices.append((start, len(texts)))
+        return slices
+
+    def _adapt(self, throttled: bool) -> None:
+        with self._lock:
+            if throttled:
+                self.batch_size = max(1, self.batch_size // 2)
+                self._clean_batches = 0
+            else:
+                self._clean_batches += 1
+                if self._clean_batches >= 10 and self.batch_size < self.max_batch_size:
+                    self.batch_size = min(self.max_batch_size, self.batch_size + max(1, self.batch_size // 4))
+                    self._clean_batches = 0
+
+    def _call(self, texts: List[str]) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                vectors = self.embed_batch(texts)
+            except Exception as e:
+                if not _is_retryable(e) or attempt == self.max_retries:
+                    raise
+                self._adapt(throttled=_is_rate_limit(e))
+                delay = _retry_after(e) or min(self.max_delay, self.base_delay * 2 ** attempt)
+                delay *= random.uniform(1.0, 1.25)  # jitter, so parallel callers don't retry in step
+                with self._lock:
+                    self.retries += 1
+                logger.warning("Embedding batch of %d failed (%s); retry %d in %.1fs",
+                               len(texts), type(e).__name__, attempt + 1, delay)
+                time.sleep(delay)
+                continue
+            self._adapt(throttled=False)
+            if self.dimension is None and vectors:
+                self.dimension = len(vectors[0])
+            return vectors
+        raise RuntimeError("unreachable")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        slices = self._batches(texts)
+        if len(slices) <= 1:
+            return self._call(texts) if texts else []
+        futures = [self._pool.submit(self._call, texts[start:end]) for start, end in slices]
+        return [vector for future in futures for vector in future.result()]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._call([text])[0]
+
+
+# ---------- Local NumPy backend ----------
+
+_LOCAL_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-/][a-z0-9]+)*")
+
+
+@lru_cache(maxsize=200000)
+def _feature(term: str, dimension: int) -> Tuple[int, float]:
+    """Column and sign of a hashed feature."""
+    h = int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+    return h % dimension, 1.0 if (h >> 63) else -1.0
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    Signed feature hashing of word unigrams and bigrams with sublinear term
+    frequency, L2-normalized. Deterministic, CPU-only and dependency-free
+    beyond NumPy; texts sharing terms (including clinical terms like LDL-C)
+    land close together, which is enough for retrieval without a network.
+    """
+
+    backend = "local"
+
+    def __init__(self, dimension: int = 384, model_name: str = "local-hash-v1"):
+        self.dimension = dimension
+        self.model_name = model_name
+
+    def _features(self, text: str) -> List[str]:
+        words = _LOCAL_TOKEN_RE.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        rows, cols, signs = [], [], []
+        for row, text in enumerate(texts):
+            for term in self._features(text):
+                col, sign = _feature(term, self.dimension)
+                rows.append(row)
+                cols.append(col)
+                signs.append(sign)
+        counts = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        np.add.at(counts, (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)),
+                  np.asarray(signs, dtype=np.float32))
+        matrix = np.sign(counts) * np.log1p(np.abs(counts))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+# ---------- Factory ----------
+
+def _openai_backend() -> BatchedEmbeddings:
+    from langchain_openai import OpenAIEmbeddings
+
+    kwargs = {"dimensions": EMBEDDING_DIM} if EMBEDDING_DIM else {}
+    # One request per call and no client-side retries: BatchedEmbeddings does both.
+    client = OpenAIEmbeddings(model=EMBEDDING_MODEL, chunk_size=EMBED_MAX_BATCH_SIZE, max_retries=0, **kwargs)
+    return BatchedEmbeddings(client.embed_documents, backend="openai", model_name=EMBEDDING_MODEL,
+                             dimension=EMBEDDING_DIM or OPENAI_DIMENSIONS.get(EMBEDDING_MODEL))
+
+
+def get_embedding_backend(name: str = EMBEDDING_BACKEND) -> Embeddings:
+    """The configured backend, uncached (see agent.vectorstore.get_embeddings for the cached one)."""
+    if name == "openai":
+        return _openai_backend()
+    if name == "local":
+        return LocalEmbeddings(EMBEDDING_DIM or 384)
+    raise ValueError(f"EMBEDDING_BACKEND must be one of {', '.join(EMBEDDING_BACKENDS)}; got {name!r}")
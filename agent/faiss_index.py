@@ -0,0 +1,201 @@
+"""Construction, training and tuning of the configurable FAISS index types"""
+
+import logging
+import math
+from typing import Any, Iterable, List, Optional
+
+import faiss
+import numpy as np
+
+from agent.config import (
+    EMBED_BATCH_SIZE,
+    FAISS_INDEX_TYPE,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH,
+    HNSW_M,
+    IVF_NLIST,
+    IVF_NPROBE,
+    PQ_M,
+    PQ_NBITS,
+)
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivfpq", "sq8", "ivfsq8")
+# Retrain IVF/PQ/SQ indexes once they hold this many times the vectors they were trained on.
+RETRAIN_GROWTH = 4
+_MIN_POINTS_PER_CENTROID = 39  # below this faiss k-means warns and clusters poorly
+
+
+def index_spec(index_type: str = FAISS_INDEX_TYPE) -> dict:
+    """The configured index type and only the parameters that apply to it."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"FAISS_INDEX_TYPE must be one of {', '.join(INDEX_TYPES)}; got {index_type!r}")
+    spec = {"type": index_type}
+    if index_type == "hnsw":
+        spec.update(M=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, ef_search=HNSW_EF_SEARCH)
+    if index_type.startswith("ivf"):
+        spec.update(nlist=IVF_NLIST, nprobe=IVF_NPROBE)
+    if index_type == "ivfpq":
+        spec.update(pq_m=PQ_M, pq_nbits=PQ_NBITS)
+    return spec
+
+
+def is_trainable(spec: dict) -> bool:
+    return spec["type"] in ("ivf", "ivfpq", "sq8", "ivfsq8")
+
+
+def factory_string(spec: dict, dim: int, n: int) -> str:
+    """faiss.index_factory description for spec, sized for n training vectors."""
+    kind = spec["type"]
+    if kind == "hnsw":
+        return f"HNSW{spec['M']}"
+    if kind == "sq8":
+        return "SQ8"
+    if kind.startswith("ivf"):
+        nlist = spec.get("nlist") or int(4 * math.sqrt(max(n, 1)))
+        nlist = max(1, min(nlist, n // _MIN_POINTS_PER_CENTROID))
+        if kind == "ivf":
+            return f"IVF{nlist},Flat"
+        if kind == "ivfsq8":
+            return f"IVF{nlist},SQ8"
+        # PQ sub-quantizers must divide the dimension.
+        m = max(d for d in range(1, min(spec["pq_m"], dim) + 1) if dim % d == 0)
+        return f"IVF{nlist},PQ{m}x{spec['pq_nbits']}"
+    return "Flat"
+
+
+def apply_search_params(index: Any, spec: dict) -> None:
+    """Set query-time knobs (efSearch / nprobe), which are not all persisted with the index."""
+    params = faiss.ParameterSpace()
+    for name, key in (("efSearch", "ef_search"), ("nprobe", "nprobe")):
+        if key in spec:
+            try:
+                params.set_index_parameter(index, name, spec[key])
+            except RuntimeError:
+                pass  # index fell back to a type without this knob
+
+
+def build_description(spec: dict, dim: int, n: int) -> str:
+    """
+    The factory description build_faiss_index actually uses for n vectors:
+    factory_string(spec), or "Flat" when n is too few to train spec.
+    """
+    if spec["type"] == "ivfpq" and n < (1 << spec["pq_nbits"]) * _MIN_POINTS_PER_CENTROID:
+        return "Flat"
+    if spec["type"].startswith("ivf") and n < _MIN_POINTS_PER_CENTROID:
+        return "Flat"
+    return factory_string(spec, dim, n)
+
+
+def built_spec(index: Any, spec: dict) -> dict:
+    """spec, or {"type": "flat"} if index is the flat fallback build_faiss_index made instead."""
+    if spec["type"] != "flat" and isinstance(faiss.downcast_index(index), faiss.IndexFlat):
+        return {"type": "flat"}
+    return spec
+
+
+def build_faiss_index(vectors: np.ndarray, spec: dict) -> Any:
+    """Create, train and fill an index of the given spec (L2 metric)."""
+    n, dim = vectors.shape
+    description = build_description(spec, dim, n)
+    if description == "Flat" and spec["type"] != "flat":
+        logger.warning("Only %d vectors; too few to train %s, using a flat index", n, spec["type"])
+    index = faiss.index_factory(dim, description)
+    if spec["type"] == "hnsw":
+        index.hnsw.efConstruction = spec["ef_construction"]
+    if n and not index.is_trained:
+        index.train(vectors)
+    if n:
+        index.add(vectors)
+    apply_search_params(index, spec)
+    return index
+
+
+def rebuild_faiss_index(vectorstore: Any, spec: dict, ids: Optional[List[str]] = None) -> None:
+    """
+    Replace vectorstore.index with a freshly trained index of spec holding
+    ids (default: everything indexed). Vectors are re-derived from the
+    docstore text through the vectorstore's embeddings, which the embedding
+    cache answers without API calls.
+    """
+    if ids is None:
+        ids = [vectorstore.index_to_docstore_id[i] for i in range(vectorstore.index.ntotal)]
+    texts = [vectorstore.docstore.search(doc_id).page_content for doc_id in ids]
+    vectors = []
+    for i in range(0, len(texts), EMBED_BATCH_SIZE):
+        vectors.extend(vectorstore.embedding_function.embed_documents(texts[i:i + EMBED_BATCH_SIZE]))
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(texts), vectorstore.index.d)
+    if getattr(vectorstore, "_normalize_L2", False):
+        faiss.normalize_L2(matrix)
+    vectorstore.index = build_faiss_index(matrix, spec)
+    vectorstore.index_to_docstore_id = dict(enumerate(ids))
+
+
+def remove_vectors(vectorstore: Any, ids: List[str], spec: dict) -> None:
+    """
+    Delete ids from the vectorstore. FAISS.delete assumes remove_ids
+    renumbers the remaining vectors, which only flat-coded indexes do; HNSW
+    cannot remove at all and IVF keeps the old ids, so those are rebuilt.
+    """
+    if isinstance(faiss.downcast_index(vectorstore.index), faiss.IndexFlatCodes):
+        vectorstore.delete(ids)
+        return
+    doomed = set(ids)
+    keep = [vectorstore.index_to_docstore_id[i] for i in range(vectorstore.index.ntotal)
+            if vectorstore.index_to_docstore_id[i] not in doomed]
+    rebuild_faiss_index(vectorstore, spec, keep)
+    vectorstore.docstore.delete(list(doomed))
+
+
+def _selector_params(index: Any, selector: Any) -> Any:
+    """Search parameters of the type index expects, restricted by selector, keeping its nprobe/efSearch."""
+    inner = faiss.downcast_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=inner.nprobe)
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+class FaissPartition:
+    """
+    Search over a subset of an index's positions (e.g. one source file's
+    chunks). Subsets of up to exact_max vectors are copied into their own
+    flat sub-index, which is exact and touches only those vectors. Larger
+    subsets, and index types that cannot reconstruct vectors (IVF), search
+    the full index through an IDSelectorBatch, so vectors outside the
+    subset are skipped during the scan instead of filtered out of a global
+    top-k afterwards.
+    """
+
+    def __init__(self, index: Any, positions: Iterable[int], exact_max: int):
+        self.positions = np.asarray(sorted(positions), dtype=np.int64)
+        self.sub_index = None
+        self._params = None
+        if not len(self.positions):
+            return
+        if len(self.positions) <= exact_max:
+            try:
+                vectors = index.reconstruct_batch(self.positions)
+            except RuntimeError:
+                vectors = None
+            if vectors is not None:
+                self.sub_index = faiss.IndexFlat(index.d, index.metric_type)
+                self.sub_index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+                return
+        self._selector = faiss.IDSelectorBatch(self.positions)  # referenced by _params
+        self._params = _selector_params(index, self._selector)
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def search(self, index: Any, vector: np.ndarray, k: int) -> List[int]:
+        """Positions (in index) of the k nearest vectors of the subset."""
+        if not len(self.positions):
+            return []
+        if self.sub_index is not None:
+            _, indices = self.sub_index.search(vector, min(k, len(self.positions)))
+            return [int(self.positions[i]) for i in indices[0] if i != -1]
+        _, indices = index.search(vector, k, params=self._params)
+        return [int(i) for i in indices[0] if i != -1]
@@ -0,0 +1,134 @@
+"""
+Metadata filters for scoped retrieval.
+
+Filters narrow the chunks a query searches before ranking. They come as a
+dict, e.g. {"source": ["ecg_study.pdf"], "year": [(2019, 2021)]}, or
+inline anywhere in a question:
+
+    source:"structural heart disease" type:pdf year:2019-2021 What was the AUC?
+
+Fields (aliases in brackets):
+  source (doc)    filename; a value with its extension must match exactly
+                  (ignoring case), otherwise any filename containing it
+  file_type (type) pdf, docx or txt
+  title           extracted document title, case-insensitive substring
+  page            1-based PDF page, N or N-M
+  year            publication year found in the document, N or N-M
+Comma-separated values, e.g. type:pdf,docx, match any of them; different
+fields must all match.
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from agent.loader import SUPPORTED_EXTENSIONS
+
+FILTER_FIELDS = ("source", "file_type", "title", "page", "year")
+_ALIASES = {"doc": "source", "type": "file_type"}
+_TEXT_FIELDS = ("source", "title")
+_RANGE_FIELDS = ("page", "year")
+_TERM_RE = re.compile(r'(?i)\b(source|doc|file_type|type|title|page|year):("[^"]*"|\S+)')
+
+Filters = Dict[str, list]
+
+
+def _range(value: Any) -> Tuple[int, int]:
+    if isinstance(value, (tuple, list)):
+        lo, hi = value
+        return int(lo), int(hi)
+    lo, _, hi = str(value).partition("-")
+    return int(lo), int(hi or lo)
+
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> Filters:
+    """Filters with aliases resolved, values as lists and page/year values as (lo, hi); raises ValueError."""
+    out: Filters = {}
+    for key, value in (filters or {}).items():
+        field = _ALIASES.get(key.lower(), key.lower())
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Unknown filter {key!r}; use one of {', '.join(FILTER_FIELDS)}")
+        values = value if isinstance(value, (list, set)) else [value]
+        if field in _RANGE_FIELDS:
+            out.setdefault(field, []).extend(_range(v) for v in values)
+        else:
+            out.setdefault(field, []).extend(str(v).strip().lower().lstrip(".") if field == "file_type"
+                                             else str(v).strip() for v in values)
+    return {field: values for field, values in out.items() if values}
+
+
+def parse_filters(text: str) -> Tuple[str, Filters]:
+    """(question without filter terms, filters) for a question with inline filters."""
+    raw: Dict[str, list] = {}
+
+    def take(match: "re.Match") -> str:
+        value = match.group(2)
+        values = [value[1:-1]] if value.startswith('"') else value.split(",")
+        raw.setdefault(match.group(1).lower(), []).extend(v for v in values if v)
+        return " "
+
+    question = " ".join(_TERM_RE.sub(take, text).split())
+    try:
+        return question, normalize_filters(raw)
+    except ValueError:
+        # Something like "page:two" is part of the question, not a filter.
+        return text, {}
+
+
+def query_scope(query: Union[str, dict]) -> Tuple[str, Filters]:
+    """
+    (question, filters) for a chain query: a string with optional inline
+    filters, or {"query": ..., "filter": {...}}; both sources are combined.
+    """
+    if isinstance(query, dict):
+        question, inline = parse_filters(query["query"])
+        filters = normalize_filters(query.get("filter"))
+        for field, values in inline.items():
+            filters.setdefault(field, []).extend(values)
+        return question, filters
+    return parse_filters(query)
+
+
+def filters_key(filters: Filters) -> Tuple:
+    """
+    Hashable canonical form of normalized filters, for cache keys. Unlike
+    format_filters, values stay separate: source:"a,b" is not source:a,b.
+    """
+    return tuple((field, tuple(sorted(set(filters[field])))) for field in FILTER_FIELDS if filters.get(field))
+
+
+def format_filters(filters: Filters) -> str:
+    """Inline form of filters, for messages and logs (see filters_key for cache keys)."""
+    terms = []
+    for field in FILTER_FIELDS:
+        values = filters.get(field)
+        if not values:
+            continue
+        if field in _RANGE_FIELDS:
+            text = ",".join(str(lo) if lo == hi else f"{lo}-{hi}" for lo, hi in sorted(set(values)))
+        else:
+            text = ",".join(sorted(set(values)))
+        terms.append(f'{field}:"{text}"' if " " in text else f"{field}:{text}")
+    return " ".join(terms)
+
+
+def _like_escape(value: str) -> str:
+    """value with LIKE wildcards escaped, so "_" and "%" match only themselves."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def sql_where(filters: Filters) -> Tuple[str, List[Any]]:
+    """WHERE clause and parameters over the docstore's chunk_tags table."""
+    clauses, params = [], []
+    for field, values in filters.items():
+        if field in _TEXT_FIELDS:
+            exact = [field == "source" and v.lower().endswith(SUPPORTED_EXTENSIONS) for v in values]
+            like = f"{field} LIKE ? ESCAPE '\\'"
+            clauses.append("(" + " OR ".join(f"{field} = ? COLLATE NOCASE" if e else like for e in exact) + ")")
+            params.extend(v if e else f"%{_like_escape(v)}%" for v, e in zip(values, exact))
+        elif field in _RANGE_FIELDS:
+            clauses.append("(" + " OR ".join(f"{field} BETWEEN ? AND ?" for _ in values) + ")")
+            params.extend(bound for lo_hi in values for bound in lo_hi)
+        else:
+            clauses.append(f"{field} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+    return " AND ".join(clauses) or "1", params
@@ -0,0 +1,110 @@
+"""
+Recall vs. latency vs. memory report for the FAISS index types.
+
+Builds every index type over the vectors of the persisted index (taken
+from the embedding cache, so no API calls) and compares each against an
+exact flat baseline:
+    python -m agent.index_report --persist-path vectorstore --k 10
+"""
+
+import argparse
+import json
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import faiss
+import numpy as np
+
+from agent.faiss_index import INDEX_TYPES, build_description, build_faiss_index, factory_string, index_spec
+
+
+def stored_vectors(vectorstore: Any) -> np.ndarray:
+    """All indexed vectors in index order, re-derived through the (cached) embeddings."""
+    ids = [vectorstore.index_to_docstore_id[i] for i in range(vectorstore.index.ntotal)]
+    texts = [vectorstore.docstore.search(doc_id).page_content for doc_id in ids]
+    vectors = np.asarray(vectorstore.embedding_function.embed_documents(texts), dtype=np.float32)
+    return vectors.reshape(len(texts), vectorstore.index.d)
+
+
+def _percentile_ms(samples: List[float], q: float) -> float:
+    return float(np.percentile(samples, q) * 1000) if samples else 0.0
+
+
+def evaluate_index(index: Any, queries: np.ndarray, exact: np.ndarray, k: int) -> Dict[str, float]:
+    """recall@k against exact neighbours and single-query latency percentiles."""
+    latencies, hits = [], 0
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, found = index.search(queries[i:i + 1], k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(found[0]) & set(exact[i]))
+    return {
+        f"recall@{k}": hits / (len(queries) * k) if len(queries) else 0.0,
+        "p50_ms": _percentile_ms(latencies, 50),
+        "p95_ms": _percentile_ms(latencies, 95),
+        "memory_bytes": int(faiss.serialize_index(index).nbytes),
+    }
+
+
+def recall_latency_report(vectors: np.ndarray, k: int = 10, n_queries: int = 200,
+                          index_types: Sequence[str] = INDEX_TYPES, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    One row per index type: build time, recall@k, p50/p95 query latency and
+    serialized size. Queries are stored vectors with small Gaussian noise,
+    so they resemble real queries without being exact matches.
+    "factory" and "index_class" describe the index actually built; when
+    there are too few vectors to train the type it falls back to a flat
+    index, flagged by "fallback" (with the intended factory in "requested").
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    k = min(k, n)
+    picks = rng.choice(n, size=min(n_queries, n), replace=False)
+    queries = vectors[picks] + rng.normal(0, 0.01, size=(len(picks), vectors.shape[1])).astype(np.float32)
+
+    baseline = faiss.IndexFlatL2(vectors.shape[1])
+    baseline.add(vectors)
+    _, exact = baseline.search(queries, k)
+
+    rows = []
+    for index_type in index_types:
+        spec = index_spec(index_type)
+        start = time.perf_counter()
+        index = build_faiss_index(vectors, spec)
+        build_seconds = time.perf_counter() - start
+        requested = factory_string(spec, vectors.shape[1], n)
+        built = build_description(spec, vectors.shape[1], n)
+        rows.append({
+            "type": index_type,
+            "factory": built,
+            "index_class": type(faiss.downcast_index(index)).__name__,
+            "fallback": built != requested,
+            "requested": requested,
+            "vectors": n,
+            "build_s": build_seconds,
+            **evaluate_index(index, queries, exact, k),
+        })
+    return rows
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--persist-path", default="vectorstore")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--types", default=",".join(INDEX_TYPES), help="comma-separated index types")
+    parser.add_argument("--fake", action="store_true", help="use the local embedding backend the index was built with")
+    args = parser.parse_args(argv)
+
+    from agent.vectorstore import open_current_index
+    embeddings = None
+    if args.fake:
+        from agent.embeddings import get_embedding_backend
+        embeddings = get_embedding_backend("local")
+    _, vectorstore, _ = open_current_index(args.persist_path, embeddings)
+    rows = recall_latency_report(stored_vectors(vectorstore), args.k, args.queries, args.types.split(","))
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
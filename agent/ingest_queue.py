@@ -0,0 +1,180 @@
+"""Background ingestion of uploaded documents into the published index"""
+
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+from agent.loader import SUPPORTED_EXTENSIONS, list_document_files
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+
+    from agent.vectorstore import SyncReport
+
+logger = logging.getLogger(__name__)
+
+JOB_STATES = ("queued", "writing", "indexing", "done", "failed")
+
+
+@dataclass
+class IngestJob:
+    """One batch of uploaded files and how far its ingestion has got."""
+    id: str
+    files: List[str]
+    status: str = "queued"
+    written: List[str] = field(default_factory=list)
+    skipped: Dict[str, str] = field(default_factory=dict)  # filename -> reason
+    files_done: int = 0
+    files_total: int = 0
+    current_file: str = ""
+    report: Optional["SyncReport"] = None
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    payload: Dict[str, bytes] = field(default_factory=dict, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    @property
+    def fraction(self) -> float:
+        """Progress in [0, 1] for a progress bar."""
+        if self.finished:
+            return 1.0
+        if self.status != "indexing" or not self.files_total:
+            return 0.0
+        return self.files_done / self.files_total
+
+
+class IngestQueue:
+    """
+    Uploads are submitted as jobs and handled one at a time by a daemon
+    worker thread, so the caller (a Streamlit rerun) never blocks on parsing
+    or embedding. For each job the worker:
+    1. skips files whose content is already in docs_path (same name and
+       content: unchanged; other name: duplicate), by sha256;
+    2. writes the rest atomically (temp file + os.replace), so a concurrent
+       sync never parses a half-written file;
+    3. runs an incremental sync_vectorstore, which parses, chunks and embeds
+       only the new or changed files and publishes a new index version that
+       serving processes swap to (see agent.live_index).
+    """
+
+    def __init__(self, docs_path: str, persist_path: str, embeddings: Optional["Embeddings"] = None,
+                 history: int = 20):
+        self.docs_path = docs_path
+        self.persist_path = persist_path
+        self.embeddings = embeddings
+        self._jobs: deque = deque(maxlen=history)
+        self._queue: "queue.Queue[IngestJob]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._hashes: Dict[Tuple[str, int, float], str] = {}
+
+    def submit(self, files: Iterable[Tuple[str, bytes]]) -> IngestJob:
+        """Queue (filename, content) pairs for ingestion; returns immediately."""
+        payload = {os.path.basename(name): data for name, data in files}
+        job = IngestJob(id=uuid.uuid4().hex[:8], files=list(payload), payload=payload)
+        with self._lock:
+            self._jobs.append(job)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="ingest", daemon=True)
+                self._worker.start()
+        self._queue.put(job)
+        return job
+
+    def jobs(self) -> List[IngestJob]:
+        """Recent jobs, newest first."""
+        with self._lock:
+            return list(reversed(self._jobs))
+
+    def active(self) -> List[IngestJob]:
+        return [job for job in self.jobs() if not job.finished]
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                self._process(job)
+            except Exception as e:
+                logger.exception("Ingest job %s failed", job.id)
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = "failed"
+            finally:
+                job.payload = {}
+                job.finished_at = job.finished_at or time.time()
+                self._queue.task_done()
+
+    def _known_hashes(self) -> Dict[str, str]:
+        """{sha256: filename} of the documents in docs_path (hashes reused while size and mtime match)."""
+        from agent.vectorstore import file_sha256, indexed_files
+
+        indexed = indexed_files(self.persist_path)
+        known = {}
+        for filename in list_document_files(self.docs_path):
+            path = os.path.join(self.docs_path, filename)
+            st = os.stat(path)
+            key = (filename, st.st_size, st.st_mtime)
+            entry = indexed.get(filename)
+            if key not in self._hashes:
+                if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+                    self._hashes[key] = entry["sha256"]
+                else:
+                    self._hashes[key] = file_sha256(path)
+            known[self._hashes[key]] = filename
+        return known
+
+    def _write(self, filename: str, data: bytes) -> None:
+        path = os.path.join(self.docs_path, filename)
+        # Dot-prefixed and without a document extension: invisible to sync until replaced.
+        tmp = os.path.join(self.docs_path, f".{filename}.{os.getpid()}.upload")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _process(self, job: IngestJob) -> None:
+        # Imported here so creating the queue at app start stays cheap.
+        from agent.vectorstore import sync_vectorstore
+
+        job.status = "writing"
+        os.makedirs(self.docs_path, exist_ok=True)
+        known = self._known_hashes()
+        for filename, data in job.payload.items():
+            if not filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                job.skipped[filename] = "unsupported file type"
+                continue
+            digest = hashlib.sha256(data).hexdigest()
+            existing = known.get(digest)
+            if existing == filename:
+                job.skipped[filename] = "unchanged"
+                continue
+            if existing is not None:
+                job.skipped[filename] = f"same content as {existing}"
+                continue
+            self._write(filename, data)
+            known[digest] = filename
+            job.written.append(filename)
+        job.payload = {}
+        if not job.written:
+            job.status = "done"
+            return
+
+        def progress(done: int, total: int, filename: str) -> None:
+            job.files_done, job.files_total, job.current_file = done, total, filename
+
+        job.status = "indexing"
+        job.files_total = len(job.written)
+        _, job.report = sync_vectorstore(self.docs_path, self.persist_path, self.embeddings, progress=progress,
+                                         open_index=False)
+        job.current_file = ""
+        job.status = "done"
+        logger.info("Ingest job %s: %d written, %d skipped, %d chunks added", job.id,
+                    len(job.written), len(job.skipped), job.report.chunks_added)
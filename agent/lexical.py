@@ -0,0 +1,105 @@
+"""BM25 inverted index over chunk text, persisted next to the FAISS index"""
+
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Keep hyphenated/alphanumeric clinical terms (NT-proBNP, HbA1c, LDL-C) whole
+# and also index their parts.
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-/][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were which with "
+    "what how does do can".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        tokens.append(token)
+        if "-" in token or "/" in token:
+            tokens.extend(part for part in re.split(r"[-/]", token) if part and part not in _STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 over chunk ids; supports incremental add/remove."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._doc_terms: Dict[str, Dict[str, int]] = {}
+        self._doc_len: Dict[str, int] = {}
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def _index(self, doc_id: str, terms: Dict[str, int]) -> None:
+        self._doc_terms[doc_id] = terms
+        length = sum(terms.values())
+        self._doc_len[doc_id] = length
+        self._total_len += length
+        for term, tf in terms.items():
+            self._postings[term][doc_id] = tf
+
+    def add(self, doc_id: str, text: str) -> None:
+        self.remove(doc_id)
+        self._index(doc_id, dict(Counter(tokenize(text))))
+
+    def remove(self, doc_id: str) -> None:
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self._total_len -= self._doc_len.pop(doc_id)
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(self, query: str, k: int = 4, ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """Top-k (doc_id, score) for query, optionally restricted to ids."""
+        n = len(self._doc_terms)
+        if not n:
+            return []
+        allowed = set(ids) if ids is not None else None
+        avg_len = self._total_len / n
+        scores: Dict[str, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avg_len)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+    def save(self, path: str) -> None:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "docs": self._doc_terms}, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Load a saved index; a missing or unreadable file gives an empty one."""
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return cls()
+        index = cls(data.get("k1", 1.5), data.get("b", 0.75))
+        for doc_id, terms in data.get("docs", {}).items():
+            index._index(doc_id, terms)
+        return index
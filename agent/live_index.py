@@ -0,0 +1,94 @@
+"""Serve the published index version and swap to newer ones without a restart"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from agent.config import FAISS_MMAP, INDEX_POLL_SECONDS
+from agent.lexical import BM25Index
+from agent.vectorstore import current_index_dir, load_manifest, open_current_index
+
+logger = logging.getLogger(__name__)
+
+
+class LiveChain:
+    """
+    A chain over the index version that persist_path's CURRENT pointer names.
+    build(vectorstore, lexical_index) makes the chain, e.g.
+        LiveChain("vectorstore", lambda vs, lex: build_chain(vs, lexical_index=lex))
+    At most every poll_interval seconds a call checks the pointer; when a
+    sync has published a new version it is loaded (FAISS memory-mapped, so
+    processes on a host share the pages), a chain is built over it and
+    swapped in. Calls already running finish on the chain they started with.
+    """
+
+    def __init__(self, persist_path: str, build: Callable[[Any, BM25Index], Any], embeddings: Any = None,
+                 poll_interval: float = INDEX_POLL_SECONDS, mmap: bool = FAISS_MMAP):
+        self.persist_path = persist_path
+        self.build = build
+        self.poll_interval = poll_interval
+        self.mmap = mmap
+        self.swaps = 0
+        self._lock = threading.Lock()
+        self._checked = time.monotonic()
+        self.index_dir, vectorstore, lexical = open_current_index(persist_path, embeddings, mmap)
+        self.embeddings = vectorstore.embedding_function
+        self.version = self._version(self.index_dir)
+        self.chain = build(vectorstore, lexical)
+
+    @staticmethod
+    def _version(index_dir: str) -> Optional[str]:
+        manifest = load_manifest(index_dir)
+        return manifest.get("version") if manifest else None
+
+    def refresh(self) -> bool:
+        """Swap to the published version if CURRENT has moved; True if it swapped."""
+        index_dir = current_index_dir(self.persist_path)
+        if index_dir is None or index_dir == self.index_dir:
+            return False
+        # Another thread is already loading it; keep answering from the old one.
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            index_dir, vectorstore, lexical = open_current_index(self.persist_path, self.embeddings, self.mmap)
+            chain = self.build(vectorstore, lexical)
+        except Exception as e:
+            logger.warning("Could not load index %s (%s); still serving %s", index_dir, e, self.index_dir)
+            return False
+        finally:
+            self._lock.release()
+        self.chain, self.index_dir, self.version = chain, index_dir, self._version(index_dir)
+        self.swaps += 1
+        logger.info("Swapped to index %s", index_dir)
+        return True
+
+    def current(self) -> Any:
+        """The chain to use for the next call, after a pointer check if one is due."""
+        now = time.monotonic()
+        if now - self._checked >= self.poll_interval:
+            self._checked = now
+            self.refresh()
+        return self.chain
+
+    def current_version(self) -> Optional[str]:
+        """Content version of the index the next call will use (for AnswerCache)."""
+        self.current()
+        return self.version
+
+    def invoke(self, *args, **kwargs):
+        return self.current().invoke(*args, **kwargs)
+
+    async def ainvoke(self, *args, **kwargs):
+        return await self.current().ainvoke(*args, **kwargs)
+
+    def stream(self, *args, **kwargs):
+        return self.current().stream(*args, **kwargs)
+
+    def astream(self, *args, **kwargs):
+        return self.current().astream(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name == "chain":
+            raise AttributeError(name)
+        return getattr(self.current(), name)
@@ -1,22 +1,176 @@
+import logging
 import os
-from langchain_community.document_loaders import TextLoader, PyPDFLoader
-from langchain.schema import Document
-from docx import Document as DocxReader
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional
+
+from agent.chunking import chunk_documents
+from agent.config import LOADER_MAX_PENDING, LOADER_WORKERS, TIKTOKEN_ENCODING
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+# LangChain's loaders, pypdf and python-docx are imported where files are
+# parsed (usually loader worker processes), so importing this module for
+# list_document_files() or SUPPORTED_EXTENSIONS stays cheap.
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".txt", ".pdf", ".docx")
+# Bump when load_file() tags documents differently; stored documents are then re-tagged.
+METADATA_VERSION = 1
+_YEAR_RE = re.compile(r"\b(19[5-9]\d|20\d\d)\b")
+_TITLE_MAX_CHARS = 200
+
+
+@dataclass
+class FileLoadResult:
+    """Parsed documents for one file, with its parse time or failure."""
+    path: str
+    docs: List["Document"] = field(default_factory=list)
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+def list_document_files(folder_path):
+    """Return the supported document filenames in folder_path, sorted."""
+    return sorted(f for f in os.listdir(folder_path) if f.endswith(SUPPORTED_EXTENSIONS))
+
+
+def load_file(path):
+    """Load a single supported file into a list of Documents."""
+    from langchain_community.document_loaders import PyPDFLoader, TextLoader
+
+    filename = os.path.basename(path)
+    if filename.endswith(".txt"):
+        docs = TextLoader(path).load()
+    elif filename.endswith(".pdf"):
+        docs = PyPDFLoader(path).load()
+    elif filename.endswith(".docx"):
+        docs = _load_docx(path)
+    else:
+        return []
+    tags = _document_tags(filename, docs)
+    for doc in docs:
+        doc.metadata.update(source=filename, **tags)
+    return docs
+
+
+def _document_tags(filename, docs):
+    """
+    File-level metadata for filtering (agent.filters): file_type, plus a
+    title (document property, else a short first line) and a year (first
+    plausible year near the start of the text or title, else the PDF's
+    creation date) where one can be found.
+    """
+    tags = {"file_type": os.path.splitext(filename)[1].lstrip(".").lower()}
+    if not docs:
+        return tags
+    first = docs[0]
+    title = str(first.metadata.get("title") or "").strip()
+    if not title:
+        line = next((line.strip() for line in first.page_content.splitlines() if line.strip()), "")
+        title = line if 3 <= len(line) <= _TITLE_MAX_CHARS else ""
+    if title:
+        tags["title"] = title
+    match = _YEAR_RE.search(f"{title}\n{first.page_content[:2000]}") or \
+        _YEAR_RE.match(str(first.metadata.get("creationdate") or "").lstrip("D:"))
+    if match and int(match.group(1)) <= time.localtime().tm_year:
+        tags["year"] = int(match.group(1))
+    return tags
+
+
+def _load_docx(path):
+    """One Document per heading-delimited section, so chunks never straddle headings."""
+    from docx import Document as DocxReader
+    from langchain_core.documents import Document
+
+    filename = os.path.basename(path)
+    reader = DocxReader(path)
+    title = (reader.core_properties.title or "").strip()
+    sections, heading, lines = [], "", []
+    for para in reader.paragraphs:
+        style = para.style.name if para.style is not None else ""
+        if style.startswith(("Heading", "Title")) and para.text.strip():
+            if any(line.strip() for line in lines):
+                sections.append((heading, lines))
+            heading, lines = para.text.strip(), []
+        lines.append(para.text)
+    if any(line.strip() for line in lines):
+        sections.append((heading, lines))
+    extra = {"title": title} if title else {}
+    return [
+        Document(page_content="\n".join(lines),
+                 metadata={"source": filename, "section": i, "heading": heading, **extra})
+        for i, (heading, lines) in enumerate(sections)
+    ]
+
+
+def _load_file_timed(path: str, chunk: bool = True, encoding: str = TIKTOKEN_ENCODING) -> FileLoadResult:
+    # Runs in a worker process; must stay a picklable top-level function.
+    start = time.perf_counter()
+    try:
+        docs = load_file(path)
+        if chunk:
+            docs = chunk_documents(docs, encoding=encoding)
+    except Exception as e:
+        return FileLoadResult(path, seconds=time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+    return FileLoadResult(path, docs, seconds=time.perf_counter() - start)
+
+
+def iter_file_results(paths: Iterable[str], max_workers: int = LOADER_WORKERS,
+                      max_pending: int = LOADER_MAX_PENDING, chunk: bool = True,
+                      encoding: str = TIKTOKEN_ENCODING) -> Iterator[FileLoadResult]:
+    """
+    Parse (and, unless chunk=False, chunk with encoding) files in a process
+    pool and yield one FileLoadResult per file as soon as it is ready
+    (completion order, not input order). Workers never substitute another
+    encoding: if theirs fails to load, the file fails.
+    At most max_pending files are parsing or waiting to be consumed at any
+    time, so memory is bounded by that window rather than the corpus size
+    and the consumer (e.g. embedding) overlaps with parsing.
+    """
+    paths = list(paths)
+    workers = min(max_workers or os.cpu_count() or 1, len(paths))
+    if workers <= 1:
+        for path in paths:
+            yield _log_result(_load_file_timed(path, chunk, encoding))
+        return
+
+    window = max(max_pending, workers)
+    queued = iter(paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for path in queued:
+            pending.add(pool.submit(_load_file_timed, path, chunk, encoding))
+            if len(pending) >= window:
+                break
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                next_path = next(queued, None)
+                if next_path is not None:
+                    pending.add(pool.submit(_load_file_timed, next_path, chunk, encoding))
+                yield _log_result(future.result())
+
+
+def _log_result(result: FileLoadResult) -> FileLoadResult:
+    name = os.path.basename(result.path)
+    if result.error:
+        logger.warning("Failed to parse %s after %.2fs: %s", name, result.seconds, result.error)
+    else:
+        logger.info("Parsed %s: %d docs in %.2fs", name, len(result.docs), result.seconds)
+    return result
+
+
+def iter_documents(folder_path, **kwargs) -> Iterator["Document"]:
+    """Stream Documents from every supported file in folder_path."""
+    paths = [os.path.join(folder_path, f) for f in list_document_files(folder_path)]
+    for result in iter_file_results(paths, **kwargs):
+        yield from result.docs
+
 
 def load_documents(folder_path):
-    docs = []
-
-    for filename in os.listdir(folder_path):
-        path = os.path.join(folder_path, filename)
-        if filename.endswith(".txt"):
-            loader = TextLoader(path)
-            docs.extend(loader.load())
-        elif filename.endswith(".pdf"):
-            loader = PyPDFLoader(path)
-            docs.extend(loader.load())
-        elif filename.endswith(".docx"):
-            doc = DocxReader(path)
-            text = "\n".join([para.text for para in doc.paragraphs])
-            docs.append(Document(page_content=text, metadata={"source": filename}))
-    
-    return docs
\ No newline at end of file
+    return list(iter_documents(folder_path))
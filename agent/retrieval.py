@@ -0,0 +1,184 @@
+"""Hybrid BM25 + vector retrieval fused by reciprocal rank, optionally scoped by metadata filters"""
+
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
+from pydantic import PrivateAttr
+
+from agent.config import (
+    DENSE_TIMEOUT,
+    PARTITION_CACHE_SIZE,
+    PARTITION_EXACT_MAX,
+    RETRIEVAL_FETCH_K,
+    RETRIEVAL_K,
+    RETRIEVAL_MODE,
+)
+from agent.faiss_index import FaissPartition
+from agent.filters import Filters, filters_key, format_filters, query_scope
+from agent.lexical import BM25Index
+from agent.tracing import emit_stage, stage
+
+logger = logging.getLogger(__name__)
+
+# Query embeddings run here so a slow embedding call can be abandoned.
+_embed_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="query-embed")
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[str]:
+    """Merge ranked id lists by sum of 1 / (k + rank)."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))
+
+
+def submit_embedding(fn: Any, *args: Any) -> Future:
+    """Run an embedding call on the query-embedding pool; wait with .result(timeout)."""
+    return _embed_pool.submit(fn, *args)
+
+
+def dense_search(vectorstore: Any, query: str, k: int, timeout: Optional[float] = None,
+                 stages: Optional[Dict[str, float]] = None, partition: Optional[FaissPartition] = None,
+                 embedding: Optional[List[float]] = None) -> List[str]:
+    """
+    Docstore ids of the k nearest chunks (within partition, if given);
+    raises FutureTimeout if embedding takes too long. Pass the query's
+    embedding to skip the embedding call. Seconds spent embedding and
+    searching are added to stages.
+    """
+    stages = {} if stages is None else stages
+    if embedding is None:
+        with stage(stages, "query_embedding"):
+            embedding = submit_embedding(vectorstore.embedding_function.embed_query, query).result(timeout)
+    with stage(stages, "faiss_search"):
+        vector = np.asarray([embedding], dtype=np.float32)
+        if getattr(vectorstore, "_normalize_L2", False):
+            vector /= np.linalg.norm(vector, axis=1, keepdims=True)
+        if partition is not None:
+            positions = partition.search(vectorstore.index, vector, k)
+        else:
+            _, indices = vectorstore.index.search(vector, k)
+            positions = [i for i in indices[0] if i != -1]
+    return [vectorstore.index_to_docstore_id[i] for i in positions]
+
+
+class Partition:
+    """The chunks matching one set of filters: docstore ids for BM25, positions for FAISS."""
+
+    def __init__(self, ids: Sequence[str], faiss_partition: Optional[FaissPartition]):
+        self.ids = frozenset(ids)
+        self.faiss = faiss_partition
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retrieves from the FAISS vectorstore and the BM25 index and fuses the
+    two rankings with reciprocal-rank fusion.
+    mode="lexical" skips the embedding call entirely; in "hybrid" mode an
+    embedding call that fails or exceeds dense_timeout falls back to BM25.
+    A successful query embedding is reported with the "query_embedding"
+    stage event (data["vector"]), so context packing can reuse it.
+
+    Queries may carry metadata filters (agent.filters), inline in the query
+    text or as invoke(query, filter={...}). Matching chunk ids come from the
+    docstore's tag table, and both searches run only over them: BM25 scores
+    only those ids and FAISS searches a FaissPartition. Partitions are
+    cached, so repeated queries on one document skip the lookup.
+    """
+
+    vectorstore: Any
+    lexical: BM25Index
+    mode: str = RETRIEVAL_MODE
+    k: int = RETRIEVAL_K
+    fetch_k: int = RETRIEVAL_FETCH_K
+    dense_timeout: float = DENSE_TIMEOUT
+    rrf_k: int = 60
+    partition_exact_max: int = PARTITION_EXACT_MAX
+    _partitions: Any = PrivateAttr(default_factory=OrderedDict)
+    _positions: Optional[Dict[str, int]] = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def partition(self, filters: Filters) -> Optional[Partition]:
+        """The chunks matching filters (cached), or None if the docstore cannot filter."""
+        key = filters_key(filters)
+        with self._lock:
+            if key in self._partitions:
+                self._partitions.move_to_end(key)
+                return self._partitions[key]
+        docstore = self.vectorstore.docstore
+        ids = docstore.ids_matching(filters) if hasattr(docstore, "ids_matching") else None
+        if ids is None:
+            return None
+        if self._positions is None:
+            self._positions = {doc_id: i for i, doc_id in self.vectorstore.index_to_docstore_id.items()}
+        positions = [self._positions[doc_id] for doc_id in ids if doc_id in self._positions]
+        partition = Partition(ids, FaissPartition(self.vectorstore.index, positions, self.partition_exact_max))
+        with self._lock:
+            self._partitions[key] = partition
+            while len(self._partitions) > PARTITION_CACHE_SIZE:
+                self._partitions.popitem(last=False)
+        return partition
+
+    def _dense_ids(self, query: str, stages: Dict[str, float],
+                   partition: Optional[Partition] = None) -> Tuple[List[str], Optional[List[float]]]:
+        """(dense ranking, query embedding); ([], None) if the embedding call failed."""
+        embedding = None
+        try:
+            with stage(stages, "query_embedding"):
+                embedding = submit_embedding(self.vectorstore.embedding_function.embed_query,
+                                             query).result(self.dense_timeout)
+            return dense_search(self.vectorstore, query, self.fetch_k, stages=stages,
+                                partition=partition.faiss if partition is not None else None,
+                                embedding=embedding), embedding
+        except FutureTimeout:
+            logger.warning("Query embedding exceeded %.1fs; answering from BM25 only", self.dense_timeout)
+        except Exception as e:
+            logger.warning("Dense retrieval failed (%s); answering from BM25 only", e)
+        return [], None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                filter: Optional[dict] = None) -> List[Document]:
+        query, filters = query_scope({"query": query, "filter": filter})
+        rankings, stages, partition, embedding = [], {}, None, None
+        if filters:
+            with stage(stages, "metadata_filter"):
+                partition = self.partition(filters)
+            if partition is not None and not partition.ids:
+                logger.info("No chunks match %s", format_filters(filters))
+                emit_stage(run_manager, "metadata_filter", stages["metadata_filter"])
+                return []
+        if self.mode != "dense":
+            with stage(stages, "bm25_search"):
+                ids = partition.ids if partition is not None else None
+                rankings.append([doc_id for doc_id, _ in self.lexical.search(query, self.fetch_k, ids=ids)])
+        if self.mode != "lexical":
+            dense, embedding = self._dense_ids(query, stages, partition)
+            rankings.append(dense)
+        fused = reciprocal_rank_fusion(rankings, self.rrf_k)
+        docstore = self.vectorstore.docstore
+        with stage(stages, "docstore_fetch"):
+            if hasattr(docstore, "mget"):
+                found = docstore.mget(fused[:2 * self.k])
+            else:
+                found = [docstore.search(doc_id) for doc_id in fused[:2 * self.k]]
+        for name, seconds in stages.items():
+            if name == "query_embedding" and embedding is not None:
+                emit_stage(run_manager, name, seconds, vector=list(embedding))
+            else:
+                emit_stage(run_manager, name, seconds)
+        return [doc for doc in found if isinstance(doc, Document)][:self.k]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun,
+                                       filter: Optional[dict] = None) -> List[Document]:
+        # The base class drops extra kwargs on the async path; pass filter through.
+        return await run_in_executor(None, self._get_relevant_documents, query,
+                                     run_manager=run_manager.get_sync(), filter=filter)
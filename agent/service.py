@@ -0,0 +1,167 @@
+"""
+Headless asyncio query service over the persisted index.
+
+Loads the vectorstore and chain once and answers queries concurrently:
+    service = QueryService.from_persist_path("vectorstore")
+    answers = await service.abatch(["What biomarkers predict heart disease?", ...])
+
+Run `python -m agent.service queries.txt` to answer one query per line
+and print JSONL; add --fake to use the offline fake LLM and local embeddings.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+from agent.answer_cache import AnswerCache, CachedQAChain, normalize_query
+from agent.chain import build_chain
+from agent.config import SERVICE_ADMISSION_TIMEOUT, SERVICE_MAX_CONCURRENCY, SERVICE_MAX_PENDING
+from agent.live_index import LiveChain
+from agent.tracing import start_metrics_server
+
+
+class ServiceOverloadedError(RuntimeError):
+    """Raised when a query waits longer than admission_timeout to be admitted."""
+
+
+@dataclass
+class _Shared:
+    """One in-flight chain call and the number of callers waiting on it."""
+    task: asyncio.Future
+    waiters: int = 0
+
+
+class QueryService:
+    """
+    Async front end for a chain with ainvoke().
+    - At most max_concurrency chain calls run at once.
+    - At most max_pending distinct queries are admitted (running or waiting);
+      further callers wait for a slot, and fail with ServiceOverloadedError
+      after admission_timeout seconds (None or 0 waits forever).
+    - Identical in-flight queries (after normalization) share one chain call;
+      it is cancelled only when every caller waiting on it has been.
+    """
+
+    def __init__(self, chain: Any, max_concurrency: int = SERVICE_MAX_CONCURRENCY,
+                 max_pending: int = SERVICE_MAX_PENDING,
+                 admission_timeout: Optional[float] = SERVICE_ADMISSION_TIMEOUT):
+        self.chain = chain
+        self.admission_timeout = admission_timeout or None
+        self._workers = asyncio.Semaphore(max_concurrency)
+        self._admission = asyncio.Semaphore(max(max_pending, max_concurrency))
+        self._inflight: Dict[str, _Shared] = {}
+        self._stats = {"completed": 0, "errors": 0, "coalesced": 0, "rejected": 0, "running": 0}
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str = "vectorstore", llm: Any = None, embeddings: Any = None,
+                          answer_cache: bool = True, **kwargs) -> "QueryService":
+        """
+        Serve the index published in persist_path, swapping to newer versions
+        as they are published. llm/embeddings override the OpenAI defaults.
+        """
+        live = LiveChain(persist_path, lambda vs, lexical: build_chain(vs, llm=llm, lexical_index=lexical),
+                         embeddings=embeddings)
+        chain = live
+        if answer_cache:
+            chain = CachedQAChain(live, AnswerCache(live.embeddings), index_version=live.current_version)
+        return cls(chain, **kwargs)
+
+    async def aquery(self, question: str) -> dict:
+        """Answer one question; returns the chain's {"query", "result", ...} dict."""
+        key = normalize_query(question)
+        shared = self._inflight.get(key)
+        if shared is None:
+            # The chain call is a task of its own that every caller waits on
+            # through a shield: one caller going away cancels only its wait.
+            shared = self._inflight[key] = _Shared(asyncio.ensure_future(self._run(question)))
+            shared.task.add_done_callback(lambda task: self._finish(key, shared))
+        else:
+            self._stats["coalesced"] += 1
+        shared.waiters += 1
+        try:
+            return await asyncio.shield(shared.task)
+        except asyncio.CancelledError:
+            if shared.waiters == 1 and not shared.task.done():
+                shared.task.cancel()  # nobody else wants the answer
+                self._finish(key, shared)
+            raise
+        finally:
+            shared.waiters -= 1
+
+    def _finish(self, key: str, shared: "_Shared") -> None:
+        if self._inflight.get(key) is shared:
+            del self._inflight[key]
+        if shared.task.done() and not shared.task.cancelled():
+            shared.task.exception()  # mark retrieved even if every waiter left
+
+    async def _run(self, question: str) -> dict:
+        try:
+            await asyncio.wait_for(self._admission.acquire(), self.admission_timeout)
+        except asyncio.TimeoutError:
+            self._stats["rejected"] += 1
+            raise ServiceOverloadedError(f"query not admitted within {self.admission_timeout}s")
+        try:
+            async with self._workers:
+                self._stats["running"] += 1
+                try:
+                    result = await self.chain.ainvoke(question)
+                finally:
+                    self._stats["running"] -= 1
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        finally:
+            self._admission.release()
+        self._stats["completed"] += 1
+        return result
+
+    async def abatch(self, questions: Sequence[str], return_exceptions: bool = False) -> List[Any]:
+        """Answer many questions concurrently, preserving order."""
+        return await asyncio.gather(*(self.aquery(q) for q in questions), return_exceptions=return_exceptions)
+
+    def stats(self) -> dict:
+        return {**self._stats, "in_flight": len(self._inflight)}
+
+
+async def _main(args) -> None:
+    llm = embeddings = None
+    if args.fake:
+        from agent.embeddings import get_embedding_backend
+        from agent.fakes import FakeChatModel
+        llm, embeddings = FakeChatModel(), get_embedding_backend("local")
+    start_metrics_server()
+    # A batch queues all of its own queries; none of them should be turned away.
+    service = QueryService.from_persist_path(args.persist_path, llm=llm, embeddings=embeddings,
+                                             max_concurrency=args.concurrency, admission_timeout=None)
+    with open(args.queries) if args.queries != "-" else sys.stdin as f:
+        questions = [line.strip() for line in f if line.strip()]
+    start = time.perf_counter()
+    results = await service.abatch(questions, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    for question, result in zip(questions, results):
+        if isinstance(result, BaseException):
+            print(json.dumps({"query": question, "error": f"{type(result).__name__}: {result}"}))
+        else:
+            print(json.dumps({"query": question, "result": result["result"], "timings": result.get("timings"),
+                              "stages": (result.get("trace") or {}).get("stages"),
+                              "cached": result.get("cached", False)}))
+    print(json.dumps({"stats": service.stats(), "seconds": elapsed,
+                      "qps": len(questions) / elapsed if elapsed else None}), file=sys.stderr)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Answer queries against the persisted index.")
+    parser.add_argument("queries", help="file with one query per line, or - for stdin")
+    parser.add_argument("--persist-path", default="vectorstore")
+    parser.add_argument("--concurrency", type=int, default=SERVICE_MAX_CONCURRENCY)
+    parser.add_argument("--fake", action="store_true",
+                        help="use the offline fake LLM and local embeddings (index must be built with them)")
+    asyncio.run(_main(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
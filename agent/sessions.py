@@ -0,0 +1,133 @@
+"""SQLite-backed chat sessions, read a window at a time"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+from agent.utils import format_timestamp
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS sessions ("
+    " id TEXT PRIMARY KEY, title TEXT NOT NULL, created_at TEXT NOT NULL,"
+    " updated REAL NOT NULL, message_count INTEGER NOT NULL DEFAULT 0, owner TEXT NOT NULL DEFAULT '')",
+    "CREATE TABLE IF NOT EXISTS messages ("
+    " session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL,"
+    " timestamp TEXT NOT NULL, extra TEXT NOT NULL, PRIMARY KEY (session_id, seq))",
+)
+# Run after _SCHEMA, once databases created before the owner column have it.
+_INDEXES = (
+    "DROP INDEX IF EXISTS sessions_updated",
+    "CREATE INDEX IF NOT EXISTS sessions_owner_updated ON sessions(owner, updated)",
+)
+
+
+class SessionStore:
+    """
+    Chat sessions and their messages in one SQLite file, so they survive
+    restarts. Sessions are listed most recently used first, a page at a
+    time, and messages() returns only the latest window of a conversation
+    (older ones on request), so reading stays cheap however long it gets.
+    Every session belongs to an owner (the client that created it): latest,
+    list_sessions and count only see the owner's sessions, and get with an
+    owner refuses anyone else's. Sessions created before owners existed
+    belong to owner "".
+    Sessions are {"id", "title", "created_at", "message_count"}; messages are
+    {"seq", "role", "content", "timestamp", **extra}, seq counting from 0.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(sessions)")]
+        if "owner" not in columns:
+            self._db.execute("ALTER TABLE sessions ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+        for statement in _INDEXES:
+            self._db.execute(statement)
+        self._db.commit()
+
+    @staticmethod
+    def _session(row) -> dict:
+        return {"id": row[0], "title": row[1], "created_at": row[2], "message_count": row[3]}
+
+    def create(self, title: str = "New Chat", owner: str = "") -> dict:
+        session = {"id": f"chat_{uuid.uuid4().hex[:12]}", "title": title, "created_at": format_timestamp(),
+                   "message_count": 0}
+        with self._lock:
+            self._db.execute("INSERT INTO sessions (id, title, created_at, updated, owner) VALUES (?, ?, ?, ?, ?)",
+                             (session["id"], title, session["created_at"], time.time(), owner))
+            self._db.commit()
+        return session
+
+    def get(self, session_id: str, owner: Optional[str] = None) -> Optional[dict]:
+        """The session, or None if it does not exist (or belongs to someone other than owner, if given)."""
+        with self._lock:
+            row = self._db.execute("SELECT id, title, created_at, message_count, owner FROM sessions WHERE id = ?",
+                                   (session_id,)).fetchone()
+        if row is None or (owner is not None and row[4] != owner):
+            return None
+        return self._session(row)
+
+    def latest(self, owner: str = "") -> Optional[dict]:
+        """The owner's most recently used session, if any."""
+        sessions = self.list_sessions(limit=1, owner=owner)
+        return sessions[0] if sessions else None
+
+    def list_sessions(self, offset: int = 0, limit: int = 10, owner: str = "") -> List[dict]:
+        """One page of the owner's sessions, most recently used first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, title, created_at, message_count FROM sessions WHERE owner = ?"
+                " ORDER BY updated DESC LIMIT ? OFFSET ?",
+                (owner, limit, offset),
+            ).fetchall()
+        return [self._session(row) for row in rows]
+
+    def count(self, owner: str = "") -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM sessions WHERE owner = ?", (owner,)).fetchone()[0]
+
+    def rename(self, session_id: str, title: str) -> None:
+        with self._lock:
+            self._db.execute("UPDATE sessions SET title = ? WHERE id = ?", (title, session_id))
+            self._db.commit()
+
+    def add_message(self, session_id: str, role: str, content: str, **extra) -> dict:
+        """Append a message and return it."""
+        message = {"role": role, "content": content, "timestamp": format_timestamp(), **extra}
+        with self._lock:
+            row = self._db.execute("SELECT message_count FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                raise KeyError(session_id)
+            message["seq"] = row[0]
+            self._db.execute(
+                "INSERT INTO messages (session_id, seq, role, content, timestamp, extra) VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, message["seq"], role, content, message["timestamp"], json.dumps(extra, default=str)),
+            )
+            self._db.execute("UPDATE sessions SET message_count = message_count + 1, updated = ? WHERE id = ?",
+                             (time.time(), session_id))
+            self._db.commit()
+        return message
+
+    def messages(self, session_id: str, limit: int, before: Optional[int] = None) -> List[dict]:
+        """The latest limit messages (older than seq before, if given), oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, role, content, timestamp, extra FROM messages"
+                " WHERE session_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+                (session_id, before if before is not None else 1 << 62, limit),
+            ).fetchall()
+        return [{"seq": seq, "role": role, "content": content, "timestamp": timestamp, **json.loads(extra)}
+                for seq, role, content, timestamp, extra in reversed(rows)]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
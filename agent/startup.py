@@ -0,0 +1,138 @@
+"""
+Cold-start profiling and background warm-up.
+
+The app renders before the heavy stack (FAISS, LangChain, the OpenAI client,
+document parsers) is imported: a Warmup thread imports it, syncs and loads
+the index and builds the chain while the first page is already on screen.
+StartupProfile records where that time goes, per module and per stage:
+    python -m agent.startup                  # profile the published index in ./vectorstore
+    python -m agent.startup idx --fake       # fake LLM and local embeddings, no API key needed
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Sequence
+
+from agent.tracing import stage
+
+logger = logging.getLogger(__name__)
+
+# Imported by the warm-up, dependencies first; each costs only what the ones
+# before it did not already load.
+HEAVY_MODULES = ("numpy", "faiss", "langchain_core.documents", "langchain_community.vectorstores",
+                 "langchain_openai", "pypdf", "docx", "tiktoken")
+
+
+class StartupProfile:
+    """
+    Seconds spent importing each heavy module, in each warm-up stage, and
+    from start to each mark ("interactive": first page rendered, "ready":
+    chain usable). Safe to fill from the warm-up thread while the UI reads it.
+    """
+
+    def __init__(self, start: Optional[float] = None):
+        self.start = time.perf_counter() if start is None else start
+        self.imports: Dict[str, float] = {}
+        self.stages: Dict[str, float] = {}
+        self.marks: Dict[str, float] = {}
+
+    def import_modules(self, names: Iterable[str] = HEAVY_MODULES) -> None:
+        """Import names (skipping ones already loaded or not installed), timing each."""
+        for name in names:
+            if name in sys.modules:
+                continue
+            start = time.perf_counter()
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                logger.debug("Warm-up skipped %s: %s", name, e)
+                continue
+            self.imports[name] = time.perf_counter() - start
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        with stage(self.stages, name):
+            yield
+
+    def mark(self, name: str) -> float:
+        """Record (once) the seconds from start to now under name."""
+        return self.marks.setdefault(name, time.perf_counter() - self.start)
+
+    def summary(self) -> Dict[str, float]:
+        """Flat {stage: seconds} for telemetry.record_startup."""
+        return {"imports": sum(self.imports.values()), **self.stages, **self.marks}
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        return {"imports": dict(self.imports), "stages": dict(self.stages), "marks": dict(self.marks)}
+
+
+class Warmup:
+    """Runs fn once on a daemon thread; poll ready, then read result or error."""
+
+    def __init__(self, fn: Callable[[], Any], name: str = "warmup"):
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(fn,), name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self, fn: Callable[[], Any]) -> None:
+        try:
+            self.result = fn()
+        except Exception as e:
+            logger.exception("Warm-up failed")
+            self.error = e
+        finally:
+            self._done.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the warm-up finishes (or timeout); True if it has."""
+        return self._done.wait(timeout)
+
+
+def profile_startup(persist_path: str, fake_llm: bool = False) -> StartupProfile:
+    """
+    Profile a cold start over the index published in persist_path; fake_llm
+    also swaps in the local embedding backend, so no API key is needed.
+    """
+    profile = StartupProfile()
+    profile.import_modules()
+    with profile.stage("index_load"):
+        from agent.vectorstore import open_current_index
+        embeddings = None
+        if fake_llm:
+            from agent.embeddings import get_embedding_backend
+            embeddings = get_embedding_backend("local")
+        _, vectorstore, lexical = open_current_index(persist_path, embeddings)
+    with profile.stage("chain_build"):
+        from agent.chain import build_chain
+        llm = None
+        if fake_llm:
+            from agent.fakes import FakeChatModel
+            llm = FakeChatModel()
+        build_chain(vectorstore, llm=llm, lexical_index=lexical)
+    profile.mark("ready")
+    return profile
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("persist_path", nargs="?", default="vectorstore")
+    parser.add_argument("--fake", action="store_true", help="use a fake LLM and the local embeddings (no API key)")
+    args = parser.parse_args(argv)
+
+    print(json.dumps(profile_startup(args.persist_path, args.fake).as_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Per-stage tracing for queries and ingest runs.
+
+StageTimer is a LangChain callback handler that turns one query's callback
+events (retriever and LLM runs, plus "stage" custom events emitted by the
+retriever) into a trace: seconds per stage, retrieved chunk count and
+prompt/completion tokens. The module-level `telemetry` aggregates traces,
+appends them to TRACE_FILE (if set) as JSONL, rotating it at TRACE_MAX_BYTES,
+and renders Prometheus text metrics, optionally served on METRICS_PORT at
+/metrics.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from uuid import UUID
+
+from agent.config import METRICS_PORT, TRACE_FILE, TRACE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+STAGE_EVENT = "stage"
+# Display order; stages missing from a trace are skipped.
+QUERY_STAGES = ("cache_lookup", "metadata_filter", "bm25_search", "query_embedding", "faiss_search", "docstore_fetch",
+                "retrieval", "context_packing", "prompt", "llm_first_token", "llm", "total")
+INGEST_STAGES = ("scan", "open", "delete", "parse", "dedup", "embed", "faiss_rebuild", "persist", "total")
+
+
+# ---------- Stage helpers ----------
+
+def emit_stage(run_manager: Any, stage: str, seconds: float, **data: Any) -> None:
+    """Report a stage from inside a retriever/tool run to the run's callback handlers."""
+    from langchain_core.callbacks.manager import dispatch_custom_event
+
+    dispatch_custom_event(STAGE_EVENT, {"stage": stage, "seconds": seconds, **data},
+                          config={"callbacks": run_manager.get_child()})
+
+
+@contextmanager
+def stage(stages: Dict[str, float], name: str) -> Iterator[None]:
+    """Add the time spent in the block to stages[name]."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+
+
+def timed_iter(iterable: Iterable, stages: Dict[str, float], name: str) -> Iterator:
+    """Yield from iterable, adding the time spent waiting for each item to stages[name]."""
+    iterator = iter(iterable)
+    while True:
+        with stage(stages, name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+# ---------- Query callbacks ----------
+
+def _stage_timer_class() -> type:
+    # Defined on first use: subclassing BaseCallbackHandler imports
+    # langchain_core, which processes that only need `telemetry` skip.
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class StageTimer(BaseCallbackHandler):
+        """Collects one query's stage timings and counts from callback events."""
+
+        def __init__(self):
+            self.stages: Dict[str, float] = {}
+            self.counts: Dict[str, int] = {"chunks": 0, "prompt_tokens": 0, "completion_tokens": 0}
+            self.query_vector: Optional[List[float]] = None  # reported by the retriever, if it embedded the query
+            self._starts: Dict[UUID, float] = {}
+
+        def on_custom_event(self, name: str, data: Any, *, run_id: UUID, **kwargs: Any) -> None:
+            if name == STAGE_EVENT:
+                self.stages[data["stage"]] = self.stages.get(data["stage"], 0.0) + data["seconds"]
+                if data.get("vector") is not None:
+                    self.query_vector = data["vector"]
+
+        def on_retriever_start(self, serialized: Any, query: str, *, run_id: UUID, **kwargs: Any) -> None:
+            self._starts[run_id] = time.perf_counter()
+
+        def on_retriever_end(self, documents: Any, *, run_id: UUID, **kwargs: Any) -> None:
+            start = self._starts.pop(run_id, None)
+            if start is not None:
+                self.stages["retrieval"] = self.stages.get("retrieval", 0.0) + time.perf_counter() - start
+            self.counts["chunks"] += len(documents)
+
+        def on_chat_model_start(self, serialized: Any, messages: Any, *, run_id: UUID, **kwargs: Any) -> None:
+            self._starts[run_id] = time.perf_counter()
+
+        def on_llm_start(self, serialized: Any, prompts: Any, *, run_id: UUID, **kwargs: Any) -> None:
+            self._starts[run_id] = time.perf_counter()
+
+        def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+            if "llm_first_token" not in self.stages and run_id in self._starts:
+                self.stages["llm_first_token"] = time.perf_counter() - self._starts[run_id]
+
+        def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+            start = self._starts.pop(run_id, None)
+            if start is not None:
+                self.stages["llm"] = self.stages.get("llm", 0.0) + time.perf_counter() - start
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            prompt_tokens, completion_tokens = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    prompt_tokens = prompt_tokens or metadata.get("input_tokens", 0)
+                    completion_tokens = completion_tokens or metadata.get("output_tokens", 0)
+            self.counts["prompt_tokens"] += prompt_tokens
+            self.counts["completion_tokens"] += completion_tokens
+
+    return StageTimer
+
+
+def __getattr__(name: str) -> Any:
+    if name == "StageTimer":
+        globals()["StageTimer"] = cls = _stage_timer_class()
+        return cls
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# ---------- Aggregation, JSONL and Prometheus ----------
+
+class TraceLog:
+    """
+    Append-only JSONL file kept open between writes; once it reaches
+    max_bytes it is renamed to <path>.1 (replacing the previous one) and a
+    new file is started. An empty path disables it.
+    """
+
+    def __init__(self, path: str = TRACE_FILE, max_bytes: int = TRACE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._file = None
+
+    def write(self, trace: dict) -> None:
+        if not self.path:
+            return
+        line = json.dumps(trace, default=str) + "\n"
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write(line)
+                self._file.flush()
+                if self.max_bytes and self._file.tell() >= self.max_bytes:
+                    self._close()
+                    os.replace(self.path, f"{self.path}.1")
+            except OSError as e:
+                logger.warning("Could not append trace to %s: %s", self.path, e)
+                self._close()
+
+    def _close(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+
+class Telemetry:
+    """Process-wide counters and stage-time summaries, plus the JSONL trace log."""
+
+    def __init__(self, trace_file: str = TRACE_FILE, recent: int = 100, trace_max_bytes: int = TRACE_MAX_BYTES):
+        # Traces are written outside _lock, so a slow disk never stalls the
+        # counters, /metrics or other queries' bookkeeping.
+        self.trace_log = TraceLog(trace_file, trace_max_bytes)
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._stage_sum: Dict[tuple, float] = defaultdict(float)
+        self._stage_count: Dict[tuple, int] = defaultdict(int)
+        self.recent: deque = deque(maxlen=recent)
+        self.startup: Dict[str, float] = {}
+
+    def _observe(self, kind: str, stages: Dict[str, float]) -> None:
+        for name, seconds in stages.items():
+            self._stage_sum[(kind, name)] += seconds
+            self._stage_count[(kind, name)] += 1
+
+    def record_query(self, trace: dict) -> None:
+        """trace: {"stages": {...}, "counts": {...}, "cached": bool, ...}"""
+        trace = {"type": "query", "ts": time.time(), **trace}
+        with self._lock:
+            self._counters["queries_total"] += 1
+            self._counters["cache_hits_total"] += bool(trace.get("cached"))
+            for name, value in trace.get("counts", {}).items():
+                self._counters[f"query_{name}_total"] += value
+            self._observe("query", trace.get("stages", {}))
+            self.recent.append(trace)
+        self.trace_log.write(trace)
+
+    def observe_stage(self, kind: str, name: str, seconds: float) -> None:
+        """Add one stage timing to the summaries without writing a trace."""
+        with self._lock:
+            self._observe(kind, {name: seconds})
+
+    def record_ingest(self, stages: Dict[str, float], counts: Dict[str, int]) -> None:
+        trace = {"type": "ingest", "ts": time.time(), "stages": stages, "counts": counts}
+        with self._lock:
+            self._counters["ingest_runs_total"] += 1
+            for name, value in counts.items():
+                self._counters[f"ingest_{name}_total"] += value
+            self._observe("ingest", stages)
+        self.trace_log.write(trace)
+
+    def record_startup(self, stages: Dict[str, float]) -> None:
+        """Cold-start timings (see agent.startup), exported as gauges."""
+        trace = {"type": "startup", "ts": time.time(), "stages": stages}
+        with self._lock:
+            self.startup.update(stages)
+        self.trace_log.write(trace)
+
+    def last_query(self) -> Optional[dict]:
+        with self._lock:
+            return self.recent[-1] if self.recent else None
+
+    def mean_stages(self) -> Dict[str, float]:
+        """Mean seconds per stage over the recent uncached queries."""
+        with self._lock:
+            traces = [t for t in self.recent if not t.get("cached")]
+        sums: Dict[str, float] = defaultdict(float)
+        for trace in traces:
+            for name, seconds in trace["stages"].items():
+                sums[name] += seconds
+        return {name: total / len(traces) for name, total in sums.items()}
+
+    def render_prometheus(self, prefix: str = "medanalytica") -> str:
+        """Counters and stage-time summaries in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                lines += [f"# TYPE {prefix}_{name} counter", f"{prefix}_{name} {self._counters[name]:g}"]
+            for kind in ("query", "ingest"):
+                metric = f"{prefix}_{kind}_stage_seconds"
+                keys = sorted(key for key in self._stage_sum if key[0] == kind)
+                if keys:
+                    lines.append(f"# TYPE {metric} summary")
+                for key in keys:
+                    lines.append(f'{metric}_sum{{stage="{key[1]}"}} {self._stage_sum[key]:.6f}')
+                    lines.append(f'{metric}_count{{stage="{key[1]}"}} {self._stage_count[key]}')
+            if self.startup:
+                lines.append(f"# TYPE {prefix}_startup_seconds gauge")
+            for name, seconds in self.startup.items():
+                lines.append(f'{prefix}_startup_seconds{{stage="{name}"}} {seconds:.6f}')
+        return "\n".join(lines) + "\n"
+
+
+telemetry = Telemetry()
+_metrics_server: Optional[ThreadingHTTPServer] = None
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = telemetry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics on port from a daemon thread (once per process); port 0 disables it."""
+    global _metrics_server
+    if not port or _metrics_server is not None:
+        return _metrics_server
+    try:
+        _metrics_server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    except OSError as e:
+        logger.warning("Metrics server not started on port %d: %s", port, e)
+        return None
+    threading.Thread(target=_metrics_server.serve_forever, name="metrics", daemon=True).start()
+    return _metrics_server
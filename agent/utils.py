@@ -1,7 +1,6 @@
 """Utility functions for the medical agent"""
 
 import re
-import time
 from datetime import datetime
 
 def sanitize_filename(filename):
@@ -12,12 +11,6 @@ def format_timestamp():
     """Get formatted timestamp"""
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-def simulate_typing(text, speed=0.01):
-    """Simulate typing effect for streaming responses"""
-    for char in text:
-        yield char
-        time.sleep(speed)
-
 def validate_medical_query(query):
     """Validate if query is medically relevant"""
     medical_keywords = [
@@ -1,12 +1,766 @@
-from langchain.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
 
-def build_vectorstore(docs, persist_path):
-    embeddings = OpenAIEmbeddings()
-    vectorstore = FAISS.from_documents(docs, embeddings)
-    vectorstore.save_local(persist_path)
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+import faiss
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from agent.chunking import get_encoding
+from agent.config import (
+    CHUNK_OVERLAP_TOKENS,
+    CHUNK_TOKENS,
+    DEDUP_THRESHOLD,
+    EMBED_BATCH_SIZE,
+    EMBED_CONCURRENCY,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    EMBEDDING_DIM,
+    FAISS_MMAP,
+    INDEX_KEEP_VERSIONS,
+    TIKTOKEN_ENCODING,
+)
+from agent.docstore import SQLiteDocstore
+from agent.embeddings import EmbeddingMismatchError, embedding_identity, embedding_mismatch, get_embedding_backend
+from agent.faiss_index import (
+    RETRAIN_GROWTH,
+    apply_search_params,
+    build_description,
+    built_spec,
+    index_spec,
+    is_trainable,
+    rebuild_faiss_index,
+    remove_vectors,
+)
+from agent.dedup import NearDuplicateIndex, duplicate_clusters, minhash_signature
+from agent.lexical import BM25Index
+from agent.tracing import stage, telemetry, timed_iter
+from agent.loader import METADATA_VERSION, iter_file_results, list_document_files
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_SCHEMA = 2  # 2: SQLite docstore instead of a pickled index.pkl
+INDEX_FILE = "index.faiss"
+INDEX_IDS_FILE = "index_ids.json"
+DOCSTORE_FILE = "docstore.sqlite"
+EMBEDDING_CACHE_FILE = "embedding_cache.sqlite"
+DEDUP_FILE = "dedup.json"
+LEXICAL_FILE = "lexical.json"
+FILE_STATS_FILE = "file_stats.json"
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+SYNC_LOCK_FILE = ".sync.lock"
+# Pre-versioning layouts kept everything directly in persist_path.
+LEGACY_FILES = (INDEX_FILE, "index.pkl", INDEX_IDS_FILE, MANIFEST_FILE, DEDUP_FILE, LEXICAL_FILE,
+                DOCSTORE_FILE, f"{DOCSTORE_FILE}-wal", f"{DOCSTORE_FILE}-shm")
+
+
+@dataclass
+class SyncReport:
+    """What an incremental sync changed in the index."""
+    added: List[str] = field(default_factory=list)
+    updated: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+    failed: Dict[str, str] = field(default_factory=dict)
+    parse_seconds: Dict[str, float] = field(default_factory=dict)
+    chunks_added: int = 0
+    chunks_deleted: int = 0
+    embedding_cache_hits: int = 0
+    embedding_cache_misses: int = 0
+    duplicates_collapsed: int = 0
+    duplicate_clusters: Dict[str, List[str]] = field(default_factory=dict)
+    rebuilt: bool = False
+    index_rebuilt: bool = False
+    stage_seconds: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.updated or self.removed or self.rebuilt
+                    or self.chunks_deleted or self.index_rebuilt)
+
+
+# ---------- Embedding cache ----------
+
+class CachedEmbeddings(Embeddings):
+    """
+    Disk-backed embedding cache in front of another Embeddings.
+    Vectors are keyed by (model name, sha256 of whitespace-normalized text),
+    so rebuilds, re-chunking and duplicate content reuse earlier vectors.
+    Least recently used entries are evicted past max_entries.
+    """
+
+    def __init__(self, underlying: Embeddings, path: str, model_name: str,
+                 max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings(last_used)")
+
+    def _key(self, kind: str, text: str) -> str:
+        normalized = " ".join(text.split())
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            rows = self._db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            found.update((key, array("f", blob).tolist()) for key, blob in rows)
+        if found:
+            now = time.time()
+            self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                 [(now, key) for key in found])
+        return found
+
+    def _store(self, items: Dict[str, List[float]]) -> None:
+        now = time.time()
+        self._db.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(key, array("f", vector).tobytes(), now) for key, vector in items.items()],
+        )
+        excess = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM embeddings WHERE key IN"
+                " (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+            )
+
+    def _embed(self, kind: str, texts: List[str], compute) -> List[List[float]]:
+        keys = [self._key(kind, t) for t in texts]
+        with self._lock:
+            found = self._lookup(list(dict.fromkeys(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            computed = dict(zip(missing, compute(list(missing.values()))))
+            with self._lock:
+                self._store(computed)
+            found.update(computed)
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("doc", texts, self.underlying.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed("query", [text], lambda ts: [self.underlying.embed_query(ts[0])])[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "entries": entries,
+                    "hit_rate": self.hits / total if total else 0.0}
+
+
+def get_embeddings(persist_path: str) -> CachedEmbeddings:
+    """The EMBEDDING_BACKEND embeddings behind the on-disk cache stored in persist_path."""
+    backend = get_embedding_backend()
+    identity = embedding_identity(backend)
+    # Plain model name for OpenAI's default sizes, so caches from before backends existed stay valid.
+    name = identity["model"] if identity["backend"] == "openai" else f"{identity['backend']}:{identity['model']}"
+    if EMBEDDING_DIM:
+        name = f"{name}@{EMBEDDING_DIM}"
+    return CachedEmbeddings(backend, os.path.join(persist_path, EMBEDDING_CACHE_FILE), model_name=name)
+
+
+# ---------- Persistence (no pickle) ----------
+# persist_path/
+#   CURRENT                  name of the published version, swapped with os.replace
+#   versions/<name>/         one complete index per build; its files are never
+#                            rewritten after publishing, so readers can mmap them
+#     index.faiss            FAISS index (faiss.write_index)
+#     index_ids.json         docstore id of every index position, in order
+#     docstore.sqlite        chunk text + metadata, fetched per hit by SQLiteDocstore
+#                            (sealed before publishing, then opened read-only)
+#     dedup.json, lexical.json, manifest.json
+#   file_stats.json          size/mtime of files touched since the published
+#                            manifest but unchanged in content (see indexed_files)
+#   embedding_cache.sqlite   shared by all versions
+
+def save_vectorstore(vectorstore, index_dir):
+    """Write the FAISS index and id map; the SQLite docstore is already on disk."""
+    index_path = os.path.join(index_dir, INDEX_FILE)
+    faiss.write_index(vectorstore.index, f"{index_path}.tmp")
+    os.replace(f"{index_path}.tmp", index_path)
+    ids_path = os.path.join(index_dir, INDEX_IDS_FILE)
+    with open(f"{ids_path}.tmp", "w") as f:
+        json.dump([vectorstore.index_to_docstore_id[i] for i in range(vectorstore.index.ntotal)], f)
+    os.replace(f"{ids_path}.tmp", ids_path)
+
+
+def _read_faiss_index(path: str, mmap: bool):
+    """Read path, memory-mapped (read-only) if asked and supported by the index type."""
+    if mmap:
+        # IVF inverted lists and flat code arrays are mapped by different flags.
+        flag = faiss.IO_FLAG_MMAP if index_spec()["type"].startswith("ivf") else \
+            getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            return faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            logger.warning("Could not memory-map %s (%s); reading it into memory", path, e)
+    return faiss.read_index(path)
+
+
+def load_vectorstore(index_dir, embeddings, mmap=False, docstore=None):
+    """
+    Open the index in index_dir. A memory-mapped index (mmap=True) is
+    read-only; sync loads without it. docstore overrides the directory's own
+    chunk store (sync edits a copy in the version it is building).
+    Raises EmbeddingMismatchError if embeddings are not the backend, model
+    and dimension the index was built with.
+    """
+    index = _read_faiss_index(os.path.join(index_dir, INDEX_FILE), mmap)
+    manifest = load_manifest(index_dir) or {}
+    reason = embedding_mismatch(manifest.get("embedding"), embeddings, index.d)
+    if reason:
+        raise EmbeddingMismatchError(f"{index_dir}: {reason}; rebuild the index or change EMBEDDING_BACKEND")
+    with open(os.path.join(index_dir, INDEX_IDS_FILE), "r") as f:
+        index_to_docstore_id = dict(enumerate(json.load(f)))
+    docstore = docstore or SQLiteDocstore(os.path.join(index_dir, DOCSTORE_FILE), read_only=True)
+    vectorstore = FAISS(embeddings, index, docstore, index_to_docstore_id)
+    apply_search_params(vectorstore.index, index_spec())
     return vectorstore
 
-def load_vectorstore(persist_path):
-    embeddings = OpenAIEmbeddings()
-    return FAISS.load_local(persist_path, embeddings, allow_dangerous_deserialization=True)
+
+def load_lexical_index(index_dir) -> BM25Index:
+    """The BM25 index kept in step with the vectorstore in index_dir."""
+    return BM25Index.load(os.path.join(index_dir, LEXICAL_FILE))
+
+
+def open_current_index(persist_path, embeddings=None, mmap=FAISS_MMAP):
+    """
+    (index_dir, vectorstore, lexical index) of the version published in
+    persist_path. Raises FileNotFoundError if nothing with vectors is published.
+    """
+    index_dir = current_index_dir(persist_path)
+    if index_dir is None or not os.path.exists(os.path.join(index_dir, INDEX_FILE)):
+        raise FileNotFoundError(f"No published index in {persist_path}; run sync_vectorstore first")
+    embeddings = embeddings or get_embeddings(persist_path)
+    return index_dir, load_vectorstore(index_dir, embeddings, mmap=mmap), load_lexical_index(index_dir)
+
+
+# ---------- Versioned index directories ----------
+
+def current_index_dir(persist_path: str) -> Optional[str]:
+    """Directory of the published index version, or None."""
+    try:
+        with open(os.path.join(persist_path, CURRENT_FILE), "r") as f:
+            name = f.read().strip()
+    except OSError:
+        return None
+    path = os.path.join(persist_path, VERSIONS_DIR, name)
+    return path if name and os.path.isdir(path) else None
+
+
+def _new_index_dir(persist_path: str) -> str:
+    # Names sort chronologically, which pruning relies on.
+    path = os.path.join(persist_path, VERSIONS_DIR, f"{time.time_ns() // 1_000_000:013d}-{os.getpid()}")
+    os.makedirs(path)
+    return path
+
+
+def publish_index_dir(persist_path: str, index_dir: str) -> None:
+    """Atomically point CURRENT at index_dir, then prune old versions."""
+    path = os.path.join(persist_path, CURRENT_FILE)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(os.path.basename(index_dir))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _prune_index_dirs(persist_path, index_dir)
+
+
+def _prune_index_dirs(persist_path: str, current: str) -> None:
+    """
+    Keep the INDEX_KEEP_VERSIONS newest versions (so processes that have not
+    swapped yet keep working) and drop the rest, plus any pre-versioning
+    files left in persist_path itself.
+    """
+    root = os.path.join(persist_path, VERSIONS_DIR)
+    older = sorted(name for name in os.listdir(root) if name != os.path.basename(current))
+    for name in older[:max(len(older) - (INDEX_KEEP_VERSIONS - 1), 0)]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    for name in LEGACY_FILES:
+        if os.path.exists(os.path.join(persist_path, name)):
+            os.remove(os.path.join(persist_path, name))
+
+
+def _discard_unpublished(persist_path: str) -> None:
+    """
+    Remove version directories newer than the one CURRENT names: builds
+    that failed or were killed before publishing. Call with the sync lock
+    held, so no build is in progress.
+    """
+    try:
+        with open(os.path.join(persist_path, CURRENT_FILE), "r") as f:
+            current = f.read().strip()
+    except OSError:
+        current = ""
+    root = os.path.join(persist_path, VERSIONS_DIR)
+    for name in sorted(os.listdir(root)):
+        if name > current:
+            logger.warning("Removing unpublished index version %s", name)
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+@contextmanager
+def _sync_lock(persist_path: str):
+    """Serialize syncs of persist_path across processes (no-op where flock is unavailable)."""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(persist_path, SYNC_LOCK_FILE), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# ---------- Manifest ----------
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_manifest(persist_path: str) -> Optional[dict]:
+    """Return the index manifest, or None if missing or unreadable."""
+    try:
+        with open(os.path.join(persist_path, MANIFEST_FILE), "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("schema") != MANIFEST_SCHEMA:
+        return None
+    return manifest
+
+
+def save_manifest(persist_path: str, manifest: dict) -> None:
+    """Write the manifest atomically so readers never see a partial file."""
+    path = os.path.join(persist_path, MANIFEST_FILE)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def indexed_files(persist_path: str, manifest: Optional[dict] = None) -> Dict[str, dict]:
+    """
+    The published manifest's file entries, with size and mtime refreshed
+    from file_stats.json where a file was touched without changing content
+    (published manifests are never rewritten, so those live beside them).
+    """
+    if manifest is None:
+        index_dir = current_index_dir(persist_path)
+        manifest = (load_manifest(index_dir) if index_dir else None) or {"files": {}}
+    try:
+        with open(os.path.join(persist_path, FILE_STATS_FILE), "r") as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        stats = {}
+    files = {}
+    for filename, entry in manifest["files"].items():
+        stat = stats.get(filename)
+        if stat and stat.get("sha256") == entry["sha256"]:
+            entry = {**entry, "size": stat["size"], "mtime": stat["mtime"]}
+        files[filename] = entry
+    return files
+
+
+def _save_file_stats(persist_path: str, files: Dict[str, dict], published: Dict[str, dict]) -> None:
+    """Record the stat info of files that differs from the published manifest (none: remove the file)."""
+    stats = {f: {"sha256": e["sha256"], "size": e["size"], "mtime": e["mtime"]} for f, e in files.items()
+             if f in published and (e["size"], e["mtime"]) != (published[f]["size"], published[f]["mtime"])}
+    path = os.path.join(persist_path, FILE_STATS_FILE)
+    if not stats:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(stats, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+_version_cache: Dict[str, Tuple[int, Optional[str]]] = {}
+
+
+def get_index_version(persist_path: str) -> Optional[str]:
+    """Content version of the index published in persist_path (manifest re-read only when it changes)."""
+    index_dir = current_index_dir(persist_path)
+    if index_dir is None:
+        return None
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _version_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        manifest = load_manifest(index_dir)
+        cached = (mtime, manifest.get("version") if manifest else None)
+        _version_cache[path] = cached
+    return cached[1]
+
+
+def _index_version(settings: dict, files: Dict[str, dict]) -> str:
+    h = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    for name in sorted(files):
+        h.update(f"{name}\0{files[name]['sha256']}\0".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def index_settings() -> dict:
+    """Settings that change chunk boundaries or metadata; a mismatch forces a full rebuild."""
+    return {
+        "chunk_tokens": CHUNK_TOKENS,
+        "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS,
+        "encoding": TIKTOKEN_ENCODING,
+        "dedup_threshold": DEDUP_THRESHOLD,
+        "metadata_version": METADATA_VERSION,
+    }
+
+
+def _chunk_ids(filename: str, digest: str, count: int) -> List[str]:
+    return [f"{filename}#{digest[:12]}#{i}" for i in range(count)]
+
+
+def _scan(docs_path: str, previous: Dict[str, dict]) -> Tuple[Dict[str, dict], Dict[str, str]]:
+    """
+    Fingerprint every supported file in docs_path.
+    Returns (entries for unchanged files, {filename: sha256} of files that
+    need (re)indexing). Files whose size and mtime match the manifest are not
+    re-hashed.
+    """
+    unchanged, dirty = {}, {}
+    for filename in list_document_files(docs_path):
+        st = os.stat(os.path.join(docs_path, filename))
+        prev = previous.get(filename)
+        if prev and prev["size"] == st.st_size and prev["mtime"] == st.st_mtime:
+            unchanged[filename] = prev
+            continue
+        digest = file_sha256(os.path.join(docs_path, filename))
+        if prev and prev["sha256"] == digest:
+            # Touched but identical: keep the vectors, refresh the stat info.
+            unchanged[filename] = {**prev, "size": st.st_size, "mtime": st.st_mtime}
+            continue
+        dirty[filename] = digest
+    return unchanged, dirty
+
+
+def _docstore_get(vectorstore, doc_id: str) -> Optional[Document]:
+    if vectorstore is None:
+        return None
+    doc = vectorstore.docstore.search(doc_id)
+    return doc if isinstance(doc, Document) else None
+
+
+def _add_chunks(vectorstore, chunks: Dict[str, Document], embeddings: Embeddings, index_dir: str):
+    """Embed and index chunks ({id: doc}), creating the vectorstore on first use."""
+    docs, ids = list(chunks.values()), list(chunks)
+    if vectorstore is None:
+        docstore = SQLiteDocstore(os.path.join(index_dir, DOCSTORE_FILE))
+        return FAISS.from_documents(docs, embeddings, ids=ids, docstore=docstore)
+    vectorstore.add_documents(docs, ids=ids)
+    return vectorstore
+
+
+def sync_vectorstore(docs_path: str, persist_path: str, embeddings: Optional[Embeddings] = None,
+                     progress: Optional[Callable[[int, int, str], None]] = None, open_index: bool = True):
+    """
+    Bring the index in persist_path in line with the files in docs_path.
+    Only new or changed files are loaded, chunked and embedded; vectors
+    belonging to changed or removed files are deleted. Without a manifest
+    (or index), or when index_settings() or the embedding backend/model
+    changed, the index is rebuilt.
+
+    Chunks that near-duplicate an indexed chunk are not embedded; the
+    indexed chunk lists every file in metadata["sources"] and the file's
+    manifest entry records it under "duplicate_of". When such a chunk's
+    owner goes away, the files pointing at it are re-indexed too.
+
+    Changes are made in a new version directory, starting from the current
+    one, which is then published by swapping the CURRENT pointer; processes
+    serving the old version are never disturbed (see agent.live_index).
+    Concurrent syncs of one persist_path run one after the other. A version
+    that fails before it is published is removed (if the process dies
+    instead, the next sync removes it).
+    embeddings defaults to get_embeddings(persist_path). progress, if given,
+    is called as progress(files_done, files_to_index, filename) as files are
+    indexed.
+    Returns (vectorstore or None if nothing is indexed, SyncReport). With
+    open_index=False the vectorstore is always None and an unchanged index
+    is not read at all; callers that serve it open the published version
+    themselves (open_current_index, LiveChain).
+    """
+    os.makedirs(os.path.join(persist_path, VERSIONS_DIR), exist_ok=True)
+    report = SyncReport()
+    with stage(report.stage_seconds, "total"), _sync_lock(persist_path):
+        _discard_unpublished(persist_path)
+        try:
+            vectorstore = _sync_locked(docs_path, persist_path, embeddings, report, progress, open_index)
+        except BaseException:
+            _discard_unpublished(persist_path)
+            raise
+    telemetry.record_ingest(report.stage_seconds, {
+        "files_added": len(report.added), "files_updated": len(report.updated),
+        "files_removed": len(report.removed), "files_failed": len(report.failed),
+        "chunks_added": report.chunks_added, "chunks_deleted": report.chunks_deleted,
+        "embedding_cache_misses": report.embedding_cache_misses,
+    })
+    return vectorstore, report
+
+
+def _sync_locked(docs_path: str, persist_path: str, embeddings: Optional[Embeddings], report: SyncReport,
+                 progress: Optional[Callable[[int, int, str], None]] = None, open_index: bool = True):
+    stages = report.stage_seconds
+    live_dir = current_index_dir(persist_path)
+    manifest = load_manifest(live_dir) if live_dir else None
+    has_index = live_dir is not None and os.path.exists(os.path.join(live_dir, INDEX_FILE))
+
+    previous: Dict[str, dict] = {}
+    settings = index_settings()
+    embeddings = embeddings or get_embeddings(persist_path)
+    # An index chunked with other settings, or embedded by another backend, can't be diffed; rebuild it.
+    reuse = manifest is not None and manifest.get("settings") == settings and \
+        (has_index or not any(entry["ids"] for entry in manifest["files"].values()))
+    mismatch = embedding_mismatch(manifest.get("embedding"), embeddings) if reuse else None
+    if mismatch:
+        logger.info("Embeddings changed (%s); rebuilding the index", mismatch)
+        reuse = False
+    if reuse:
+        previous = indexed_files(persist_path, manifest)
+    else:
+        report.rebuilt = True
+
+    with stage(stages, "scan"):
+        files, dirty = _scan(docs_path, previous)
+    removed = [f for f in previous if f not in files and f not in dirty]
+
+    # Files whose vectors go away, plus (transitively) unchanged files that
+    # deduplicated into one of those vectors.
+    doomed = set(removed) | set(dirty)
+    while True:
+        doomed_ids = {cid for f in doomed if f in previous for cid in previous[f]["ids"]}
+        dependents = [f for f, entry in files.items()
+                      if doomed_ids.intersection(entry.get("duplicate_of", []))]
+        if not dependents:
+            break
+        for f in dependents:
+            dirty[f] = files.pop(f)["sha256"]
+            doomed.add(f)
+    report.unchanged = sorted(files)
+    report.removed = sorted(removed)
+
+    spec = index_spec()
+    faiss_state = manifest.get("faiss_index") if reuse else None
+    # What the live index was built for: spec itself, or spec with too few
+    # vectors to train it (built flat, recorded under "requested").
+    built_for = ((faiss_state or {}).get("spec", {"type": "flat"}), (faiss_state or {}).get("requested"))
+    if reuse and not dirty and not removed and (not has_index or spec in built_for):
+        # Nothing to rebuild: keep serving the published version.
+        if files != previous:
+            _save_file_stats(persist_path, files, manifest["files"])
+        report.duplicate_clusters = duplicate_clusters(files)
+        if not open_index:
+            return None
+        with stage(stages, "open"):
+            vectorstore = load_vectorstore(live_dir, embeddings) if has_index else None
+        if vectorstore is not None and vectorstore.index.ntotal == 0:
+            vectorstore = None
+        return vectorstore
+
+    if dirty:
+        # Load the tokenizer here, before anything is written: a failure
+        # stops the sync instead of chunking with something else.
+        get_encoding(settings["encoding"])
+    index_dir = _new_index_dir(persist_path)
+    vectorstore = None
+    with stage(stages, "open"):
+        if reuse and has_index:
+            docstore = SQLiteDocstore.copy(os.path.join(live_dir, DOCSTORE_FILE),
+                                           os.path.join(index_dir, DOCSTORE_FILE))
+            vectorstore = load_vectorstore(live_dir, embeddings, docstore=docstore)
+        dedup = NearDuplicateIndex.load(os.path.join(live_dir, DEDUP_FILE)) if reuse else NearDuplicateIndex()
+        lexical = load_lexical_index(live_dir) if reuse else BM25Index()
+
+    if doomed_ids and vectorstore is not None:
+        with stage(stages, "delete"):
+            remove_vectors(vectorstore, list(doomed_ids), spec)
+        report.chunks_deleted = len(doomed_ids)
+    for cid in doomed_ids:
+        dedup.remove(cid)
+        lexical.remove(cid)
+    for f in doomed:
+        for cid in previous.get(f, {}).get("duplicate_of", []):
+            target = _docstore_get(vectorstore, cid)
+            if target is not None:
+                target.metadata["sources"] = [s for s in target.metadata.get("sources", []) if s != f]
+                vectorstore.docstore.add({cid: target})
+
+    # Parsing runs ahead in worker processes while this loop embeds. Kept
+    # chunks are embedded EMBED_BATCH_SIZE * EMBED_CONCURRENCY at a time,
+    # across files, so a remote backend has enough batches to send in parallel.
+    hits, misses = getattr(embeddings, "hits", 0), getattr(embeddings, "misses", 0)
+    pending: Dict[str, Document] = {}
+    paths = [os.path.join(docs_path, f) for f in dirty]
+    for done, result in enumerate(timed_iter(iter_file_results(paths, encoding=settings["encoding"]), stages, "parse"), 1):
+        filename = os.path.basename(result.path)
+        report.parse_seconds[filename] = round(result.seconds, 3)
+        if progress is not None:
+            progress(done, len(paths), filename)
+        if result.error:
+            # Left out of the manifest so the next sync retries it.
+            report.failed[filename] = result.error
+            continue
+        digest = dirty[filename]
+        st = os.stat(result.path)
+
+        kept: Dict[str, Document] = {}
+        duplicate_of: List[str] = []
+        with stage(stages, "dedup"):
+            for doc, cid in zip(result.docs, _chunk_ids(filename, digest, len(result.docs))):
+                doc.metadata["sources"] = [filename]
+                sig = minhash_signature(doc.page_content)
+                match = dedup.find(sig)
+                if match is None:
+                    dedup.add(cid, sig)
+                    lexical.add(cid, doc.page_content)
+                    kept[cid] = doc
+                    continue
+                report.duplicates_collapsed += 1
+                if match in kept:
+                    if filename not in kept[match].metadata["sources"]:
+                        kept[match].metadata["sources"].append(filename)
+                elif match in pending:
+                    if filename not in pending[match].metadata["sources"]:
+                        pending[match].metadata["sources"].append(filename)
+                else:
+                    target = _docstore_get(vectorstore, match)
+                    if target is not None and filename not in target.metadata["sources"]:
+                        target.metadata["sources"].append(filename)
+                        vectorstore.docstore.add({match: target})
+                if match not in kept and match not in duplicate_of:
+                    duplicate_of.append(match)
+
+        ids = list(kept)
+        pending.update(kept)
+        if len(pending) >= EMBED_BATCH_SIZE * EMBED_CONCURRENCY:
+            with stage(stages, "embed"):
+                vectorstore = _add_chunks(vectorstore, pending, embeddings, index_dir)
+            pending = {}
+        files[filename] = {"sha256": digest, "size": st.st_size, "mtime": st.st_mtime,
+                           "ids": ids, "duplicate_of": duplicate_of}
+        (report.updated if filename in previous else report.added).append(filename)
+        report.chunks_added += len(ids)
+
+    if pending:
+        with stage(stages, "embed"):
+            vectorstore = _add_chunks(vectorstore, pending, embeddings, index_dir)
+
+    # New indexes start flat; convert to the configured type, and retrain
+    # trained types once the corpus has outgrown their training set. An
+    # index built flat because there were too few vectors to train spec is
+    # rebuilt as soon as there are enough.
+    if vectorstore is not None and vectorstore.index.ntotal:
+        n = vectorstore.index.ntotal
+        built = (faiss_state or {}).get("spec", {"type": "flat"})
+        fallback = built != spec and (faiss_state or {}).get("requested") == spec
+        if fallback:
+            stale_spec = build_description(spec, vectorstore.index.d, n) != "Flat"
+        else:
+            stale_spec = built != spec
+        outgrown = is_trainable(spec) and not fallback and faiss_state is not None and \
+            n > RETRAIN_GROWTH * max(faiss_state.get("trained_on", 0), 1)
+        if stale_spec or outgrown:
+            with stage(stages, "faiss_rebuild"):
+                rebuild_faiss_index(vectorstore, spec)
+            faiss_state = {"spec": spec, "trained_on": n}
+            report.index_rebuilt = True
+        # Record the index actually built, not the one asked for.
+        if built_spec(vectorstore.index, spec) != spec:
+            faiss_state = {"spec": {"type": "flat"}, "requested": spec, "trained_on": 0}
+    faiss_state = faiss_state or {"spec": {"type": "flat"}, "trained_on": 0}
+
+    report.embedding_cache_hits = getattr(embeddings, "hits", 0) - hits
+    report.embedding_cache_misses = getattr(embeddings, "misses", 0) - misses
+    report.duplicate_clusters = duplicate_clusters(files)
+    if report.duplicates_collapsed:
+        logger.info("Collapsed %d near-duplicate chunks; %d clusters in index",
+                    report.duplicates_collapsed, len(report.duplicate_clusters))
+
+    if not report.changed:
+        # Only parse failures (retried next time): discard the new version.
+        if vectorstore is not None:
+            vectorstore.docstore.close()
+        shutil.rmtree(index_dir, ignore_errors=True)
+        if files != previous:
+            _save_file_stats(persist_path, files, manifest["files"])
+        vectorstore = load_vectorstore(live_dir, embeddings) if has_index and open_index else None
+    else:
+        with stage(stages, "persist"):
+            if vectorstore is not None:
+                save_vectorstore(vectorstore, index_dir)
+                vectorstore.docstore.seal()
+            dedup.save(os.path.join(index_dir, DEDUP_FILE))
+            lexical.save(os.path.join(index_dir, LEXICAL_FILE))
+            save_manifest(index_dir, {
+                "schema": MANIFEST_SCHEMA,
+                "updated_at": time.time(),
+                "settings": settings,
+                "version": _index_version({**settings, "embedding": embedding_identity(embeddings)}, files),
+                "faiss_index": faiss_state,
+                "embedding": {**embedding_identity(embeddings),
+                              **({"dimension": vectorstore.index.d} if vectorstore is not None else {})},
+                "files": files,
+            })
+            publish_index_dir(persist_path, index_dir)
+            _save_file_stats(persist_path, files, files)  # the new manifest has them all
+        if vectorstore is not None:
+            # Published: from here on the version is only read.
+            vectorstore.docstore.close()
+            vectorstore.docstore = SQLiteDocstore(os.path.join(index_dir, DOCSTORE_FILE), read_only=True)
+            if not open_index:
+                vectorstore.docstore.close()
+                vectorstore = None
+    if vectorstore is not None and vectorstore.index.ntotal == 0:
+        vectorstore = None
+    return vectorstore
@@ -1,12 +1,23 @@
+import logging
 import os
-import time
+import re
+import uuid
+from itertools import chain as chain_events
 from textwrap import dedent
 import streamlit as st
 
-from agent.loader import load_documents
-from agent.vectorstore import load_vectorstore, build_vectorstore
-from agent.chain import build_chain
-from agent.utils import format_timestamp, validate_medical_query
+from agent.startup import StartupProfile, Warmup
+# Only light modules here: FAISS, LangChain and the OpenAI client are imported
+# by the warm-up thread (see "Init QA chain"), so the first page shows at once.
+from agent.ingest_queue import IngestQueue
+from agent.loader import list_document_files
+from agent.tracing import QUERY_STAGES, start_metrics_server, telemetry
+from agent.config import CHAT_WINDOW, SESSION_DB, SESSION_PAGE_SIZE
+from agent.sessions import SessionStore
+from agent.utils import validate_medical_query
+
+logger = logging.getLogger(__name__)
+startup_profile = StartupProfile()  # used if this run starts the agent warm-up
 
 # ---------- Page ----------
 st.set_page_config(
@@ -35,40 +46,140 @@ os.makedirs(docs_path, exist_ok=True)
 os.makedirs(persist_path, exist_ok=True)
 
 # ---------- Session ----------
+# Sessions and messages persist in SQLite; a rerun reads one page of sessions
+# and the latest chat_window messages, however long the history is.
+@st.cache_resource(show_spinner=False)
+def get_session_store():
+    return SessionStore(SESSION_DB)
+
+def get_client_id():
+    """
+    Owner of this browser's chats. Kept in the URL (?client=...) so a reload
+    or bookmark finds them again on any replica; other visitors never see
+    them. Without query params (Streamlit < 1.30) chats last one browser session.
+    """
+    if "client_id" not in st.session_state:
+        client = st.query_params.get("client", "") if hasattr(st, "query_params") else ""
+        if not re.fullmatch(r"[0-9a-f]{32}", client):
+            client = uuid.uuid4().hex
+            if hasattr(st, "query_params"):
+                st.query_params["client"] = client
+        st.session_state.client_id = client
+    return st.session_state.client_id
+
+sessions = get_session_store()
+client_id = get_client_id()
+
 if "initialized" not in st.session_state:
     st.session_state.initialized = True
-    st.session_state.chat_sessions = {}
-    st.session_state.current_session_id = "default"
+    st.session_state.current_session_id = (sessions.latest(owner=client_id) or sessions.create(owner=client_id))["id"]
+    st.session_state.chat_window = CHAT_WINDOW
+    st.session_state.session_page = 0
     st.session_state.processing = False
     st.session_state.last_query = ""
     st.session_state.show_new_chat_modal = False
-    st.session_state.chat_sessions["default"] = {
-        "id": "default", "title": "New Chat", "history": [], "created_at": format_timestamp()
-    }
 
-def create_new_session(session_id=None, title="New Chat"):
-    if session_id is None: session_id = f"chat_{int(time.time())}"
-    st.session_state.chat_sessions[session_id] = {
-        "id": session_id, "title": title, "history": [], "created_at": format_timestamp()
-    }
-    return session_id
+def create_new_session(title="New Chat"):
+    return sessions.create(title, owner=client_id)["id"]
 
 def get_current_session():
-    cid = st.session_state.current_session_id
-    if cid not in st.session_state.chat_sessions:
-        create_new_session(cid, "New Chat")
-    return st.session_state.chat_sessions[cid]
+    session = sessions.get(st.session_state.current_session_id, owner=client_id)
+    if session is None:
+        session = sessions.create(owner=client_id)
+        st.session_state.current_session_id = session["id"]
+    return session
 
 def switch_session(session_id):
-    if session_id in st.session_state.chat_sessions:
+    if sessions.get(session_id, owner=client_id) is not None:
         st.session_state.current_session_id = session_id
+        st.session_state.chat_window = CHAT_WINDOW
         st.session_state.last_query = ""
         return True
     return False
 
-def add_message_to_current_session(role, content):
-    s = get_current_session()
-    s["history"].append({"role": role, "content": content, "timestamp": format_timestamp()})
+def add_message_to_current_session(role, content, **extra):
+    return sessions.add_message(get_current_session()["id"], role, content, **extra)
+
+def format_latency(timings):
+    if not timings: return ""
+    return f" • first token {timings['ttft']:.2f}s • total {timings['total']:.2f}s"
+
+def message_html(message, i):
+    if message["role"] == "user":
+        avatar, name = f"https://api.dicebear.com/6.x/personas/svg?seed=user{i}", "You"
+        css = "user-message"
+    else:
+        avatar, name = f"https://api.dicebear.com/6.x/bottts/svg?seed=assistant{i}", "MedAnalytica Pro"
+        css = "assistant-message"
+    return f"""
+    <div class="{css}">
+      <div class="message-header">
+        <img src="{avatar}" class="avatar"> {name}
+      </div>
+      {message['content']}
+      <div class="timestamp">{message['timestamp']}{format_latency(message.get('timings'))}</div>
+    </div>"""
+
+def latency_html():
+    """Last query's time per stage (mean over recent uncached queries in brackets)."""
+    last = telemetry.last_query()
+    if not last:
+        return "No queries yet"
+    stages, means = last["stages"], telemetry.mean_stages()
+    total = stages.get("total") or 1e-9
+    rows = []
+    for name in QUERY_STAGES:
+        if name not in stages:
+            continue
+        mean = f" ({means[name] * 1000:.0f})" if name in means and not last.get("cached") else ""
+        width = 100 if name == "total" else min(100, stages[name] / total * 100)
+        rows.append(f'<div class="rp-lat"><span>{name.replace("_", " ")}</span>'
+                    f'<span>{stages[name] * 1000:.0f} ms{mean}</span></div>'
+                    f'<div class="rp-lat-bar" style="width:{width:.0f}%"></div>')
+    counts = last.get("counts") or {}
+    if counts:
+        approx = "~" if last.get("tokens_estimated") else ""
+        rows.append(f'<div class="rp-lat"><span>{counts.get("chunks", 0)} chunks</span>'
+                    f'<span>{approx}{counts.get("prompt_tokens", 0)} in / {approx}{counts.get("completion_tokens", 0)} out tokens</span></div>')
+    return "".join(rows)
+
+@st.cache_resource(show_spinner=False)
+def get_ingest_queue():
+    return IngestQueue(docs_path, persist_path)
+
+def upload_key(f):
+    return getattr(f, "file_id", None) or f"{f.name}:{f.size}"
+
+def job_summary(job):
+    if job.status == "failed":
+        return f"❌ Failed: {job.error}"
+    parts = []
+    if job.report is not None:
+        parts.append(f"{len(job.written)} indexed ({job.report.chunks_added} chunks)")
+        failed = [f for f in job.written if f in job.report.failed]
+        if failed: parts.append(f"{len(failed)} unreadable: {', '.join(failed)}")
+    if job.skipped:
+        parts.append(f"{len(job.skipped)} skipped (" + "; ".join(f"{f}: {r}" for f, r in job.skipped.items()) + ")")
+    return "✅ " + (", ".join(parts) or "Nothing to index")
+
+def ingest_status():
+    """Progress of upload jobs; polls while any is running and reruns the app when one finishes."""
+    ingest_queue = get_ingest_queue()
+    seen = st.session_state.setdefault("finished_jobs", set())
+    for job in ingest_queue.jobs()[:3]:
+        if job.finished:
+            st.caption(f"{', '.join(job.files)}: {job_summary(job)}")
+        elif job.status == "indexing":
+            st.progress(job.fraction, text=f"Indexing {job.files_done}/{job.files_total} {job.current_file}")
+        else:
+            st.progress(0.0, text=f"{job.status.capitalize()} {len(job.files)} file(s)…")
+    newly_finished = [job for job in ingest_queue.jobs() if job.finished and job.id not in seen]
+    seen.update(job.id for job in newly_finished)
+    if newly_finished and st.session_state.get("polling_jobs"):
+        # A running agent swaps to the new index by itself; one that found no documents is re-initialized.
+        st.session_state.reinit_agent = not st.session_state.get("agent_ready")
+        st.session_state.polling_jobs = False
+        st.rerun()
 
 def count_uploaded_docs() -> int:
     try:
@@ -87,29 +198,49 @@ with st.sidebar:
     if st.button("🔄 New Chat", use_container_width=True, key="new_chat_btn"):
         st.session_state.show_new_chat_modal = True
     st.markdown("### 📝 Chat History")
-    if st.session_state.chat_sessions:
-        for session_id, session in list(st.session_state.chat_sessions.items()):
-            is_active = session_id == st.session_state.current_session_id
-            render_html(f'<div class="chat-history-item{" active" if is_active else ""}">')
-            if st.button(f'{"🔵" if is_active else "⚪"} {session["title"]}',
-                         key=f"session_{session_id}", use_container_width=True):
-                if switch_session(session_id): st.rerun()
-            render_html("</div>")
-    else:
-        st.info("No chat history yet"); create_new_session("default","New Chat")
+    page, pages = st.session_state.session_page, max(1, -(-sessions.count(owner=client_id) // SESSION_PAGE_SIZE))
+    for session in sessions.list_sessions(page * SESSION_PAGE_SIZE, SESSION_PAGE_SIZE, owner=client_id):
+        session_id = session["id"]
+        is_active = session_id == st.session_state.current_session_id
+        render_html(f'<div class="chat-history-item{" active" if is_active else ""}">')
+        if st.button(f'{"🔵" if is_active else "⚪"} {session["title"]}',
+                     key=f"session_{session_id}", use_container_width=True):
+            if switch_session(session_id): st.rerun()
+        render_html("</div>")
+    if pages > 1:
+        prev_col, page_col, next_col = st.columns([1, 2, 1])
+        with prev_col:
+            if st.button("◀", key="sessions_prev", disabled=page == 0):
+                st.session_state.session_page = page - 1; st.rerun()
+        with page_col:
+            st.caption(f"Page {page + 1} of {pages}")
+        with next_col:
+            if st.button("▶", key="sessions_next", disabled=page >= pages - 1):
+                st.session_state.session_page = page + 1; st.rerun()
     st.markdown("---")
     with st.expander("📁 Document Management", expanded=True):
         render_html('<div class="upload-section"><p><strong>Supported formats:</strong> PDF, DOCX, TXT</p><p><strong>Size limit:</strong> 200MB per file</p></div>')
         uploaded_files = st.file_uploader("Upload medical documents", type=["pdf","docx","txt"],
                                           accept_multiple_files=True, label_visibility="collapsed", key="file_uploader")
         if uploaded_files:
-            ok = 0
-            for f in uploaded_files:
-                try:
-                    with open(os.path.join(docs_path, f.name), "wb") as out: out.write(f.getbuffer()); ok += 1
-                except Exception as e:
-                    st.error(f"Error uploading {f.name}: {e}")
-            if ok: st.success(f"✅ {ok} file(s) uploaded successfully!"); st.info("Documents will be processed automatically.")
+            # The widget hands back the same files on every rerun; queue each upload once.
+            submitted = st.session_state.setdefault("submitted_uploads", set())
+            new_files = [f for f in uploaded_files if upload_key(f) not in submitted]
+            if new_files:
+                get_ingest_queue().submit((f.name, f.getvalue()) for f in new_files)
+                submitted.update(upload_key(f) for f in new_files)
+                st.info(f"📥 {len(new_files)} file(s) queued for indexing.")
+        polling = bool(get_ingest_queue().active())
+        st.session_state.polling_jobs = st.session_state.get("polling_jobs") or polling
+        # Re-run only this part every second while jobs are running (st.fragment needs Streamlit 1.37+).
+        if hasattr(st, "fragment"):
+            st.fragment(run_every=1.0 if polling else None)(ingest_status)()
+        else:
+            ingest_status()
+        # Scopes retrieval to one file (agent.filters); "source:", "type:", "year:" etc. also work inline.
+        scope_options = ["All documents"] + list_document_files(docs_path)
+        st.selectbox("🔎 Search within", scope_options, key="search_scope",
+                     help='Or type filters in the question, e.g. type:pdf year:2020 or source:electrocardiograms')
 
 # ---------- Center wrap + header ----------
 render_html('<div class="center-wrap"><div class="main-wrap">')
@@ -125,61 +256,99 @@ render_html("""
 """)
 
 # ---------- Init QA chain ----------
-@st.cache_resource(show_spinner=False)
-def initialize_ai_agent():
+def initialize_ai_agent(profile):
+    """(chain, status message, index update note); runs on the warm-up thread, so no st.* calls."""
     try:
-        files = [f for f in os.listdir(docs_path) if f.endswith((".pdf",".docx",".txt"))]
+        files = list_document_files(docs_path)
         if not files:
-            return None, "📁 No medical documents found. Please upload PDF, DOCX, or TXT files in the sidebar."
-        if not os.path.exists(f"{persist_path}/index.faiss"):
-            with st.spinner("🔍 Indexing medical documents... This may take a few moments."):
-                docs = load_documents(docs_path)
-                if not docs:
-                    return None, "❌ No readable content found in documents. Please check your file formats."
-                _ = build_vectorstore(docs, persist_path)
-                st.success("✅ Documents indexed successfully!")
-        vs = load_vectorstore(persist_path)
-        return build_chain(vs), "✅ Cardiovascular AI agent ready!"
+            return None, "📁 No medical documents found. Please upload PDF, DOCX, or TXT files in the sidebar.", None
+        start_metrics_server()
+        profile.import_modules()
+        from agent.answer_cache import AnswerCache, CachedQAChain
+        from agent.chain import build_chain
+        from agent.live_index import LiveChain
+        from agent.vectorstore import get_embeddings, sync_vectorstore
+        embeddings = get_embeddings(persist_path)
+        with profile.stage("sync"):
+            # LiveChain opens the published index (memory-mapped) below; don't read it twice.
+            _, report = sync_vectorstore(docs_path, persist_path, embeddings, open_index=False)
+        note = (f"✅ Index updated: {len(report.added)} added, {len(report.updated)} changed, "
+                f"{len(report.removed)} removed ({report.chunks_added} chunks embedded).") if report.changed else None
+
+        def build(vs, lexical):
+            if "chain_build" in profile.stages:  # a later index swap, not startup
+                return build_chain(vs, lexical_index=lexical)
+            with profile.stage("chain_build"):
+                return build_chain(vs, lexical_index=lexical)
+
+        with profile.stage("index_load"):
+            try:
+                live = LiveChain(persist_path, build, embeddings=embeddings)
+            except FileNotFoundError:  # nothing published with vectors
+                return None, "❌ No readable content found in documents. Please check your file formats.", None
+        profile.stages["index_load"] -= profile.stages.get("chain_build", 0.0)
+        chain = CachedQAChain(live, AnswerCache(live.embeddings), index_version=live.current_version)
+        return chain, "✅ Cardiovascular AI agent ready!", note
     except Exception as e:
         msg = str(e)
         if any(k in msg.lower() for k in ("api_key","openai","openai_api_key")):
-            return None, "🔑 OpenAI API key required. Please add OPENAI_API_KEY to your environment or .env file."
-        return None, f"❌ Error initializing AI agent: {msg}"
+            return None, "🔑 OpenAI API key required. Please add OPENAI_API_KEY to your environment or .env file.", None
+        return None, f"❌ Error initializing AI agent: {msg}", None
+    finally:
+        profile.mark("ready")
 
-qa_chain, status_message = initialize_ai_agent()
-if not qa_chain: st.error(status_message)
+@st.cache_resource(show_spinner=False)
+def get_agent_warmup(_profile):
+    return Warmup(lambda: initialize_ai_agent(_profile), name="agent-warmup"), _profile
+
+@st.cache_resource(show_spinner=False)
+def log_startup(_profile):
+    """Once per process: log the cold-start profile and export it to telemetry."""
+    logger.info("Startup profile: %s", _profile.as_dict())
+    telemetry.record_startup(_profile.summary())
+    return True
+
+def agent_warmup_status():
+    """Shown while the agent loads; reruns the app once it is ready."""
+    if warmup.ready:
+        st.rerun()
+    st.info("⏳ Loading the medical document index… you can browse chats and upload documents meanwhile.")
+
+if st.session_state.pop("reinit_agent", False):
+    get_agent_warmup.clear()
+warmup, agent_profile = get_agent_warmup(startup_profile)
+if not warmup.ready:
+    # Poll every second from a fragment (Streamlit 1.37+); older versions wait here as before.
+    if hasattr(st, "fragment"):
+        st.fragment(run_every=1.0)(agent_warmup_status)()
+    else:
+        with st.spinner("🔍 Syncing medical document index..."):
+            warmup.wait()
+qa_chain, status_message, index_note = warmup.result if warmup.ready else (None, None, None)
+# While loading, finished uploads are picked up by the warm-up itself.
+st.session_state.agent_ready = bool(qa_chain) or not warmup.ready
+if warmup.ready and not qa_chain: st.error(status_message)
+if index_note and st.session_state.get("index_note_shown") != index_note:
+    st.session_state.index_note_shown = index_note
+    st.success(index_note)
 
 # ---------- Chat viewport (scrolls) ----------
 render_html('<div class="chat-viewport"><div class="chat-container">')
 
-try:
-    current_session = get_current_session()
-except KeyError:
-    st.session_state.chat_sessions = {}; st.session_state.current_session_id = "default"
-    create_new_session("default","New Chat"); current_session = get_current_session()
+current_session = get_current_session()
+history = sessions.messages(current_session["id"], st.session_state.chat_window)
 
-if not current_session["history"]:
+if not history:
     render_html('<div style="text-align:center; color:#98a2b3; padding:24px;">Start a conversation using the input below.</div>')
 else:
-    for i, message in enumerate(current_session["history"]):
-        if message["role"] == "user":
-            render_html(f"""
-            <div class="user-message">
-              <div class="message-header">
-                <img src="https://api.dicebear.com/6.x/personas/svg?seed=user{i}" class="avatar"> You
-              </div>
-              {message['content']}
-              <div class="timestamp">{message['timestamp']}</div>
-            </div>""")
-        else:
-            render_html(f"""
-            <div class="assistant-message">
-              <div class="message-header">
-                <img src="https://api.dicebear.com/6.x/bottts/svg?seed=assistant{i}" class="avatar"> MedAnalytica Pro
-              </div>
-              {message['content']}
-              <div class="timestamp">{message['timestamp']}</div>
-            </div>""")
+    older = current_session["message_count"] - len(history)
+    if older > 0 and st.button(f"⬆️ Load older messages ({older} more)", key="load_older"):
+        st.session_state.chat_window += CHAT_WINDOW; st.rerun()
+    for message in history:
+        render_html(message_html(message, message["seq"]))
+
+# Filled token by token while an answer streams in.
+stream_slot = st.empty()
 
 if st.session_state.processing:
     render_html("""
@@ -195,9 +364,25 @@ render_html("</div></div>")   # close chat-container + chat-viewport
 render_html("</div></div>")   # close main-wrap + center-wrap
 
 # ---------- Right sidebar (capabilities + info) ----------
+def startup_html():
+    """Cold-start timings: time to first page and to a usable agent, and the slowest steps."""
+    marks, stages = agent_profile.marks, agent_profile.summary()
+    rows = [f'<div class="rp-lat"><span>{name}</span><span>{marks[name]:.2f} s</span></div>'
+            for name in ("interactive", "ready") if name in marks]
+    steps = {k: v for k, v in stages.items() if k not in marks}
+    for name, seconds in sorted(steps.items(), key=lambda item: -item[1])[:4]:
+        rows.append(f'<div class="rp-lat"><span>{name.replace("_", " ")}</span><span>{seconds:.2f} s</span></div>')
+    return "".join(rows) or "Loading…"
+
 def right_sidebar():
     docs_count = count_uploaded_docs()
     sess = get_current_session()
+    cache = qa_chain.cache.stats() if qa_chain else None
+    cache_html = (
+        f"<strong>{cache['hit_rate']:.0%}</strong> hit rate "
+        f"({cache['exact_hits'] + cache['semantic_hits']} hits / {cache['misses']} misses, {cache['entries']} cached)"
+        if cache else "Unavailable"
+    )
     render_html(f"""
     <aside class="right-pane">
       <div class="rp-section">
@@ -241,12 +426,27 @@ def right_sidebar():
         <div class="rp-card"><strong>{docs_count}</strong> uploaded (PDF/DOCX/TXT)</div>
       </div>
 
+      <div class="rp-section">
+        <div class="rp-title">Answer cache</div>
+        <div class="rp-card">{cache_html}</div>
+      </div>
+
+      <div class="rp-section">
+        <div class="rp-title">Latency (ms)</div>
+        <div class="rp-card">{latency_html()}</div>
+      </div>
+
+      <div class="rp-section">
+        <div class="rp-title">Startup</div>
+        <div class="rp-card">{startup_html()}</div>
+      </div>
+
       <div class="rp-section">
         <div class="rp-title">Session</div>
         <div class="rp-card">
           <div><strong>Title:</strong> {sess['title']}</div>
           <div><strong>Created:</strong> {sess['created_at']}</div>
-          <div><strong>Messages:</strong> {len(sess['history'])}</div>
+          <div><strong>Messages:</strong> {sess['message_count']}</div>
         </div>
       </div>
     </aside>
@@ -282,7 +482,8 @@ if st.session_state.show_new_chat_modal:
     c1, c2 = st.columns(2)
     with c1:
         if st.button("✅ Start New Chat", key="confirm_new", use_container_width=True):
-            st.session_state.current_session_id = create_new_session(title="New Chat")
+            switch_session(create_new_session(title="New Chat"))
+            st.session_state.session_page = 0
             st.session_state.show_new_chat_modal = False
             st.session_state.last_query = ""
             st.rerun()
@@ -293,24 +494,44 @@ if st.session_state.show_new_chat_modal:
 
 # ---------- Handle query ----------
 if submit_btn and query and query != st.session_state.last_query:
-    if not qa_chain:
+    if not warmup.ready:
+        st.info("⏳ The AI agent is still loading; please ask again in a moment.")
+    elif not qa_chain:
         st.error("❌ AI agent not ready. Please check the status above.")
     elif not validate_medical_query(query):
         st.warning("⚠️ Please ask a medically relevant question about cardiovascular health.")
     else:
         st.session_state.processing = True
         st.session_state.last_query = query
-        add_message_to_current_session("user", query)
+        user_message = add_message_to_current_session("user", query)
         try:
-            with st.spinner("🤔 Analyzing with medical AI..."):
-                resp = qa_chain.invoke(query)
-                answer = resp.get("result", "I couldn't generate a response based on the available medical documents.")
-                add_message_to_current_session("assistant", answer)
-                if len(get_current_session()["history"]) == 2:
-                    words = query.split()[:3]
-                    get_current_session()["title"] = " ".join(words) + ("..." if len(query.split()) > 3 else "")
+            user_html = message_html(user_message, user_message["seq"])
+            answer, timings, partial = "", None, []
+            scope = st.session_state.get("search_scope", "All documents")
+            request = query if scope == "All documents" else {"query": query, "filter": {"source": [scope]}}
+            with st.spinner("🔍 Searching medical documents..."):
+                events = qa_chain.stream(request)
+                first = next(events)  # retrieval, or the whole answer on a cache hit
+            for event in chain_events([first], events):
+                if event["type"] == "token":
+                    partial.append(event["text"])
+                    streaming = {"role": "assistant", "content": "".join(partial), "timestamp": "streaming…"}
+                    stream_slot.markdown(dedent(user_html + message_html(streaming, user_message["seq"] + 1)),
+                                         unsafe_allow_html=True)
+                elif event["type"] == "done":
+                    answer, timings = event["result"], event["timings"]
+            answer = answer or "I couldn't generate a response based on the available medical documents."
+            add_message_to_current_session("assistant", answer, timings=timings)
+            if user_message["seq"] == 0:
+                words = query.split()[:3]
+                sessions.rename(current_session["id"], " ".join(words) + ("..." if len(query.split()) > 3 else ""))
         except Exception as e:
             add_message_to_current_session("assistant", f"❌ Error: {e}")
         finally:
             st.session_state.processing = False
-            st.rerun()
\ No newline at end of file
+            st.rerun()
+
+# ---------- Startup profile ----------
+agent_profile.mark("interactive")  # first page fully rendered (kept from the first run only)
+if warmup.ready:
+    log_startup(agent_profile)
\ No newline at end of file
@@ -0,0 +1,6 @@
+"""Run the suite offline: approximate token counts and the local embedding backend."""
+
+import os
+
+os.environ.setdefault("TIKTOKEN_ENCODING", "approx")
+os.environ.setdefault("EMBEDDING_BACKEND", "local")
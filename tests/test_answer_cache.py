@@ -0,0 +1,97 @@
+"""Answer cache: exact and semantic hits, expiry, index versions and scopes"""
+
+import pytest
+
+from agent import answer_cache
+from agent.answer_cache import AnswerCache, CachedQAChain, normalize_query
+from agent.embeddings import LocalEmbeddings
+
+RESPONSE = {"query": "q", "result": "an answer"}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_normalize_query():
+    assert normalize_query("  What is   HbA1c?? ") == normalize_query("what is hba1c") == "what is hba1c"
+
+
+def test_exact_hit_and_miss():
+    cache = AnswerCache()
+    cache.put("What is HbA1c?", RESPONSE)
+    assert cache.get("what is hba1c")[0] == RESPONSE
+    assert cache.get("What is troponin?")[0] is None
+    assert cache.stats()["exact_hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = AnswerCache(ttl=60)
+    cache.put("What is HbA1c?", RESPONSE)
+    clock[0] += 59
+    assert cache.get("What is HbA1c?")[0] == RESPONSE
+    clock[0] += 2
+    assert cache.get("What is HbA1c?")[0] is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_new_index_version_clears_the_cache():
+    cache = AnswerCache()
+    cache.put("What is HbA1c?", RESPONSE, version="v1")
+    assert cache.get("What is HbA1c?", version="v1")[0] == RESPONSE
+    assert cache.get("What is HbA1c?", version="v2")[0] is None
+    assert cache.get("What is HbA1c?", version="v1")[0] is None
+
+
+def test_scopes_are_separate():
+    cache = AnswerCache()
+    cache.put("What was the AUC?", RESPONSE, scope=(("source", ("ecg",)),))
+    assert cache.get("What was the AUC?")[0] is None
+    assert cache.get("What was the AUC?", scope=(("source", ("diet",)),))[0] is None
+    assert cache.get("What was the AUC?", scope=(("source", ("ecg",)),))[0] == RESPONSE
+
+
+def test_lru_bound():
+    cache = AnswerCache(max_entries=2)
+    for q in ("a", "b", "c"):
+        cache.put(q, RESPONSE)
+    assert cache.get("a")[0] is None and cache.get("c")[0] == RESPONSE
+
+
+def test_semantic_hit_for_a_reworded_question():
+    cache = AnswerCache(LocalEmbeddings(256), threshold=0.8, mode="hybrid")
+    cache.put("What biomarkers predict heart disease in adults", RESPONSE)
+    assert cache.get("Which biomarkers predict heart disease in adults")[0] == RESPONSE
+    assert cache.get("How much fibre is in a low-fibre diet")[0] is None
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_lexical_mode_never_embeds():
+    class Exploding(LocalEmbeddings):
+        def embed_query(self, text):
+            raise AssertionError("embedded in lexical mode")
+
+    cache = AnswerCache(Exploding(), threshold=0.5, mode="lexical")
+    cache.put("What is HbA1c?", RESPONSE)
+    assert cache.get("What is troponin?")[0] is None
+
+
+def test_cached_chain_invalidates_on_version_change():
+    class Chain:
+        calls = 0
+
+        def invoke(self, query):
+            self.calls += 1
+            return {"query": query, "result": f"answer {self.calls}"}
+
+    version = ["v1"]
+    inner = Chain()
+    chain = CachedQAChain(inner, AnswerCache(), index_version=lambda: version[0])
+    assert chain.invoke("What is HbA1c?")["cached"] is False
+    assert chain.invoke("what is hba1c")["cached"] is True
+    version[0] = "v2"
+    response = chain.invoke("What is HbA1c?")
+    assert response["cached"] is False and response["result"] == "answer 2"
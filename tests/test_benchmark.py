@@ -0,0 +1,31 @@
+"""benchmark.compare: relative tolerance plus an absolute floor"""
+
+from agent.benchmark import compare
+
+
+def results(p95_ms=0.5, build_seconds=0.3, qps=80.0, docs_per_s=30.0):
+    return {"runs": [{
+        "size": 10,
+        "ingest": {"docs_per_s": docs_per_s},
+        "build": {"seconds": build_seconds},
+        "load": {"mmap_seconds": 0.002, "read_seconds": 0.002},
+        "retrieval": {"p50_ms": 0.4, "p95_ms": p95_ms, "p99_ms": 1.0},
+        "e2e": [{"concurrency": 1, "qps": qps, "p95_ms": 40.0}],
+    }]}
+
+
+def test_sub_millisecond_noise_is_ignored():
+    assert compare(results(), results(p95_ms=0.9)) == []
+    assert compare(results(), results(p95_ms=0.9), min_delta_ms=0) == [
+        "size=10 retrieval.p95_ms: 0.5 -> 0.9 (+80% worse)"]
+
+
+def test_real_regressions_are_reported():
+    regressions = compare(results(), results(p95_ms=5.0, build_seconds=0.6, qps=40.0, docs_per_s=10.0))
+    assert [line.split()[1] for line in regressions] == [
+        "ingest.docs_per_s:", "build.seconds:", "retrieval.p95_ms:", "e2e.c1.qps:"]
+
+
+def test_improvements_and_small_relative_changes_pass():
+    assert compare(results(), results(p95_ms=0.1, qps=200.0)) == []
+    assert compare(results(), results(build_seconds=0.35)) == []
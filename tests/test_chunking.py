@@ -0,0 +1,97 @@
+"""Token-aware chunking and tokenizer loading"""
+
+import os
+
+import pytest
+
+from agent import chunking, vectorstore
+from agent.chunking import TokenizerUnavailableError, chunk_documents, count_tokens, get_encoding, split_text
+from agent.embeddings import LocalEmbeddings
+from agent.vectorstore import current_index_dir, load_manifest, sync_vectorstore
+
+TEXT = "\n".join(f"Line {i} reports troponin, HbA1c and blood pressure for patient {i}." for i in range(40))
+
+
+def test_approx_counts_words_and_punctuation():
+    assert get_encoding("approx") is None
+    assert count_tokens("Hello, world!", "approx") == 4
+
+
+def test_split_text_respects_budget_and_overlap():
+    chunks = split_text(TEXT, chunk_tokens=60, overlap_tokens=20, encoding="approx")
+    assert len(chunks) > 1
+    assert all(tokens <= 60 for _, _, tokens in chunks)
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(TEXT)
+    for (_, prev_end, _), (start, end, _) in zip(chunks, chunks[1:]):
+        assert start < prev_end < end
+        assert count_tokens(TEXT[start:prev_end], "approx") <= 20
+
+
+def test_chunk_documents_records_offsets():
+    from langchain_core.documents import Document
+
+    doc = Document(page_content=TEXT, metadata={"source": "a.txt", "page": 3})
+    chunks = chunk_documents([doc], chunk_tokens=60, overlap_tokens=0, encoding="approx")
+    assert [c.metadata["chunk"] for c in chunks] == list(range(len(chunks)))
+    for chunk in chunks:
+        assert chunk.metadata["page"] == 3
+        assert chunk.page_content == TEXT[chunk.metadata["start_index"]:chunk.metadata["end_index"]]
+        assert chunk.metadata["tokens"] == count_tokens(chunk.page_content, "approx")
+
+
+@pytest.fixture
+def flaky_tiktoken(monkeypatch):
+    """tiktoken.get_encoding fails the first `failures[0]` calls."""
+    tiktoken = pytest.importorskip("tiktoken")
+    failures = [0]
+    calls = []
+
+    def get(name):
+        calls.append(name)
+        if len(calls) <= failures[0]:
+            raise ConnectionError("download timed out")
+        return object()
+
+    monkeypatch.setattr(tiktoken, "get_encoding", get)
+    monkeypatch.setattr(chunking.time, "sleep", lambda seconds: None)
+    get_encoding.cache_clear()
+    yield failures, calls
+    get_encoding.cache_clear()
+
+
+def test_transient_load_failures_are_retried(flaky_tiktoken, monkeypatch):
+    failures, calls = flaky_tiktoken
+    monkeypatch.setattr(chunking, "TIKTOKEN_LOAD_RETRIES", 2)
+    failures[0] = 2
+    assert get_encoding("test-encoding") is not None
+    assert len(calls) == 3
+
+
+def test_load_failure_is_loud_and_not_cached(flaky_tiktoken, monkeypatch):
+    failures, calls = flaky_tiktoken
+    monkeypatch.setattr(chunking, "TIKTOKEN_LOAD_RETRIES", 0)
+    failures[0] = 1
+    with pytest.raises(TokenizerUnavailableError, match="TIKTOKEN_ENCODING=approx"):
+        get_encoding("test-encoding")
+    assert get_encoding("test-encoding") is not None
+
+
+def test_sync_stops_when_the_tokenizer_is_unavailable(flaky_tiktoken, tmp_path, monkeypatch):
+    failures, _ = flaky_tiktoken
+    monkeypatch.chdir(tmp_path)
+    docs, persist_path = tmp_path / "docs", str(tmp_path / "idx")
+    docs.mkdir()
+    (docs / "a.txt").write_text(TEXT)
+    embeddings = LocalEmbeddings(64)
+    sync_vectorstore(str(docs), persist_path, embeddings)
+    published = current_index_dir(persist_path)
+
+    monkeypatch.setattr(chunking, "TIKTOKEN_LOAD_RETRIES", 0)
+    monkeypatch.setattr(vectorstore, "TIKTOKEN_ENCODING", "test-encoding")
+    failures[0] = 1
+    (docs / "b.txt").write_text(TEXT.upper())
+    with pytest.raises(TokenizerUnavailableError):
+        sync_vectorstore(str(docs), persist_path, embeddings)
+    assert current_index_dir(persist_path) == published
+    assert load_manifest(published)["settings"]["encoding"] == "approx"
+    assert sorted(os.listdir(os.path.join(persist_path, "versions"))) == [os.path.basename(published)]
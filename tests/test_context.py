@@ -0,0 +1,82 @@
+"""Context packing: token budget, overlap handling and MMR ordering"""
+
+from langchain_core.documents import Document
+
+from agent.chunking import count_tokens
+from agent.context import ContextBuilder
+
+UNIT = " ".join(f"w{i}" for i in range(200))
+
+
+def passage(start, end, source="a.pdf", page=0):
+    text = UNIT[start:end]
+    return Document(page_content=text, metadata={"source": source, "page": page, "start_index": start,
+                                                 "end_index": end, "tokens": count_tokens(text)})
+
+
+def words(n, prefix):
+    text = " ".join(f"{prefix}{i}" for i in range(n))
+    return Document(page_content=text, metadata={"source": f"{prefix}.txt", "tokens": n})
+
+
+def test_packs_within_budget_skipping_passages_that_do_not_fit():
+    docs = [words(40, "a"), words(50, "b"), words(30, "c"), words(5, "d")]
+    packed, stats = ContextBuilder(token_budget=80).build("q", docs, embed_query=False)
+    assert [d.metadata["source"] for d in packed] == ["a.txt", "c.txt", "d.txt"]
+    assert stats["context_tokens"] <= 80
+    assert stats["tokens_saved"] == stats["candidate_tokens"] - stats["context_tokens"]
+
+
+def test_first_passage_larger_than_budget_is_truncated():
+    packed, stats = ContextBuilder(token_budget=10).build("q", [words(50, "a"), words(5, "b")], embed_query=False)
+    assert packed[0].metadata["truncated"] is True
+    assert count_tokens(packed[0].page_content) <= 10
+    assert stats["context_tokens"] <= 10
+
+
+def test_mostly_covered_passage_is_dropped():
+    first, second = passage(0, 300), passage(50, 320)
+    packed, stats = ContextBuilder(token_budget=1000).build("q", [first, second], embed_query=False)
+    assert packed == [first]
+    assert stats["overlaps_dropped"] == 1
+
+
+def test_small_overlap_is_trimmed_off():
+    first, second = passage(0, 300), passage(280, 600)
+    packed, stats = ContextBuilder(token_budget=1000).build("q", [first, second], embed_query=False)
+    trimmed = packed[1]
+    assert trimmed.metadata["trimmed"] is True
+    assert trimmed.metadata["start_index"] >= 300
+    assert trimmed.page_content == UNIT[trimmed.metadata["start_index"]:600]
+    assert stats["overlaps_trimmed"] == 1
+
+
+def test_other_units_never_overlap():
+    first, second = passage(0, 300), passage(0, 300, page=1)
+    packed, _ = ContextBuilder(token_budget=1000).build("q", [first, second], embed_query=False)
+    assert packed == [first, second]
+
+
+class TableEmbeddings:
+    """Embeddings looked up from a {text: vector} table."""
+
+    def __init__(self, table):
+        self.table = table
+
+    def embed_query(self, text):
+        return self.table[text]
+
+    def embed_documents(self, texts):
+        return [self.table[t] for t in texts]
+
+
+def test_mmr_moves_a_near_duplicate_behind_a_different_passage():
+    a, a2, b = words(5, "a"), words(5, "aa"), words(5, "b")
+    table = {"q": [1.0, 0.0], a.page_content: [1.0, 0.0], a2.page_content: [0.99, 0.14],
+             b.page_content: [0.6, 0.8]}
+    builder = ContextBuilder(TableEmbeddings(table), token_budget=1000, lambda_mult=0.3)
+    packed, _ = builder.build("q", [a, a2, b])
+    assert [d.metadata["source"] for d in packed] == ["a.txt", "b.txt", "aa.txt"]
+    # With no query vector and embed_query=False (lexical retrieval) the order is kept.
+    packed, _ = builder.build("q", [a, a2, b], embed_query=False)
+    assert [d.metadata["source"] for d in packed] == ["a.txt", "aa.txt", "b.txt"]
@@ -0,0 +1,42 @@
+"""MinHash near-duplicate detection"""
+
+from agent.dedup import NearDuplicateIndex, duplicate_clusters, minhash_signature, similarity
+
+TEXT = ("Elevated troponin after exercise predicts adverse cardiac events in adults with stable angina, "
+        "independent of age, blood pressure and HbA1c at baseline. Patients with persistent elevation were "
+        "referred for echocardiography within two weeks, and those with reduced ejection fraction started "
+        "guideline-directed therapy before discharge from the cardiology clinic.")
+UNRELATED = "Sodium restriction lowered systolic pressure, but edema and dyspnea did not change at follow-up."
+
+
+def test_signature_ignores_case_and_spacing():
+    assert minhash_signature(TEXT) == minhash_signature("  " + TEXT.upper().replace(" ", "\n"))
+    assert similarity(minhash_signature(TEXT), minhash_signature(UNRELATED)) < 0.2
+
+
+def test_find_returns_the_near_duplicate_only():
+    index = NearDuplicateIndex(threshold=0.8)
+    index.add("a#0", minhash_signature(TEXT))
+    index.add("b#0", minhash_signature(UNRELATED))
+    assert index.find(minhash_signature(TEXT.replace("clinic", "service"))) == "a#0"
+    assert index.find(minhash_signature("Flavonoid intake and diet diversity in older women.")) is None
+
+
+def test_removed_chunks_are_not_found(tmp_path):
+    index = NearDuplicateIndex()
+    index.add("a#0", minhash_signature(TEXT))
+    path = str(tmp_path / "dedup.json")
+    index.save(path)
+    index.remove("a#0")
+    assert index.find(minhash_signature(TEXT)) is None
+    assert NearDuplicateIndex.load(path).find(minhash_signature(TEXT)) == "a#0"
+    assert NearDuplicateIndex.load(str(tmp_path / "missing.json")).signatures == {}
+
+
+def test_clusters_list_the_owner_first():
+    files = {
+        "copy.txt": {"ids": [], "duplicate_of": ["owner.txt#0"]},
+        "owner.txt": {"ids": ["owner.txt#0", "owner.txt#1"], "duplicate_of": []},
+        "third.txt": {"ids": ["third.txt#0"], "duplicate_of": ["owner.txt#0"]},
+    }
+    assert duplicate_clusters(files) == {"owner.txt#0": ["owner.txt", "copy.txt", "third.txt"]}
@@ -0,0 +1,100 @@
+"""Batched embedding calls, retries, the local backend and index identity checks"""
+
+import threading
+
+import numpy as np
+import pytest
+
+from agent import embeddings as embeddings_module
+from agent.embeddings import BatchedEmbeddings, LocalEmbeddings, embedding_identity, embedding_mismatch
+
+
+class RateLimitError(Exception):
+    """Named like the OpenAI client's error, which is how retries recognise it."""
+
+    def __init__(self, retry_after=None):
+        super().__init__("rate limited")
+        self.response = type("Response", (), {"headers": {"retry-after": retry_after}})()
+
+
+class Backend:
+    """Raw batch call that records batch sizes and fails as scripted."""
+
+    def __init__(self, failures=()):
+        self.batches = []
+        self.failures = list(failures)
+        self.lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self.lock:
+            self.batches.append(len(texts))
+            if self.failures:
+                raise self.failures.pop(0)
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(embeddings_module.time, "sleep", slept.append)
+    return slept
+
+
+def test_texts_are_split_by_count_and_tokens_and_kept_in_order():
+    backend = Backend()
+    batched = BatchedEmbeddings(backend, "test", "m", batch_size=3, max_batch_tokens=10_000, concurrency=3)
+    texts = [f"text number {i}" * (i + 1) for i in range(8)]
+    assert batched.embed_documents(texts) == [[float(len(t)), 1.0] for t in texts]
+    assert sorted(backend.batches) == [2, 3, 3]
+    assert batched.dimension == 2
+
+    by_tokens = BatchedEmbeddings(Backend(), "test", "m", batch_size=100, max_batch_tokens=5)
+    assert len(by_tokens._batches(["one two three", "four five six", "seven"])) == 2
+    assert by_tokens.embed_documents([]) == []
+
+
+def test_rate_limits_are_retried_and_shrink_the_batch(sleeps):
+    backend = Backend([RateLimitError(retry_after="3"), RateLimitError()])
+    batched = BatchedEmbeddings(backend, "test", "m", batch_size=64, base_delay=1.0)
+    assert batched.embed_query("LDL-C") == [5.0, 1.0]
+    assert batched.retries == 2
+    assert batched.batch_size == 16
+    assert 3.0 <= sleeps[0] <= 3.75  # Retry-After, plus jitter
+    assert 1.0 <= sleeps[1] <= 1.25 * 2
+
+
+def test_batch_size_grows_back_after_clean_batches(sleeps):
+    batched = BatchedEmbeddings(Backend([RateLimitError()]), "test", "m", batch_size=8, max_batch_size=8)
+    batched.embed_query("first")
+    assert batched.batch_size == 4
+    for _ in range(10):
+        batched.embed_query("again")
+    assert batched.batch_size == 5
+
+
+def test_other_errors_and_exhausted_retries_raise(sleeps):
+    with pytest.raises(ValueError):
+        BatchedEmbeddings(Backend([ValueError("bad input")]), "test", "m").embed_query("x")
+    assert sleeps == []
+    with pytest.raises(RateLimitError):
+        BatchedEmbeddings(Backend([RateLimitError()] * 3), "test", "m", max_retries=2).embed_query("x")
+    assert len(sleeps) == 2
+
+
+def test_local_embeddings_are_deterministic_and_normalized():
+    local = LocalEmbeddings(128)
+    a, b, c = np.array(local.embed_documents(["LDL-C was lowered by statins", "statins lowered LDL-C", "ECG"]))
+    assert np.allclose(np.linalg.norm([a, b, c], axis=1), 1.0)
+    assert a @ b > a @ c
+    assert local.embed_query("statins lowered LDL-C") == list(b)
+    assert local.embed_documents([""]) == [[0.0] * 128]
+
+
+def test_indexes_built_with_other_embeddings_are_refused():
+    local = LocalEmbeddings(64)
+    identity = embedding_identity(local)
+    assert identity == {"backend": "local", "model": "local-hash-v1", "dimension": 64}
+    assert embedding_mismatch(identity, local) is None
+    assert embedding_mismatch(None, local, index_dimension=64) is None
+    assert "dimension" in embedding_mismatch(None, local, index_dimension=1536)
+    assert "backend" in embedding_mismatch({**identity, "backend": "openai"}, local)
@@ -0,0 +1,62 @@
+"""Configurable FAISS index types and the flat fallback for small corpora"""
+
+import random
+
+import numpy as np
+import pytest
+
+from agent import faiss_index, vectorstore
+from agent.embeddings import LocalEmbeddings
+from agent.faiss_index import build_description, build_faiss_index, built_spec, index_spec
+from agent.vectorstore import current_index_dir, load_manifest, sync_vectorstore
+
+WORDS = ("troponin hba1c ldl hdl angina edema dyspnea plaque fibre flavonoid ecg auc cohort adults "
+         "risk pressure sodium statin arrhythmia biomarker echocardiography ejection fraction").split()
+
+
+def test_too_few_vectors_build_flat():
+    spec = index_spec("ivf")
+    vectors = np.random.RandomState(0).rand(10, 16).astype(np.float32)
+    index = build_faiss_index(vectors, spec)
+    assert build_description(spec, 16, 10) == "Flat"
+    assert built_spec(index, spec) == {"type": "flat"}
+    assert built_spec(build_faiss_index(vectors, index_spec("flat")), index_spec("flat")) == {"type": "flat"}
+
+
+def test_enough_vectors_build_the_requested_type():
+    spec = index_spec("ivf")
+    vectors = np.random.RandomState(0).rand(100, 16).astype(np.float32)
+    assert built_spec(build_faiss_index(vectors, spec), spec) == spec
+
+
+def write_files(folder, start, count):
+    rng = random.Random(start)
+    for i in range(start, start + count):
+        (folder / f"doc{i}.txt").write_text(" ".join(rng.choice(WORDS) + str(rng.randrange(1000)) for _ in range(40)))
+
+
+@pytest.fixture
+def ivf(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(vectorstore, "index_spec", lambda: faiss_index.index_spec("ivf"))
+    return faiss_index.index_spec("ivf")
+
+
+def test_manifest_records_the_fallback_and_retries_once_trainable(ivf, tmp_path):
+    docs, persist_path, embeddings = tmp_path / "docs", str(tmp_path / "idx"), LocalEmbeddings(16)
+    docs.mkdir()
+    write_files(docs, 0, 5)
+    sync_vectorstore(str(docs), persist_path, embeddings)
+    state = load_manifest(current_index_dir(persist_path))["faiss_index"]
+    assert state["spec"] == {"type": "flat"} and state["requested"] == ivf
+
+    # Nothing changed: the fallback is settled, no new version.
+    published = current_index_dir(persist_path)
+    _, report = sync_vectorstore(str(docs), persist_path, embeddings)
+    assert not report.changed and current_index_dir(persist_path) == published
+
+    write_files(docs, 5, 60)
+    _, report = sync_vectorstore(str(docs), persist_path, embeddings)
+    state = load_manifest(current_index_dir(persist_path))["faiss_index"]
+    assert report.index_rebuilt
+    assert state["spec"] == ivf and "requested" not in state and state["trained_on"] >= 39
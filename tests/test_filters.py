@@ -0,0 +1,88 @@
+"""Metadata filters: parsing, canonical keys, SQL matching and the no-match answer"""
+
+import asyncio
+
+import pytest
+from langchain_core.documents import Document
+
+from agent.chain import build_chain
+from agent.docstore import SQLiteDocstore
+from agent.embeddings import LocalEmbeddings
+from agent.fakes import FakeChatModel
+from agent.filters import filters_key, normalize_filters, parse_filters, query_scope
+from agent.vectorstore import open_current_index, sync_vectorstore
+
+
+def test_inline_terms_are_lifted_out_of_the_question():
+    question, filters = parse_filters('source:"structural heart" type:pdf,DOCX year:2019-2021 What was the AUC?')
+    assert question == "What was the AUC?"
+    assert filters == {"source": ["structural heart"], "file_type": ["pdf", "docx"], "year": [(2019, 2021)]}
+
+
+def test_a_term_that_is_not_a_filter_stays_in_the_question():
+    assert parse_filters("Summarize page:two of the study") == ("Summarize page:two of the study", {})
+    assert parse_filters("What is LDL-C?") == ("What is LDL-C?", {})
+
+
+def test_unknown_dict_filters_raise():
+    with pytest.raises(ValueError):
+        normalize_filters({"author": "Smith"})
+
+
+def test_query_scope_combines_dict_and_inline_filters():
+    question, filters = query_scope({"query": "page:3 What was measured?", "filter": {"doc": "ecg.pdf", "page": 2}})
+    assert question == "What was measured?"
+    assert filters == {"source": ["ecg.pdf"], "page": [(2, 2), (3, 3)]}
+
+
+def test_key_keeps_a_value_with_a_comma_apart_from_split_values():
+    joined = normalize_filters({"source": ["heart, lung"]})
+    split = normalize_filters({"source": ["heart", " lung"]})
+    assert filters_key(joined) != filters_key(split)
+
+
+def test_key_ignores_order_duplicates_and_aliases():
+    a = normalize_filters({"type": ["pdf", "docx", "pdf"], "year": ["2019-2021"]})
+    b = normalize_filters({"year": [(2019, 2021)], "file_type": [".DOCX", "pdf"]})
+    assert filters_key(a) == filters_key(b)
+    assert hash(filters_key(a)) == hash(filters_key(b))
+
+
+def test_like_wildcards_in_values_match_literally(tmp_path):
+    store = SQLiteDocstore(str(tmp_path / "docstore.sqlite"))
+    for i, source in enumerate(["ecg_v2.pdf", "ecgxv2.pdf", "100%_fiber.txt", "100 fiber.txt"]):
+        store.add({f"c{i}": Document(page_content="text", metadata={"source": source})})
+
+    assert store.ids_matching(normalize_filters({"source": "ecg_v"})) == ["c0"]
+    assert store.ids_matching(normalize_filters({"source": "100%"})) == ["c2"]
+    assert sorted(store.ids_matching(normalize_filters({"source": "ecg"}))) == ["c0", "c1"]
+
+
+@pytest.fixture
+def chain(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "ecg.txt").write_text("An AI model read electrocardiograms and detected structural heart disease.")
+    (docs / "diet.txt").write_text("A low-fibre diet was associated with high-risk coronary plaque.")
+    embeddings = LocalEmbeddings(64)
+    sync_vectorstore(str(docs), str(tmp_path / "idx"), embeddings)
+    _, vectorstore, lexical = open_current_index(str(tmp_path / "idx"), embeddings)
+    return build_chain(vectorstore, llm=FakeChatModel(), lexical_index=lexical)
+
+
+def test_a_filter_matching_nothing_skips_the_llm(chain):
+    response = chain.invoke("source:missing.pdf What was the AUC?")
+    assert response["no_match"] is True
+    assert "source:missing.pdf" in response["result"]
+    events = list(chain.stream({"query": "What was the AUC?", "filter": {"year": 1990}}))
+    assert events[-1]["no_match"] is True
+    assert [e["type"] for e in events] == ["retrieval", "done"]
+    assert chain.llm.calls == 0
+
+
+def test_a_filter_matching_something_answers_from_it(chain):
+    response = asyncio.run(chain.ainvoke("source:diet What was associated with plaque?"))
+    assert "no_match" not in response
+    assert response["result"].startswith("A low-fibre diet")
+    assert chain.llm.calls == 1
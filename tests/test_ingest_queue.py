@@ -0,0 +1,70 @@
+"""Background ingestion: skipping known content, writing uploads and publishing an index"""
+
+import time
+
+import pytest
+
+from agent.embeddings import LocalEmbeddings
+from agent.ingest_queue import IngestQueue
+from agent.vectorstore import indexed_files
+
+
+def wait(job, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not job.finished:
+        assert time.monotonic() < deadline, f"job still {job.status}"
+        time.sleep(0.01)
+    return job
+
+
+@pytest.fixture
+def ingest(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "ecg.txt").write_text("An AI model read electrocardiograms and detected structural heart disease.")
+    return IngestQueue(str(docs), str(tmp_path / "idx"), LocalEmbeddings(64))
+
+
+def test_uploads_are_written_and_indexed(ingest, tmp_path):
+    job = wait(ingest.submit([("uploads/diet.txt", b"A low-fibre diet was associated with coronary plaque.")]))
+
+    assert job.status == "done", job.error
+    assert job.written == ["diet.txt"]
+    assert job.fraction == 1.0 and job.payload == {}
+    assert job.report.chunks_added > 0
+    assert (tmp_path / "docs" / "diet.txt").read_bytes().startswith(b"A low-fibre diet")
+    assert sorted(indexed_files(ingest.persist_path)) == ["diet.txt", "ecg.txt"]
+    assert not [p.name for p in (tmp_path / "docs").iterdir() if p.name.startswith(".")]
+
+
+def test_known_content_and_unsupported_files_are_skipped(ingest, tmp_path):
+    ecg = (tmp_path / "docs" / "ecg.txt").read_bytes()
+    job = wait(ingest.submit([("ecg.txt", ecg), ("copy.txt", ecg), ("notes.xlsx", b"cells")]))
+
+    assert job.status == "done"
+    assert job.written == [] and job.report is None
+    assert job.skipped == {"ecg.txt": "unchanged", "copy.txt": "same content as ecg.txt",
+                           "notes.xlsx": "unsupported file type"}
+    assert sorted(p.name for p in (tmp_path / "docs").iterdir()) == ["ecg.txt"]
+
+
+def test_a_failed_sync_fails_the_job_and_the_worker_keeps_going(ingest, monkeypatch):
+    from agent import vectorstore
+
+    real_sync = vectorstore.sync_vectorstore
+
+    def broken_sync(*args, **kwargs):
+        raise RuntimeError("embedding service down")
+
+    monkeypatch.setattr(vectorstore, "sync_vectorstore", broken_sync)
+    failed = wait(ingest.submit([("diet.txt", b"A low-fibre diet was associated with coronary plaque.")]))
+    assert failed.status == "failed"
+    assert failed.error == "RuntimeError: embedding service down"
+    assert failed.finished_at is not None
+
+    monkeypatch.setattr(vectorstore, "sync_vectorstore", real_sync)
+    job = wait(ingest.submit([("labs.txt", b"NT-proBNP was ordered for heart failure follow-up.")]))
+    assert job.status == "done", job.error
+    assert [j.id for j in ingest.jobs()] == [job.id, failed.id]
+    assert ingest.active() == []
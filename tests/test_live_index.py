@@ -0,0 +1,78 @@
+"""LiveChain: swapping to newly published index versions"""
+
+import pytest
+
+from agent.embeddings import LocalEmbeddings
+from agent.live_index import LiveChain
+from agent.vectorstore import current_index_dir, sync_vectorstore
+
+
+class Built:
+    """Stands in for a chain; remembers what it was built over."""
+
+    def __init__(self, vectorstore, lexical):
+        self.vectorstore = vectorstore
+        self.lexical = lexical
+
+    def invoke(self, query):
+        return {"query": query, "chunks": len(self.lexical)}
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "ecg.txt").write_text("An AI model read electrocardiograms and detected structural heart disease.")
+    embeddings = LocalEmbeddings(64)
+    persist_path = str(tmp_path / "idx")
+    sync_vectorstore(str(docs), persist_path, embeddings, open_index=False)
+
+    def add(name, text):
+        (docs / name).write_text(text)
+        sync_vectorstore(str(docs), persist_path, embeddings, open_index=False)
+
+    return persist_path, embeddings, add
+
+
+def test_a_new_version_is_swapped_in(corpus):
+    persist_path, embeddings, add = corpus
+    live = LiveChain(persist_path, Built, embeddings, poll_interval=0)
+    first_version, first_chain = live.current_version(), live.chain
+    assert live.refresh() is False
+    assert live.invoke("q") == {"query": "q", "chunks": 1}
+
+    add("diet.txt", "A low-fibre diet was associated with coronary plaque.")
+    assert live.invoke("q") == {"query": "q", "chunks": 2}
+    assert live.swaps == 1
+    assert live.index_dir == current_index_dir(persist_path)
+    assert live.current_version() != first_version
+    assert first_chain.invoke("q") == {"query": "q", "chunks": 1}  # calls in flight keep their index
+
+
+def test_the_pointer_is_checked_at_most_every_poll_interval(corpus):
+    persist_path, embeddings, add = corpus
+    live = LiveChain(persist_path, Built, embeddings, poll_interval=3600)
+    add("diet.txt", "A low-fibre diet was associated with coronary plaque.")
+    assert live.invoke("q")["chunks"] == 1
+    assert live.swaps == 0
+    assert live.refresh() is True
+    assert live.invoke("q")["chunks"] == 2
+
+
+def test_a_version_that_fails_to_load_leaves_the_old_one_serving(corpus):
+    persist_path, embeddings, add = corpus
+    builds = []
+
+    def build(vectorstore, lexical):
+        builds.append(lexical)
+        if len(builds) > 1:
+            raise RuntimeError("out of memory")
+        return Built(vectorstore, lexical)
+
+    live = LiveChain(persist_path, build, embeddings, poll_interval=0)
+    old_dir = live.index_dir
+    add("diet.txt", "A low-fibre diet was associated with coronary plaque.")
+    assert live.refresh() is False
+    assert live.index_dir == old_dir
+    assert live.invoke("q")["chunks"] == 1
@@ -0,0 +1,83 @@
+"""BM25 index, reciprocal rank fusion and the hybrid retriever"""
+
+import pytest
+
+from agent.embeddings import LocalEmbeddings
+from agent.lexical import BM25Index, tokenize
+from agent.retrieval import HybridRetriever, reciprocal_rank_fusion
+from agent.vectorstore import open_current_index, sync_vectorstore
+
+DOCS = {
+    "ecg.txt": "An AI model read electrocardiograms and detected structural heart disease with an AUC of 0.91.",
+    "diet.txt": "A low-fibre diet was associated with high-risk coronary plaque in middle-aged adults.",
+    "labs.txt": "NT-proBNP and HbA1c were the laboratory tests most often ordered for heart failure follow-up.",
+}
+
+
+def test_tokenize_keeps_clinical_terms_whole_and_split():
+    assert tokenize("What is the NT-proBNP of the patient?") == ["nt-probnp", "nt", "probnp", "patient"]
+
+
+def test_bm25_ranks_and_restricts():
+    index = BM25Index()
+    for name, text in DOCS.items():
+        index.add(name, text)
+    assert index.search("fibre diet plaque", k=1)[0][0] == "diet.txt"
+    assert {doc_id for doc_id, _ in index.search("heart", k=3)} == {"ecg.txt", "labs.txt"}
+    assert [doc_id for doc_id, _ in index.search("heart", ids=["labs.txt"])] == ["labs.txt"]
+    index.remove("diet.txt")
+    assert index.search("fibre diet plaque") == []
+    assert len(index) == 2
+
+
+def test_bm25_save_and_load(tmp_path):
+    index = BM25Index()
+    for name, text in DOCS.items():
+        index.add(name, text)
+    path = str(tmp_path / "lexical.json")
+    index.save(path)
+    assert BM25Index.load(path).search("NT-proBNP") == index.search("NT-proBNP")
+    assert len(BM25Index.load(str(tmp_path / "missing.json"))) == 0
+
+
+def test_rrf_rewards_agreement():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "a"], ["b", "d"]])
+    assert fused[0] == "b"
+    assert set(fused) == {"a", "b", "c", "d"}
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for name, text in DOCS.items():
+        (docs / name).write_text(text)
+    embeddings = LocalEmbeddings(64)
+    sync_vectorstore(str(docs), str(tmp_path / "idx"), embeddings)
+    _, vectorstore, lexical = open_current_index(str(tmp_path / "idx"), embeddings)
+    return vectorstore, lexical
+
+
+def sources(docs):
+    return [doc.metadata["source"] for doc in docs]
+
+
+def test_hybrid_retrieval_and_filters(index):
+    vectorstore, lexical = index
+    retriever = HybridRetriever(vectorstore=vectorstore, lexical=lexical, k=2, mode="hybrid")
+    assert sources(retriever.invoke("low-fibre diet plaque"))[0] == "diet.txt"
+    assert sources(retriever.invoke("heart", filter={"source": "labs"})) == ["labs.txt"]
+    assert retriever.invoke("heart", filter={"source": "missing"}) == []
+
+
+def test_dense_failure_falls_back_to_bm25(index):
+    vectorstore, lexical = index
+
+    class Broken(LocalEmbeddings):
+        def embed_query(self, text):
+            raise ConnectionError("embeddings are down")
+
+    vectorstore.embedding_function = Broken(64)
+    retriever = HybridRetriever(vectorstore=vectorstore, lexical=lexical, k=1, mode="hybrid")
+    assert sources(retriever.invoke("NT-proBNP HbA1c")) == ["labs.txt"]
@@ -0,0 +1,168 @@
+"""QueryService coalescing and admission control, over a fake chain"""
+
+import asyncio
+
+import pytest
+
+from agent.answer_cache import AnswerCache, CachedQAChain
+from agent.service import QueryService, ServiceOverloadedError
+
+
+class GatedChain:
+    """ainvoke() waits for release; counts calls and the peak concurrency."""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.calls = 0
+        self.running = 0
+        self.peak = 0
+
+    async def ainvoke(self, question):
+        self.calls += 1
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await self.release.wait()
+        finally:
+            self.running -= 1
+        return {"query": question, "result": f"answer to {question}"}
+
+
+def test_identical_queries_share_one_call():
+    async def scenario():
+        chain = GatedChain()
+        service = QueryService(chain, max_concurrency=4)
+        tasks = [asyncio.create_task(service.aquery(q))
+                 for q in ("What is HbA1c?", "what is hba1c", "  What is  HbA1c ")]
+        await asyncio.sleep(0)
+        chain.release.set()
+        return chain, service, await asyncio.gather(*tasks)
+
+    chain, service, results = asyncio.run(scenario())
+    assert chain.calls == 1
+    assert all(r is results[0] for r in results)
+    assert service.stats()["coalesced"] == 2
+    assert service.stats()["in_flight"] == 0
+
+
+def test_coalesced_callers_see_the_error():
+    class Failing:
+        async def ainvoke(self, question):
+            await asyncio.sleep(0.01)
+            raise RuntimeError("boom")
+
+    async def scenario():
+        service = QueryService(Failing())
+        return service, await asyncio.gather(service.aquery("q"), service.aquery("Q?"),
+                                             return_exceptions=True)
+
+    service, results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert service.stats()["errors"] == 1
+
+
+def test_concurrency_is_bounded():
+    async def scenario():
+        chain = GatedChain()
+        service = QueryService(chain, max_concurrency=2, max_pending=10)
+        tasks = [asyncio.create_task(service.aquery(f"question {i}")) for i in range(6)]
+        await asyncio.sleep(0.01)
+        running = service.stats()["running"]
+        chain.release.set()
+        await asyncio.gather(*tasks)
+        return chain, service, running
+
+    chain, service, running = asyncio.run(scenario())
+    assert running == 2
+    assert chain.peak == 2
+    assert service.stats()["completed"] == 6
+
+
+def test_overload_is_rejected_after_admission_timeout():
+    async def scenario():
+        chain = GatedChain()
+        service = QueryService(chain, max_concurrency=1, max_pending=2, admission_timeout=0.05)
+        admitted = [asyncio.create_task(service.aquery(f"question {i}")) for i in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(ServiceOverloadedError):
+            await service.aquery("one too many")
+        chain.release.set()
+        await asyncio.gather(*admitted)
+        return service
+
+    stats = asyncio.run(scenario()).stats()
+    assert stats["rejected"] == 1
+    assert stats["completed"] == 2
+
+
+def test_cached_chain_astream_answers_repeats_from_the_cache():
+    class StreamingChain:
+        calls = 0
+
+        async def astream(self, query):
+            self.calls += 1
+            yield {"type": "token", "text": "an answer"}
+            yield {"type": "done", "result": "an answer", "timings": {"total": 0.0}}
+
+    async def collect(chain, query):
+        return [event async for event in chain.astream(query)]
+
+    inner = StreamingChain()
+    chain = CachedQAChain(inner, AnswerCache())
+    first = asyncio.run(collect(chain, "What is HbA1c?"))
+    second = asyncio.run(collect(chain, "what is hba1c"))
+    assert [e["type"] for e in first] == ["token", "done"]
+    assert first[-1]["cached"] is False
+    assert second == [second[-1]] and second[-1]["cached"] is True
+    assert second[-1]["result"] == "an answer"
+    assert inner.calls == 1
+
+
+def test_cancelling_the_first_caller_keeps_followers_waiting():
+    async def scenario():
+        chain = GatedChain()
+        service = QueryService(chain)
+        leader = asyncio.create_task(service.aquery("What is HbA1c?"))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(service.aquery("what is hba1c"))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        chain.release.set()
+        return chain, service, leader, await follower
+
+    chain, service, leader, result = asyncio.run(scenario())
+    assert leader.cancelled()
+    assert result["result"] == "answer to What is HbA1c?"
+    assert chain.calls == 1
+    assert service.stats()["completed"] == 1
+
+
+def test_cancelling_every_caller_cancels_the_chain_call():
+    async def scenario():
+        chain = GatedChain()
+        service = QueryService(chain)
+        callers = [asyncio.create_task(service.aquery("q")) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        running, in_flight = chain.running, service.stats()["in_flight"]
+        # A new caller starts a fresh chain call rather than joining the cancelled one.
+        retry = asyncio.create_task(service.aquery("q"))
+        await asyncio.sleep(0)
+        chain.release.set()
+        return chain, running, in_flight, await retry
+
+    chain, running, in_flight, result = asyncio.run(scenario())
+    assert (running, in_flight) == (0, 0)
+    assert chain.calls == 2
+    assert result["result"] == "answer to q"
+
+
+def test_admission_wait_is_bounded_by_default():
+    from agent.config import SERVICE_ADMISSION_TIMEOUT
+
+    assert QueryService(GatedChain()).admission_timeout == SERVICE_ADMISSION_TIMEOUT > 0
+    assert QueryService(GatedChain(), admission_timeout=0).admission_timeout is None
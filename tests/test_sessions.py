@@ -0,0 +1,70 @@
+"""SessionStore: owner isolation, ordering, message windows and old databases"""
+
+import itertools
+import sqlite3
+
+import pytest
+
+from agent import sessions
+from agent.sessions import SessionStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr(sessions.time, "time", lambda: float(next(clock)))
+    store = SessionStore(str(tmp_path / "sessions.sqlite"))
+    yield store
+    store.close()
+
+
+def test_owners_only_see_their_own_sessions(store):
+    alice = store.create("Alice's chat", owner="alice")
+    bob = store.create("Bob's chat", owner="bob")
+
+    assert store.get(alice["id"], owner="alice") == alice
+    assert store.get(alice["id"], owner="bob") is None
+    assert store.get(alice["id"], owner="") is None
+    assert store.get(alice["id"]) == alice  # no owner given: internal lookups
+
+    assert [s["id"] for s in store.list_sessions(owner="alice")] == [alice["id"]]
+    assert store.latest(owner="bob")["id"] == bob["id"]
+    assert store.latest(owner="carol") is None
+    assert (store.count(owner="alice"), store.count(owner="bob"), store.count()) == (1, 1, 0)
+
+
+def test_sessions_are_listed_most_recently_used_first(store):
+    first, second, third = (store.create(f"chat {i}", owner="alice") for i in range(3))
+    store.add_message(first["id"], "user", "hello again")
+
+    assert [s["id"] for s in store.list_sessions(owner="alice")] == [first["id"], third["id"], second["id"]]
+    assert [s["id"] for s in store.list_sessions(offset=1, limit=1, owner="alice")] == [third["id"]]
+    assert store.latest(owner="alice")["message_count"] == 1
+
+
+def test_messages_are_read_a_window_at_a_time(store):
+    session = store.create(owner="alice")
+    for i in range(5):
+        store.add_message(session["id"], "user" if i % 2 == 0 else "assistant", f"message {i}", sources=[i])
+
+    latest = store.messages(session["id"], limit=2)
+    assert [(m["seq"], m["content"], m["sources"]) for m in latest] == [(3, "message 3", [3]), (4, "message 4", [4])]
+    assert [m["seq"] for m in store.messages(session["id"], limit=10, before=latest[0]["seq"])] == [0, 1, 2]
+    with pytest.raises(KeyError):
+        store.add_message("chat_missing", "user", "hello")
+
+
+def test_sessions_from_before_owners_belong_to_the_anonymous_owner(tmp_path):
+    path = str(tmp_path / "sessions.sqlite")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE sessions (id TEXT PRIMARY KEY, title TEXT NOT NULL, created_at TEXT NOT NULL,"
+               " updated REAL NOT NULL, message_count INTEGER NOT NULL DEFAULT 0)")
+    db.execute("INSERT INTO sessions VALUES ('chat_old', 'Old chat', '2024-01-01 09:00', 1.0, 0)")
+    db.commit()
+    db.close()
+
+    store = SessionStore(path)
+    assert store.get("chat_old", owner="")["title"] == "Old chat"
+    assert store.get("chat_old", owner="alice") is None
+    assert store.count(owner="alice") == 0
+    store.close()
@@ -0,0 +1,28 @@
+"""Cold-start profiling CLI"""
+
+import json
+import os
+import subprocess
+import sys
+
+from agent.embeddings import get_embedding_backend
+from agent.vectorstore import sync_vectorstore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_fake_profile_needs_no_api_key(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.txt").write_text("Troponin and HbA1c predict cardiac events in adults. " * 20)
+    persist_path = str(tmp_path / "idx")
+    sync_vectorstore(str(docs), persist_path, get_embedding_backend("local"))
+
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    env.update(PYTHONPATH=ROOT, EMBEDDING_BACKEND="openai", TIKTOKEN_ENCODING="approx")
+    proc = subprocess.run([sys.executable, "-m", "agent.startup", persist_path, "--fake"], cwd=str(tmp_path),
+                          env=env, capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 0, proc.stderr
+    profile = json.loads(proc.stdout)
+    assert {"index_load", "chain_build"} <= set(profile["stages"])
+    assert "ready" in profile["marks"]
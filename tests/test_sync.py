@@ -0,0 +1,81 @@
+"""Incremental sync: near-duplicate chunks survive their owner's removal"""
+
+import os
+
+import pytest
+
+from agent.embeddings import LocalEmbeddings
+from agent.vectorstore import indexed_files, open_current_index, sync_vectorstore
+
+TEXT = ("Elevated troponin after exercise predicts adverse cardiac events in adults with "
+        "stable angina, independent of age, blood pressure and HbA1c; patients with "
+        "persistent elevation were referred for echocardiography within two weeks. ") * 3
+OTHER = ("Sodium restriction lowered systolic pressure in the treatment group, while "
+         "the control group showed no change in edema or dyspnea at follow-up. ") * 3
+
+
+def write(folder, name, text):
+    with open(os.path.join(folder, name), "w") as f:
+        f.write(text)
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    write(docs, "owner.txt", TEXT)
+    write(docs, "copy.txt", TEXT)
+    write(docs, "other.txt", OTHER)
+    return str(docs), str(tmp_path / "idx"), LocalEmbeddings(64)
+
+
+def sources(persist_path, embeddings):
+    _, vectorstore, _ = open_current_index(persist_path, embeddings)
+    docs = vectorstore.docstore.mget(list(vectorstore.index_to_docstore_id.values()))
+    return sorted(sorted(d.metadata["sources"]) for d in docs)
+
+
+def test_duplicate_points_at_owner(corpus):
+    docs, persist_path, embeddings = corpus
+    _, report = sync_vectorstore(docs, persist_path, embeddings)
+    files = indexed_files(persist_path)
+    owner, copy = sorted(("owner.txt", "copy.txt"), key=lambda f: bool(files[f]["ids"]), reverse=True)
+    assert report.duplicates_collapsed >= 1
+    assert files[copy]["ids"] == [] and files[copy]["duplicate_of"] == files[owner]["ids"]
+    assert ["copy.txt", "owner.txt"] in sources(persist_path, embeddings)
+
+
+def test_removing_owner_reindexes_its_duplicates(corpus):
+    docs, persist_path, embeddings = corpus
+    sync_vectorstore(docs, persist_path, embeddings)
+    files = indexed_files(persist_path)
+    owner = "owner.txt" if files["owner.txt"]["ids"] else "copy.txt"
+    survivor = "copy.txt" if owner == "owner.txt" else "owner.txt"
+
+    os.remove(os.path.join(docs, owner))
+    _, report = sync_vectorstore(docs, persist_path, embeddings)
+
+    assert report.removed == [owner]
+    assert report.updated == [survivor]
+    assert report.unchanged == ["other.txt"]
+    files = indexed_files(persist_path)
+    assert owner not in files
+    assert files[survivor]["ids"] and files[survivor]["duplicate_of"] == []
+    assert sources(persist_path, embeddings) == sorted([["other.txt"]] + [[survivor]] * len(files[survivor]["ids"]))
+
+
+def test_removing_a_duplicate_only_drops_its_source(corpus):
+    docs, persist_path, embeddings = corpus
+    sync_vectorstore(docs, persist_path, embeddings)
+    files = indexed_files(persist_path)
+    copy = "copy.txt" if not files["copy.txt"]["ids"] else "owner.txt"
+    owner = "owner.txt" if copy == "copy.txt" else "copy.txt"
+
+    os.remove(os.path.join(docs, copy))
+    _, report = sync_vectorstore(docs, persist_path, embeddings)
+
+    assert report.removed == [copy]
+    assert report.updated == [] and report.chunks_deleted == 0
+    assert indexed_files(persist_path)[owner]["ids"] == files[owner]["ids"]
+    assert sources(persist_path, embeddings) == sorted([["other.txt"]] + [[owner]] * len(files[owner]["ids"]))
@@ -0,0 +1,51 @@
+"""Versioned index directories: publishing and cleanup of failed builds"""
+
+import os
+
+import pytest
+
+from agent import vectorstore
+from agent.embeddings import LocalEmbeddings
+from agent.vectorstore import VERSIONS_DIR, current_index_dir, sync_vectorstore
+
+
+@pytest.fixture
+def synced(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.txt").write_text("Troponin predicts cardiac events in adults with stable angina. " * 10)
+    persist_path = str(tmp_path / "idx")
+    embeddings = LocalEmbeddings(32)
+    sync_vectorstore(str(docs), persist_path, embeddings)
+    return docs, persist_path, embeddings
+
+
+def versions(persist_path):
+    return sorted(os.listdir(os.path.join(persist_path, VERSIONS_DIR)))
+
+
+def test_failed_build_leaves_no_version_behind(synced, monkeypatch):
+    docs, persist_path, embeddings = synced
+    published = current_index_dir(persist_path)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("embedding service exploded")
+
+    monkeypatch.setattr(vectorstore, "_add_chunks", fail)
+    (docs / "b.txt").write_text("A low-fibre diet was associated with high-risk coronary plaque. " * 10)
+    with pytest.raises(RuntimeError):
+        sync_vectorstore(str(docs), persist_path, embeddings)
+    assert current_index_dir(persist_path) == published
+    assert versions(persist_path) == [os.path.basename(published)]
+
+
+def test_next_sync_removes_leftovers_of_a_killed_build(synced):
+    docs, persist_path, embeddings = synced
+    published = os.path.basename(current_index_dir(persist_path))
+    root = os.path.join(persist_path, VERSIONS_DIR)
+    os.makedirs(os.path.join(root, "0000000000001-1"))  # an older version some replica may still serve
+    os.makedirs(os.path.join(root, "9999999999999-1"))  # a build that never got published
+    _, report = sync_vectorstore(str(docs), persist_path, embeddings)
+    assert not report.changed
+    assert versions(persist_path) == ["0000000000001-1", published]